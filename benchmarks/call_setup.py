@@ -0,0 +1,129 @@
+"""
+Measures how long it takes from ofono announcing a call to the MM Call
+object being announced with CallAdded, for incoming and outgoing calls.
+
+Usage, from the top of the source tree:
+
+python3 benchmarks/call_setup.py [--calls 1000]
+
+The voice interface runs against a fake ofono client, so this measures
+ofono2mm itself, not D-Bus or the modem.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from dbus_next import Variant
+
+from ofono2mm.mm_modem_voice import MMModemVoiceInterface
+
+from argparse import ArgumentParser
+
+import asyncio
+import time
+
+class FakeSignals:
+    def subscribe(self, path, interface, member, handler):
+        pass
+
+    def unsubscribe(self, path, interface, member, handler):
+        pass
+
+class FakeOfonoClient:
+    signals = FakeSignals()
+
+    def __getitem__(self, key):
+        return self
+
+    def evict(self, path, interface, signals=True):
+        pass
+
+class FakeObjectManager:
+    def export(self, path, interface):
+        pass
+
+    def unexport(self, path, interface=None):
+        pass
+
+class FakeModem:
+    object_manager = FakeObjectManager()
+    ofono_client = FakeOfonoClient()
+    ofono_interfaces = {}
+
+    async def wait_for_ofono_interface(self, iface, timeout=None):
+        return True
+
+class FakeVoiceCallManager:
+    """
+    Answers Dial the way ofono does: CallAdded first, then the reply.
+    """
+
+    def __init__(self):
+        self.voice = None
+        self.i = 0
+        self.announced = {}
+
+    async def call_dial(self, number, hide_callerid):
+        self.i += 1
+        path = f'/ril_0/voicecall{self.i:02}'
+        self.announced[path] = time.perf_counter()
+        self.voice.add_call(path, {
+            'State': Variant('s', 'dialing'),
+            'LineIdentification': Variant('s', number),
+            'Multiparty': Variant('b', False),
+        })
+        return path
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+def report(name, latencies):
+    print(f"{name}: {len(latencies)} calls, p50 {percentile(latencies, 50) * 1e6:.1f} us, "
+          f"p99 {percentile(latencies, 99) * 1e6:.1f} us, max {max(latencies) * 1e6:.1f} us")
+
+async def run(calls):
+    manager = FakeVoiceCallManager()
+    voice = MMModemVoiceInterface(0, None, FakeOfonoClient(), '/ril_0', None, {},
+                                  {'org.ofono.VoiceCallManager': manager}, {}, FakeModem())
+    manager.voice = voice
+    await voice.init_calls()
+
+    incoming = []
+    for i in range(calls):
+        path = f'/ril_0/incoming{i}'
+        start = time.perf_counter()
+        voice.add_call(path, {
+            'State': Variant('s', 'incoming'),
+            'LineIdentification': Variant('s', '+4912345678'),
+            'Multiparty': Variant('b', False),
+        })
+        incoming.append(time.perf_counter() - start)
+        await voice.remove_call(path)
+        # Let the call pool refill, as it would between two real calls
+        await asyncio.sleep(0)
+
+    outgoing = []
+    for i in range(calls):
+        start = time.perf_counter()
+        mm_path = await voice.CreateCall.__wrapped__(voice, {'number': Variant('s', '+4912345678')})
+        outgoing.append(time.perf_counter() - start)
+        await voice.remove_call(voice.mm_to_ofono_calls[mm_path])
+        await asyncio.sleep(0)
+
+    voice.data_restore.cancel()
+
+    report("ofono CallAdded to MM CallAdded", incoming)
+    report("CreateCall to MM CallAdded", outgoing)
+
+def main():
+    parser = ArgumentParser(description="Call setup latency of ofono2mm.")
+    parser.add_argument('--calls', type=int, default=1000, help='Number of calls in each direction.')
+    args = parser.parse_args()
+
+    asyncio.run(run(args.calls))
+
+if __name__ == '__main__':
+    main()
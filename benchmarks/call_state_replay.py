@@ -0,0 +1,134 @@
+"""
+Replays ofono VoiceCall state sequences through MMCallInterface, checks
+the StateChanged and PropertiesChanged signals they produce against the
+expected ones and reports how fast the transitions are applied.
+
+Usage, from the top of the source tree:
+
+python3 benchmarks/call_state_replay.py [--rounds 10000]
+
+Every sequence step is (call, ofono property, ofono value, expected
+StateChanged arguments or None, expected PropertiesChanged or None).
+Calls start in the state ofono announced them with, as in CallAdded.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from dbus_next import Variant
+
+from ofono2mm.mm_call import MMCallInterface
+from ofono2mm.mm_types import OFONO_CALL_STATES
+
+from argparse import ArgumentParser
+
+import time
+
+SEQUENCES = {
+    'incoming answered': (
+        {'a': 'incoming'},
+        [
+            ('a', 'State', 'active', (3, 4, 3), {'State': 4, 'StateReason': 3}),
+            ('a', 'State', 'disconnected', (4, 7, 4), {'State': 7, 'StateReason': 4}),
+        ],
+    ),
+    'outgoing answered': (
+        {'a': 'dialing'},
+        [
+            ('a', 'State', 'alerting', (1, 2, 1), {'State': 2, 'StateReason': 1}),
+            # Repeated by some RILs, nothing to tell
+            ('a', 'State', 'alerting', None, None),
+            ('a', 'State', 'active', (2, 4, 3), {'State': 4, 'StateReason': 3}),
+            ('a', 'State', 'disconnected', (4, 7, 4), {'State': 7, 'StateReason': 4}),
+        ],
+    ),
+    'outgoing refused': (
+        {'a': 'dialing'},
+        [
+            ('a', 'State', 'alerting', (1, 2, 1), {'State': 2, 'StateReason': 1}),
+            ('a', 'State', 'disconnected', (2, 7, 5), {'State': 7, 'StateReason': 5}),
+        ],
+    ),
+    'waiting call swapped with held one': (
+        {'a': 'active', 'b': 'waiting'},
+        [
+            ('a', 'State', 'held', (4, 5, 0), {'State': 5, 'StateReason': 0}),
+            ('b', 'State', 'active', (6, 4, 3), {'State': 4, 'StateReason': 3}),
+            ('b', 'State', 'held', (4, 5, 0), {'State': 5, 'StateReason': 0}),
+            ('a', 'State', 'active', (5, 4, 0), {'State': 4, 'StateReason': 0}),
+            ('a', 'Multiparty', True, None, {'Multiparty': True}),
+            ('b', 'Multiparty', True, None, {'Multiparty': True}),
+            ('b', 'State', 'active', (5, 4, 0), {'State': 4, 'StateReason': 0}),
+            ('a', 'State', 'disconnected', (4, 7, 4), {'State': 7, 'StateReason': 4}),
+            ('b', 'Multiparty', False, None, {'Multiparty': False}),
+            ('b', 'State', 'disconnected', (4, 7, 4), {'State': 7, 'StateReason': 4}),
+        ],
+    ),
+}
+
+class FakeSignals:
+    def subscribe(self, path, interface, member, handler):
+        pass
+
+class FakeOfonoClient:
+    signals = FakeSignals()
+
+    def __getitem__(self, key):
+        return self
+
+def new_call(ofono_state, emissions):
+    mm_call_interface = MMCallInterface(0, None, FakeOfonoClient(), '/ril_0', None, {}, {}, {})
+    mm_call_interface.props.State, mm_call_interface.props.StateReason = OFONO_CALL_STATES[ofono_state]
+    mm_call_interface.StateChanged = lambda old, new, reason: emissions.append(('StateChanged', (old, new, reason)))
+    mm_call_interface.emit_properties_changed = lambda changed: emissions.append(('PropertiesChanged', changed))
+
+    return mm_call_interface
+
+def replay(name, check=True):
+    """
+    Replays one sequence, raising AssertionError on an unexpected signal
+    when check is True. Returns the number of steps replayed.
+    """
+
+    initial_states, steps = SEQUENCES[name]
+    emissions = []
+    calls = {call: new_call(ofono_state, emissions) for call, ofono_state in initial_states.items()}
+
+    for i, (call, prop, value, state_changed, properties_changed) in enumerate(steps):
+        del emissions[:]
+        calls[call].update_property(prop, Variant('b' if isinstance(value, bool) else 's', value))
+
+        if not check:
+            continue
+
+        expected = []
+        if state_changed is not None:
+            expected.append(('StateChanged', state_changed))
+        if properties_changed is not None:
+            expected.append(('PropertiesChanged', properties_changed))
+
+        assert emissions == expected, f"{name}, step {i} ({call} {prop} {value}): got {emissions}, expected {expected}"
+
+    return len(steps)
+
+def main():
+    parser = ArgumentParser(description="Call state transition replay of ofono2mm.")
+    parser.add_argument('--rounds', type=int, default=10000, help='Number of times every sequence is replayed.')
+    args = parser.parse_args()
+
+    for name in SEQUENCES:
+        replay(name)
+    print(f"{len(SEQUENCES)} sequences checked")
+
+    for name in SEQUENCES:
+        steps = 0
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            steps += replay(name, check=False)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {steps / elapsed:.0f} transitions/s, {elapsed / args.rounds * 1e6:.1f} us per sequence")
+
+if __name__ == '__main__':
+    main()
@@ -4,26 +4,39 @@ from dbus_next.aio import MessageBus
 from dbus_next.service import (ServiceInterface,
                                method, dbus_property)
 from dbus_next.constants import PropertyAccess
-from dbus_next import DBusError, BusType
+from dbus_next import BusType
 
 import asyncio
+import signal
 from argparse import ArgumentParser
 
-from ofono2mm import MMModemInterface, Ofono, DBus
+from ofono2mm import MMModemInterface, CachedClient, Ofono, OfonoReadiness, DBus
 from ofono2mm.logger import Logger
+from ofono2mm.mm_object_manager import MMObjectManager
+from ofono2mm.mm_service import MMServiceInterface
+from ofono2mm.snapshot import ModemSnapshot
+from ofono2mm.sms_store import SmsStore
+from ofono2mm.dtmf import DtmfQueue
 from ofono2mm.utils import async_locked
 
 has_bus = False
 
 class MMInterface(ServiceInterface):
-    def __init__(self, loop, bus):
+    def __init__(self, loop, bus, max_parallel_modems=4, snapshot=None, sms_store=None):
         super().__init__('org.freedesktop.ModemManager1')
         self.loop = loop
         self.bus = bus
+        self.snapshot = snapshot
+        self.sms_store = sms_store
+        self.modem_export_semaphore = asyncio.Semaphore(max_parallel_modems)
+        self.i = 0
         self.ofono_client = Ofono(bus)
         self.dbus_client = DBus(bus)
-        self.mm_modem_interfaces = []
-        self.mm_modem_objects = []
+        self.ofono_readiness = OfonoReadiness(self.ofono_client)
+        self.object_manager = MMObjectManager(bus)
+        self.ofono_manager_interface = None
+        self.mm_modem_indexes = {}
+        self.mm_modems = {}
         self.loop.create_task(self.check_ofono_presence())
 
     @dbus_property(access=PropertyAccess.READ)
@@ -48,45 +61,77 @@ class MMInterface(ServiceInterface):
 
     def ofono_added(self):
         self.ofono_manager_interface = self.ofono_client["ofono"]["/"]["org.ofono.Manager"]
-        self.ofono_manager_interface.on_modem_added(self.ofono_modem_added)
-        self.ofono_manager_interface.on_modem_removed(self.ofono_modem_removed)
+        self.ofono_client.signals.subscribe('/', 'org.ofono.Manager', 'ModemAdded', self.ofono_modem_added)
+        self.ofono_client.signals.subscribe('/', 'org.ofono.Manager', 'ModemRemoved', self.ofono_modem_removed)
+        self.ofono_readiness.ofono_added()
         self.loop.create_task(self.find_ofono_modems())
 
     def ofono_removed(self):
+        if self.ofono_manager_interface:
+            self.ofono_client.signals.unsubscribe('/', 'org.ofono.Manager', 'ModemAdded', self.ofono_modem_added)
+            self.ofono_client.signals.unsubscribe('/', 'org.ofono.Manager', 'ModemRemoved', self.ofono_modem_removed)
         self.ofono_manager_interface = None
+        self.ofono_readiness.ofono_removed()
 
     @async_locked
     async def find_ofono_modems(self):
-        global has_bus
+        if not self.ofono_manager_interface:
+            return
+
+        self.ofono_modem_list = await self.ofono_readiness.wait_for_modems(self.get_ofono_modems)
+        if self.ofono_modem_list is None:
+            return
+
+        # Only touch what changed: modems ofono no longer knows about are
+        # torn down, known ones keep their object paths and new ones are
+        # exported. Indexes are handed out in GetModems order before any
+        # modem starts initialising, so the object paths don't depend on
+        # which modem finishes first.
+        ofono_paths = [modem[0] for modem in self.ofono_modem_list]
+        for path in list(self.mm_modem_indexes):
+            if path not in ofono_paths:
+                self.remove_modem(path)
+
+        updates = []
+        for modem in self.ofono_modem_list:
+            if modem[0] in self.mm_modem_indexes:
+                updates.append(self.refresh_modem(modem[0], modem[1]))
+            else:
+                updates.append(self.export_new_modem(modem[0], modem[1], self.reserve_modem_index(modem[0])))
+
+        results = await asyncio.gather(*updates, return_exceptions=True)
+        for modem, result in zip(self.ofono_modem_list, results):
+            if isinstance(result, Exception):
+                Logger.error("Failed to export modem %s: %s", modem[0], result)
 
-        for mm_object in self.mm_modem_objects:
-            self.bus.unexport(mm_object)
+    def reserve_modem_index(self, path):
+        self.mm_modem_indexes[path] = self.i
+        self.i += 1
+        return self.mm_modem_indexes[path]
 
-        self.mm_modem_objects = []
-        self.mm_modem_intefaces = []
+    async def refresh_modem(self, path, mprops):
+        if path in self.mm_modems:
+            await self.mm_modems[path].refresh_ofono_props(mprops)
 
+    async def get_ofono_modems(self):
         if not self.ofono_manager_interface:
-            return
+            return []
 
-        self.ofono_modem_list = False
-        while not self.ofono_modem_list:
-            try:
-                self.ofono_modem_list = [
-                    x
-                    for x in await self.ofono_manager_interface.call_get_modems()
-                    if x[0].startswith("/ril_") or x[0].startswith("/phonesim") # FIXME
-                ]
-            except DBusError:
-                pass
+        return [
+            x
+            for x in await self.ofono_manager_interface.call_get_modems()
+            if self.is_supported_modem(x[0])
+        ]
 
-        self.i = 0
+    def is_supported_modem(self, path):
+        return path.startswith("/ril_") or path.startswith("/phonesim") # FIXME
 
-        for modem in self.ofono_modem_list:
-            await self.export_new_modem(modem[0], modem[1])
+    async def request_bus_name(self):
+        global has_bus
 
-        if not has_bus and len(self.mm_modem_objects) != 0:
-            await self.bus.request_name('org.freedesktop.ModemManager1')
+        if not has_bus:
             has_bus = True
+            await self.bus.request_name('org.freedesktop.ModemManager1')
 
     def dbus_name_owner_changed(self, name, old_owner, new_owner):
         if name == "org.ofono":
@@ -96,43 +141,86 @@ class MMInterface(ServiceInterface):
                 self.ofono_added()
 
     def ofono_modem_added(self, path, mprops):
+        if self.ofono_readiness.waiting:
+            # Discovery is still waiting for ofono, it will pick this modem up
+            self.ofono_readiness.poke()
+            return
+
+        if not self.is_supported_modem(path) or path in self.mm_modem_indexes:
+            return
+
         try:
-            self.loop.create_task(self.export_new_modem(path, props))
+            self.loop.create_task(self.export_new_modem(path, mprops, self.reserve_modem_index(path)))
         except Exception as e:
             pass
 
-    async def export_new_modem(self, path, mprops):
-        mm_modem_interface = MMModemInterface(self.loop, self.i, self.bus, self.ofono_client, path)
-        mm_modem_interface.ofono_props = mprops
-        self.ofono_client["ofono_modem"][path]['org.ofono.Modem'].on_property_changed(mm_modem_interface.ofono_changed)
+    async def export_new_modem(self, path, mprops, index):
+        mm_modem_interface = MMModemInterface(self.loop, index, self.bus, self.ofono_client, path, self.object_manager, self.snapshot, self.sms_store)
+
+        # Limit how many modems initialise at once, a wedged modem only
+        # holds up its own slot.
+        async with self.modem_export_semaphore:
+            try:
+                await self.init_new_modem(mm_modem_interface, mprops)
+            except Exception:
+                mm_modem_interface.teardown()
+                if self.mm_modem_indexes.get(path) == index:
+                    self.mm_modem_indexes.pop(path)
+                raise
+
+        if self.mm_modem_indexes.get(path) != index:
+            # The modem went away while it was being initialised
+            mm_modem_interface.teardown()
+            return
+
+        self.mm_modems[path] = mm_modem_interface
+
+        # Claim the bus name as soon as the first modem is usable
+        await self.request_bus_name()
+
+    async def init_new_modem(self, mm_modem_interface, mprops):
+        start = self.loop.time()
+        mm_modem_interface.ofono_state.update_modem(mprops)
+        self.ofono_client.signals.subscribe(mm_modem_interface.modem_name, 'org.ofono.Modem', 'PropertyChanged', mm_modem_interface.ofono_changed)
+
+        # With a snapshot of this modem at hand, publish it right away and
+        # reconcile with ofono once its interfaces have been read
+        warm_start = self.snapshot is not None and self.snapshot.has_modem(mm_modem_interface.modem_name)
+        if warm_start:
+            mm_modem_interface.hold_state()
+            mm_modem_interface.export_snapshot_sim()
+            self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{mm_modem_interface.index}', mm_modem_interface)
+            await self.request_bus_name()
+
         await mm_modem_interface.init_ofono_interfaces()
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.i}', mm_modem_interface)
+        ofono_interfaces_time = self.loop.time() - start
+        if not warm_start:
+            self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{mm_modem_interface.index}', mm_modem_interface)
+        mm_modem_interface.reconciled = True
         mm_modem_interface.set_props()
-        await mm_modem_interface.init_mm_sim_interface()
-        await mm_modem_interface.init_mm_3gpp_interface()
-        await mm_modem_interface.init_mm_3gpp_ussd_interface()
-        await mm_modem_interface.init_mm_3gpp_profile_manager_interface()
-        await mm_modem_interface.init_mm_messaging_interface()
-        await mm_modem_interface.init_mm_simple_interface()
-        await mm_modem_interface.init_mm_firmware_interface()
-        await mm_modem_interface.init_mm_time_interface()
-        await mm_modem_interface.init_mm_cdma_interface()
-        await mm_modem_interface.init_mm_sar_interface()
-        await mm_modem_interface.init_mm_oma_interface()
-        await mm_modem_interface.init_mm_signal_interface()
-        await mm_modem_interface.init_mm_location_interface()
-        await mm_modem_interface.init_mm_voice_interface()
-        self.mm_modem_interfaces.append(mm_modem_interface)
-        self.mm_modem_objects.append(f'/org/freedesktop/ModemManager1/Modem/{self.i}')
-        self.i += 1
+        timings = await mm_modem_interface.init_mm_interfaces()
+        timings['ofono_interfaces'] = ofono_interfaces_time
+
+        Logger.debug("Modem %s ready in %.1f ms", mm_modem_interface.modem_name, (self.loop.time() - start) * 1000)
+        for step, duration in sorted(timings.items(), key=lambda x: x[1], reverse=True):
+            Logger.debug("  %s: %.1f ms", step, duration * 1000)
+
+    def save_snapshot(self):
+        if not self.snapshot:
+            return
+
+        for mm_modem_interface in self.mm_modems.values():
+            mm_modem_interface.record_snapshot()
+        self.snapshot.save()
 
     def ofono_modem_removed(self, path):
-        for mm_object in self.mm_modem_objects:
-            try:
-                if mm_object.modem_name == path:
-                    self.bus.unexport(mm_object)
-            except Exception as e:
-                pass
+        self.remove_modem(path)
+
+    def remove_modem(self, path):
+        self.mm_modem_indexes.pop(path, None)
+        if path in self.mm_modems:
+            Logger.info("Modem %s removed", path)
+            self.mm_modems.pop(path).teardown()
 
     @method()
     def SetLogging(self, level: 's'):
@@ -150,6 +238,13 @@ async def main():
     parser = ArgumentParser(description="oFono2MM.", add_help=False)
     parser.add_argument('-d', '--debug', action='store_true', help='Enable debug messages.')
     parser.add_argument('-h', '--help', action='store_true', help='Show help.')
+    parser.add_argument('--max-parallel-modems', type=int, default=4, help='Maximum number of modems initialised at the same time.')
+    parser.add_argument('--introspection-cache', default='/var/cache/ofono2mm/introspection.json', help='File keeping the parsed ofono introspection data, empty to disable.')
+    parser.add_argument('--snapshot', default='/var/lib/ofono2mm/snapshot.json', help='File keeping the last-known modem properties across restarts, empty to disable.')
+    parser.add_argument('--sms-store', default='/var/lib/ofono2mm/sms.db', help='Database keeping the SMS messages across restarts, empty to disable.')
+    parser.add_argument('--dtmf-tone-ms', type=int, default=100, help='Time given to every DTMF tone before the next batch of tones is sent.')
+    parser.add_argument('--dtmf-pause-ms', type=int, default=50, help='Pause after every DTMF tone before the next batch of tones is sent.')
+    parser.add_argument('--coalesce-ms', type=int, default=20, help='Window in which property changes are merged into one PropertiesChanged signal, 0 for one loop iteration, negative to disable.')
 
     args = parser.parse_args()
 
@@ -158,11 +253,46 @@ async def main():
         return
 
     Logger.DEBUG = args.debug
+    CachedClient.INTROSPECTION_CACHE = args.introspection_cache
+    MMServiceInterface.COALESCE_WINDOW = args.coalesce_ms / 1000
+    DtmfQueue.TONE_DURATION = max(0, args.dtmf_tone_ms) / 1000
+    DtmfQueue.PAUSE_DURATION = max(0, args.dtmf_pause_ms) / 1000
+
+    snapshot = None
+    if args.snapshot:
+        snapshot = ModemSnapshot(args.snapshot)
+        snapshot.load()
+
+    sms_store = None
+    if args.sms_store:
+        sms_store = SmsStore(args.sms_store)
+        sms_store.open()
 
     bus = await MessageBus(bus_type=BusType.SYSTEM).connect()
     loop = asyncio.get_running_loop()
-    mm_manager_interface = MMInterface(loop, bus)
+    mm_manager_interface = MMInterface(loop, bus, max(1, args.max_parallel_modems), snapshot, sms_store)
     bus.export('/org/freedesktop/ModemManager1', mm_manager_interface)
+
+    def shutdown():
+        mm_manager_interface.save_snapshot()
+        Logger.debug("PropertiesChanged: %d requested, %d emitted, reduction ratio %.2f",
+                     MMServiceInterface.requested_signals, MMServiceInterface.emitted_signals,
+                     MMServiceInterface.signal_reduction_ratio())
+        MMServiceInterface.log_get_all_stats()
+        mm_manager_interface.ofono_client.signals.log_stats()
+        mm_manager_interface.ofono_client.reads.log_stats()
+        mm_manager_interface.ofono_client.log_timeout_stats()
+        for path, mm_modem_interface in mm_manager_interface.mm_modems.items():
+            mm_modem_interface.operations.log_stats(path)
+            if mm_modem_interface.mm_modem_voice_interface:
+                mm_modem_interface.mm_modem_voice_interface.log_call_stats(path)
+        if sms_store:
+            sms_store.close()
+        bus.disconnect()
+
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        loop.add_signal_handler(signum, shutdown)
+
     await bus.wait_for_disconnect()
 
 asyncio.run(main())
@@ -36,4 +36,5 @@ __all__ = [
 	"MMCallInterface",
 	"MMModemVoiceInterface",
 	"Ofono",
+	"OfonoReadiness",
 ]
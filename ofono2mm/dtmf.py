@@ -0,0 +1,140 @@
+from dbus_next import DBusError
+
+from ofono2mm.logger import Logger
+
+import asyncio
+
+class DtmfQueue:
+    """
+    Paces the DTMF tones of one call, so rapid SendDtmf calls don't
+    overlap in ofono and get rejected.
+
+    Usage:
+
+    dtmf = DtmfQueue(voice_call_manager.call_send_tones)
+    await dtmf.send('123#')
+
+    Digits queued while tones are being sent are batched into a single
+    send_tones() call. After each batch the queue waits for the tones to
+    be played, tone_duration plus pause_duration seconds per digit,
+    before sending the next one. A batch ofono refuses because it is
+    busy is tried again, the digits are never dropped.
+
+    send_tones is any coroutine function taking the digits, which makes
+    the queue easy to drive with a fake VoiceCallManager. progress, if
+    given, is called with the digits sent and queued after every batch,
+    MMCallInterface emits them as its DtmfProgress signal.
+
+    The default durations are set from the --dtmf-tone-ms and
+    --dtmf-pause-ms options, a queue may override them.
+    """
+
+    TONE_DURATION = 0.1
+    PAUSE_DURATION = 0.05
+    MAX_BATCH = 32
+    MAX_BUSY_RETRIES = 10
+
+    def __init__(self, send_tones, tone_duration=None, pause_duration=None, progress=None):
+        self.send_tones = send_tones
+        self.tone_duration = self.TONE_DURATION if tone_duration is None else tone_duration
+        self.pause_duration = self.PAUSE_DURATION if pause_duration is None else pause_duration
+        self.progress = progress
+        # (digits, future) waiting to be sent
+        self.pending = []
+        self.task = None
+        self.sent = 0
+        self.queued = 0
+
+    def send(self, digits):
+        """
+        Queues digits, returns a future done once all of them were sent.
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        if not digits:
+            future.set_result(None)
+            return future
+
+        self.pending.append((digits, future))
+        self.queued += len(digits)
+
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+        return future
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+        for _, future in self.pending:
+            if not future.done():
+                future.cancel()
+        self.pending = []
+        self.sent = 0
+        self.queued = 0
+
+    def take_batch(self):
+        digits = ''
+        futures = []
+        while self.pending and len(digits) + len(self.pending[0][0]) <= self.MAX_BATCH:
+            batch_digits, future = self.pending.pop(0)
+            digits += batch_digits
+            futures.append(future)
+
+        # A string longer than a batch goes out on its own
+        if not futures:
+            batch_digits, future = self.pending.pop(0)
+            digits = batch_digits
+            futures.append(future)
+
+        return digits, futures
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+
+        try:
+            while self.pending:
+                digits, futures = self.take_batch()
+                started = loop.time()
+
+                try:
+                    await self.send_batch(digits)
+                except Exception as e:
+                    Logger.warning("Failed to send DTMF %s: %s", digits, e)
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                    self.queued -= len(digits)
+                    continue
+
+                self.sent += len(digits)
+                for future in futures:
+                    if not future.done():
+                        future.set_result(None)
+
+                Logger.debug("DTMF: %d of %d digits sent", self.sent, self.queued)
+                if self.progress is not None:
+                    self.progress(self.sent, self.queued)
+
+                # Let the tones play out before the next batch
+                remaining = started + len(digits) * (self.tone_duration + self.pause_duration) - loop.time()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+
+            self.sent = 0
+            self.queued = 0
+        finally:
+            if self.task is asyncio.current_task():
+                self.task = None
+
+    async def send_batch(self, digits):
+        for attempt in range(self.MAX_BUSY_RETRIES):
+            try:
+                return await self.send_tones(digits)
+            except DBusError as e:
+                if e.type != 'org.ofono.Error.InProgress' or attempt == self.MAX_BUSY_RETRIES - 1:
+                    raise
+
+            await asyncio.sleep(len(digits) * (self.tone_duration + self.pause_duration))
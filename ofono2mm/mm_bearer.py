@@ -1,14 +1,52 @@
-from dbus_next.service import (ServiceInterface,
-                               method, dbus_property, signal)
-from dbus_next.constants import PropertyAccess
+from dbus_next.service import (method, signal)
 from dbus_next import Variant, DBusError, BusType
 
+from ofono2mm.mm_service import MMServiceInterface
+from ofono2mm.mm_properties import MMPropertySchema
 from ofono2mm.mm_types import ModemManagerPortType
-from ofono2mm.utils import async_retryable
+from ofono2mm.utils import async_retryable, async_deadline
 
 import asyncio
 
-class MMBearerInterface(ServiceInterface):
+class MMBearerInterface(MMServiceInterface):
+    # The ofono properties set_roaming_allowance() reads, see
+    # OfonoStateMirror. The contexts are followed through their own
+    # PropertyChanged signals.
+    OFONO_DEPENDENCIES = [
+        (None, 'Interfaces'),
+        ('org.ofono.ConnectionManager', 'RoamingAllowed'),
+    ]
+
+    PROPERTIES = MMPropertySchema([
+        ("Interface", 's', ''),
+        ("Connected", 'b', False),
+        ("Suspended", 'b', False),
+        ("Multiplexed", 'b', True),
+        ("Ip4Config", 'a{sv}', {
+            "method": Variant('u', 3) # on runtime dhcp MM_BEARER_IP_METHOD_DHCP
+        }),
+        ("Ip6Config", 'a{sv}', {
+            "method": Variant('u', 3) # on runtime dhcp MM_BEARER_IP_METHOD_DHCP
+        }),
+        ("ReloadStatsSupported", 'b', False),
+        ("IpTimeout", 'u', 0),
+        ("BearerType", 'u', 1),
+        ("Properties", 'a{sv}', {
+            "apn": Variant('s', ''),
+            "ip-type": Variant('u', 1), # hardcoded value ipv4 MM_BEARER_IP_FAMILY_IPV4
+            "apn-type": Variant('u', 2), # hardcoded value default internet MM_BEARER_APN_TYPE_DEFAULT
+            "allowed-auth": Variant('u', 0), # on runtime unknown MM_BEARER_ALLOWED_AUTH_UNKNOWN
+            "user": Variant('s', ''),
+            "password": Variant('s', ''),
+            "access-type-preference": Variant('u', 0), # on runtime none MM_BEARER_ACCESS_TYPE_PREFERENCE_NONE
+            "roaming-allowance": Variant('u', 0), # on runtime none MM_BEARER_ROAMING_ALLOWANCE_NONE
+            "profile-id": Variant('i', -1),
+            "profile-name": Variant('s', ''),
+            "profile-enabled": Variant('b', True),
+            "profile-source": Variant('u', 0), # hardcoded value unknown MM_BEARER_PROFILE_SOURCE_UNKNOWN
+        }),
+    ])
+
     def __init__(self, index, bus, ofono_client, modem_name, ofono_modem, ofono_props, ofono_interfaces, ofono_interface_props, mm_modem):
         super().__init__('org.freedesktop.ModemManager1.Bearer')
         # print(f"Creating new bearer interface for {index}")
@@ -24,80 +62,10 @@ class MMBearerInterface(ServiceInterface):
         self.mm_modem = mm_modem
         self.disconnecting = False
         self.reconnect_task = None
-        self.props = {
-            "Interface": Variant('s', ''),
-            "Connected": Variant('b', False),
-            "Suspended": Variant('b', False),
-            "Multiplexed": Variant('b', True),
-            "Ip4Config": Variant('a{sv}', {
-                "method": Variant('u', 3) # on runtime dhcp MM_BEARER_IP_METHOD_DHCP
-            }),
-            "Ip6Config": Variant('a{sv}', {
-                "method": Variant('u', 3) # on runtime dhcp MM_BEARER_IP_METHOD_DHCP
-            }),
-            "ReloadStatsSupported": Variant('b', False),
-            "IpTimeout": Variant('u', 0),
-            "BearerType": Variant('u', 1),
-            "Properties": Variant('a{sv}', {
-                "apn": Variant('s', ''),
-                "ip-type": Variant('u', 1), # hardcoded value ipv4 MM_BEARER_IP_FAMILY_IPV4
-                "apn-type": Variant('u', 2), # hardcoded value default internet MM_BEARER_APN_TYPE_DEFAULT
-                "allowed-auth": Variant('u', 0), # on runtime unknown MM_BEARER_ALLOWED_AUTH_UNKNOWN
-                "user": Variant('s', ''),
-                "password": Variant('s', ''),
-                "access-type-preference": Variant('u', 0), # on runtime none MM_BEARER_ACCESS_TYPE_PREFERENCE_NONE
-                "roaming-allowance": Variant('u', 0), # on runtime none MM_BEARER_ROAMING_ALLOWANCE_NONE
-                "profile-id": Variant('i', -1),
-                "profile-name": Variant('s', ''),
-                "profile-enabled": Variant('b', True),
-                "profile-source": Variant('u', 0), # hardcoded value unknown MM_BEARER_PROFILE_SOURCE_UNKNOWN
-            })
-        }
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Interface(self) -> 's':
-        return self.props['Interface'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Connected(self) -> 'b':
-        return self.props['Connected'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Suspended(self) -> 'b':
-        return self.props['Suspended'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Multiplexed(self) -> 'b':
-        return self.props['Multiplexed'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Ip4Config(self) -> 'a{sv}':
-        return self.props['Ip4Config'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Ip6Config(self) -> 'a{sv}':
-        return self.props['Ip6Config'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def ReloadStatsSupported(self) -> 'b':
-        return self.props['ReloadStatsSupported'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def IpTimeout(self) -> 'u':
-        return self.props['IpTimeout'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def BearerType(self) -> 'u':
-        return self.props['BearerType'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Properties(self) -> 'a{sv}':
-        return self.props['Properties'].value
 
     async def set_props(self):
-        old_props = self.props.copy()
         if 'org.ofono.ConnectionManager' in self.ofono_interface_props:
-            contexts = await self.ofono_interfaces['org.ofono.ConnectionManager'].call_get_contexts()
+            contexts = await self.mm_modem.get_ofono_contexts()
             self.context_names = []
             ctx_idx = 0
             chosen_apn = None
@@ -118,33 +86,49 @@ class MMBearerInterface(ServiceInterface):
                         chosen_password = password
                         chosen_ctx_path = ctx[0]
 
-            self.props['Properties'].value['apn'] = Variant('s', chosen_apn if chosen_apn != '' else '')
-            self.props['Properties'].value['user'] = Variant('s', chosen_username if chosen_username != '' else '')
-            self.props['Properties'].value['password'] = Variant('s', chosen_password if chosen_password != '' else '')
+            self.props.Properties['apn'] = Variant('s', chosen_apn if chosen_apn != '' else '')
+            self.props.Properties['user'] = Variant('s', chosen_username if chosen_username != '' else '')
+            self.props.Properties['password'] = Variant('s', chosen_password if chosen_password != '' else '')
 
             if chosen_auth_method == 'none':
-                self.props['Properties'].value['allowed-auth'] = Variant('u', 1) # none MM_BEARER_ALLOWED_AUTH_NONE
+                self.props.Properties['allowed-auth'] = Variant('u', 1) # none MM_BEARER_ALLOWED_AUTH_NONE
             elif chosen_auth_method == 'pap':
-                self.props['Properties'].value['allowed-auth'] = Variant('u', 2) # pap MM_BEARER_ALLOWED_AUTH_PAP
+                self.props.Properties['allowed-auth'] = Variant('u', 2) # pap MM_BEARER_ALLOWED_AUTH_PAP
             elif chosen_auth_method == 'chap':
-                self.props['Properties'].value['allowed-auth'] = Variant('u', 3) # chap MM_BEARER_ALLOWED_AUTH_CHAP
+                self.props.Properties['allowed-auth'] = Variant('u', 3) # chap MM_BEARER_ALLOWED_AUTH_CHAP
             else:
-                self.props['Properties'].value['allowed-auth'] = Variant('u', 0) # unknown MM_BEARER_ALLOWED_AUTH_UNKNOWN
-
-            ofono_interface = self.ofono_client["ofono_modem"][self.modem_name]['org.ofono.ConnectionManager']
+                self.props.Properties['allowed-auth'] = Variant('u', 0) # unknown MM_BEARER_ALLOWED_AUTH_UNKNOWN
 
             roaming_allowed = None
-            connman_props = await ofono_interface.call_get_properties()
+            connman_props = await self.mm_modem.get_ofono_connection_manager_properties()
 
             if connman_props.get('RoamingAllowed', Variant('b', True).value) != "":
                 roaming_allowed = connman_props.get('RoamingAllowed', Variant('b', True).value).value
 
                 if roaming_allowed == True:
-                    self.props['Properties'].value['roaming-allowance'] = Variant('u', 2) # roaming partner network MM_BEARER_ROAMING_ALLOWANCE_PARTNER
+                    self.props.Properties['roaming-allowance'] = Variant('u', 2) # roaming partner network MM_BEARER_ROAMING_ALLOWANCE_PARTNER
                 elif roaming_allowed == False:
-                    self.props['Properties'].value['roaming-allowance'] = Variant('u', 0) # roaming none MM_BEARER_ROAMING_ALLOWANCE_NONE
+                    self.props.Properties['roaming-allowance'] = Variant('u', 0) # roaming none MM_BEARER_ROAMING_ALLOWANCE_NONE
+
+    def set_roaming_allowance(self, changes=None):
+        connman_props = self.ofono_interface_props.get('org.ofono.ConnectionManager', {})
+        if 'RoamingAllowed' not in connman_props:
+            return
+
+        properties = dict(self.props.Properties)
+        if connman_props['RoamingAllowed'].value:
+            properties['roaming-allowance'] = Variant('u', 2) # roaming partner network MM_BEARER_ROAMING_ALLOWANCE_PARTNER
+        else:
+            properties['roaming-allowance'] = Variant('u', 0) # roaming none MM_BEARER_ROAMING_ALLOWANCE_NONE
+
+        # Properties handed to CreateBearer may not have it
+        old = self.props.Properties.get('roaming-allowance')
+        if old is None or properties['roaming-allowance'].value != old.value:
+            self.props.Properties = properties
+            self.emit_properties_changed({'Properties': properties})
 
     @method()
+    @async_deadline(60)
     async def Connect(self):
         await self.doConnect()
 
@@ -163,6 +147,7 @@ class MMBearerInterface(ServiceInterface):
         self.reconnect_task = None
 
     @method()
+    @async_deadline(30)
     async def Disconnect(self):
         await self.doDisconnect()
 
@@ -198,40 +183,28 @@ class MMBearerInterface(ServiceInterface):
         if propname == "Active":
             if self.disconnecting and (not value.value):
                 self.disconnecting = False
-            elif not self.disconnecting and (not value.value) and self.reconnect_task is None and self.props['Connected'].value:
+            elif not self.disconnecting and (not value.value) and self.reconnect_task is None and self.props.Connected:
                 self.reconnect_task = asyncio.create_task(self.doConnect())
 
-            self.props['Connected'] = value
+            self.props.Connected = value.value
             self.emit_properties_changed({'Connected': value.value})
         elif propname == "Settings":
             if 'Interface' in value.value:
-                self.props['Interface'] = value.value['Interface']
+                self.props.Interface = value.value['Interface'].value
                 self.emit_properties_changed({'Interface': value.value['Interface'].value})
-                if [value.value['Interface'].value, 2] not in self.mm_modem.props['Ports'].value:
-                    self.mm_modem.props['Ports'].value.append([value.value['Interface'].value, ModemManagerPortType.AT])
+                if [value.value['Interface'].value, 2] not in self.mm_modem.props.Ports:
+                    self.mm_modem.props.Ports.append([value.value['Interface'].value, ModemManagerPortType.AT])
             if 'Method' in value.value:
                 if value.value['Method'].value == 'static':
-                    self.props['Ip4Config'].value['method'] = Variant('u', 2) # static MM_BEARER_IP_METHOD_STATIC
+                    self.props.Ip4Config['method'] = Variant('u', 2) # static MM_BEARER_IP_METHOD_STATIC
                 if value.value['Method'].value == 'dhcp':
-                    self.props['Ip4Config'].value['method'] = Variant('u', 3) # dhcp MM_BEARER_IP_METHOD_DHCP
+                    self.props.Ip4Config['method'] = Variant('u', 3) # dhcp MM_BEARER_IP_METHOD_DHCP
             if 'Address' in value.value:
-                self.props['Ip4Config'].value['address'] = value.value['Address']
+                self.props.Ip4Config['address'] = value.value['Address']
             if 'DomainNameServers' in value.value:
                 for i in range(0, min(3, len(value.value['DomainNameServers'].value))):
-                    self.props['Ip4Config'].value['dns' + str(i + 1)] = Variant('s', value.value['DomainNameServers'].value[i])
+                    self.props.Ip4Config['dns' + str(i + 1)] = Variant('s', value.value['DomainNameServers'].value[i])
             if 'Gateway' in value.value:
-                self.props['Ip4Config'].value['gateway'] = value.value['Gateway']
-
-            self.emit_properties_changed({'Ip4Config': self.props['Ip4Config'].value})
-
-    def ofono_changed(self, name, varval):
-        self.ofono_props[name] = varval
-        self.set_props()
-
-    def ofono_interface_changed(self, iface):
-        def ch(name, varval):
-            if iface in self.ofono_interface_props:
-                self.ofono_interface_props[iface][name] = varval
-            self.set_props()
+                self.props.Ip4Config['gateway'] = value.value['Gateway']
 
-        return ch
+            self.emit_properties_changed({'Ip4Config': self.props.Ip4Config})
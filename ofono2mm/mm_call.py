@@ -1,8 +1,26 @@
-from dbus_next.service import ServiceInterface, method, dbus_property, signal
-from dbus_next.constants import PropertyAccess
+from dbus_next.service import method, signal
 from dbus_next import Variant
 
-class MMCallInterface(ServiceInterface):
+from ofono2mm.mm_service import MMServiceInterface
+from ofono2mm.mm_properties import MMPropertySchema
+from ofono2mm.mm_types import ModemManagerCallState, ModemManagerCallStateReason, ofono_call_transition
+from ofono2mm.dtmf import DtmfQueue
+
+class MMCallInterface(MMServiceInterface):
+    PROPERTIES = MMPropertySchema([
+        ('State', 'i', 0), # on runtime unknown MM_CALL_STATE_UNKNOWN
+        ('StateReason', 'i', 0), # on runtime unknown MM_CALL_STATE_REASON_UNKNOWN
+        ('Direction', 'i', 0), # on runtime unknown MM_CALL_DIRECTION_UNKNOWN
+        ('Number', 's', ''),
+        ('Multiparty', 'b', False),
+        ('AudioPort', 's', ''),
+        ('AudioFormat', 'a{sv}', {
+            "encoding": Variant('s', 'pcm'),
+            "resolution": Variant('s', 's16le'),
+            "rate": Variant('u', 48000),
+        }),
+    ])
+
     def __init__(self, index, bus, ofono_client, modem_name, ofono_modem, ofono_props, ofono_interfaces, ofono_interface_props):
         super().__init__('org.freedesktop.ModemManager1.Call')
         self.index = index
@@ -14,119 +32,96 @@ class MMCallInterface(ServiceInterface):
         self.ofono_props = ofono_props
         self.ofono_interfaces = ofono_interfaces
         self.ofono_interface_props = ofono_interface_props
-        self.ofono_interface = None
         self.voicecall = '/'
-        self.props = {
-            'State': Variant('i', 0), # on runtime unknown MM_CALL_STATE_UNKNOWN
-            'StateReason': Variant('i', 0), # on runtime unknown MM_CALL_STATE_REASON_UNKNOWN
-            'Direction': Variant('i', 0), # on runtime unknown MM_CALL_DIRECTION_UNKNOWN
-            'Number': Variant('s', ''),
-            'Multiparty': Variant('b', False),
-            'AudioPort': Variant('s', ''),
-            'AudioFormat': Variant('a{sv}', {
-                "encoding": Variant('s', 'pcm'),
-                "resolution": Variant('s', 's16le'),
-                "rate": Variant('u', 48000),
-            })
-        }
-
-    async def init_call(self):
-        print("Connect property changes")
-        self.ofono_interface = self.ofono_client["ofono_modem"][self.voicecall]['org.ofono.VoiceCall']
-        self.ofono_interface.on_property_changed(self.update_property)
-        print(f"{self.ofono_interface}")
-
-    async def update_property(self, property, value):
-        print(f"update property: {property} value: {value} {self.ofono_interface}")
-        
+        # Loop time the call was announced with CallAdded
+        self.added = None
+        self.dtmf = DtmfQueue(self.send_tones, progress=self.DtmfProgress)
+
+    @property
+    def ofono_interface(self):
+        # Only built when the call is acted upon, not when it rings
+        return self.ofono_client["ofono_modem"][self.voicecall]['org.ofono.VoiceCall']
+
+    def init_call(self):
+        self.ofono_client.signals.subscribe(self.voicecall, 'org.ofono.VoiceCall', 'PropertyChanged', self.update_property)
+
+    def teardown(self):
+        self.dtmf.cancel()
+        self.cancel_properties_changed()
+
+    def update_property(self, property, value):
         if property == "State":
-            if value.value == "alerting":
-                old_state = self.props['State'].value
-                new_state = 2 # MM_CALL_STATE_RINGING_OUT
-                reason = 1 # MM_CALL_STATE_REASON_OUTGOING_STARTED
-                self.props['State'] = Variant('i', new_state)
-                self.StateChanged(old_state, new_state, reason)
-            elif value.value == "active":
-                old_state = self.props['State'].value
-                new_state = 4 # active MM_CALL_STATE_ACTIVE
-                reason = 3 # accepted MM_CALL_STATE_REASON_ACCEPTED
-                self.props['State'] = Variant('i', new_state)
-                self.StateChanged(old_state, new_state, reason)
-            elif value.value == "disconnected":
-                old_state = self.props['State'].value
-                new_state = 7 # MM_CALL_STATE_TERMINATED
-                reason = 4 # MM_CALL_STATE_REASON_TERMINATED
-                self.props['State'] = Variant('i', new_state)
-                self.StateChanged(old_state, new_state, reason)
+            self.set_state(*ofono_call_transition(self.props.State, value.value))
+        elif property == "Multiparty":
+            self.set_multiparty(value.value)
+
+    def set_state(self, new_state, reason):
+        old_state = self.props.State
+        if new_state == old_state and reason == self.props.StateReason:
+            return
+
+        self.props.State = new_state
+        self.props.StateReason = reason
+        if new_state == ModemManagerCallState.TERMINATED:
+            self.dtmf.cancel()
+        if new_state != old_state:
+            self.StateChanged(old_state, new_state, reason)
+        self.emit_properties_changed({'State': new_state, 'StateReason': reason})
+
+    def set_multiparty(self, multiparty):
+        if multiparty == self.props.Multiparty:
+            return
+
+        self.props.Multiparty = multiparty
+        self.emit_properties_changed({'Multiparty': multiparty})
 
     @method()
     def Start(self):
-        self.props['State'] = Variant('i', 4) # active MM_CALL_STATE_ACTIVE
-        self.props['StateReason'] = Variant('i', 1) # accepted MM_CALL_STATE_REASON_OUTGOING_STARTED
+        # CreateCall already dialed, the state follows ofono's VoiceCall
+        # State from here, see ofono_call_transition
+        pass
 
     @method()
     async def Accept(self):
-        #ofono_interface = self.ofono_client["ofono_modem"][self.voicecall]['org.ofono.VoiceCall']
         await self.ofono_interface.call_answer()
-        self.props['State'] = Variant('i', 4) # active MM_CALL_STATE_ACTIVE
-        self.props['StateReason'] = Variant('i', 3) # accepted MM_CALL_STATE_REASON_ACCEPTED
+        self.set_state(ModemManagerCallState.ACTIVE, ModemManagerCallStateReason.ACCEPTED)
 
     @method()
     async def Deflect(self, number: 's'):
-        #ofono_interface = self.ofono_client["ofono_modem"][self.voicecall]['org.ofono.VoiceCall']
         await self.ofono_interface.call_deflect(number)
-        self.props['StateReason'] = Variant('i', 10) # deflected MM_CALL_STATE_REASON_DEFLECTED
+        self.set_state(self.props.State, ModemManagerCallStateReason.DEFLECTED)
 
     @method()
     async def JoinMultiparty(self):
         await self.ofono_interfaces['org.ofono.VoiceCallManager'].call_create_multiparty()
-        self.props['Multiparty'] = Variant('b', True)
+        self.set_multiparty(True)
 
     @method()
     async def LeaveMultiparty(self):
         await self.ofono_interfaces['org.ofono.VoiceCallManager'].call_hangup_multiparty()
-        self.props['Multiparty'] = Variant('b', False)
+        self.set_multiparty(False)
 
     @method()
     async def Hangup(self):
         await self.ofono_interfaces['org.ofono.VoiceCallManager'].call_hangup_all()
 
+    async def send_tones(self, tones):
+        await self.ofono_interfaces['org.ofono.VoiceCallManager'].call_send_tones(tones)
+
     @method()
     async def SendDtmf(self, dtmf: 's'):
-        await self.ofono_interfaces['org.ofono.VoiceCallManager'].call_send_tones(dtmf)
+        await self.dtmf.send(dtmf)
 
     @signal()
     def DtmfReceived(self, dtmf) -> 's':
         return dtmf
 
+    # Not part of the ModemManager API: digits sent and queued so far by
+    # SendDtmf, after every batch handed to ofono
+    @signal()
+    def DtmfProgress(self, sent, queued) -> 'uu':
+        return [sent, queued]
+
     @signal()
     def StateChanged(self, old, new, reason) -> 'iiu':
         return [old, new, reason]
-
-    @dbus_property(access=PropertyAccess.READ)
-    def State(self) -> 'i':
-        return self.props['State'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def StateReason(self) -> 'i':
-        return self.props['StateReason'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Direction(self) -> 'i':
-        return self.props['Direction'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Number(self) -> 's':
-        return self.props['Number'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Multiparty(self) -> 'b':
-        return self.props['Multiparty'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def AudioPort(self) -> 's':
-        return self.props['AudioPort'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def AudioFormat(self) -> 'a{sv}':
-        return self.props['AudioFormat'].value
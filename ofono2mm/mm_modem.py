@@ -1,8 +1,8 @@
-from dbus_next.service import (ServiceInterface,
-                               method, dbus_property, signal)
-from dbus_next.constants import PropertyAccess
+from dbus_next.service import (method, signal)
 from dbus_next import Variant, DBusError, BusType
 
+from ofono2mm.mm_service import MMServiceInterface
+from ofono2mm.mm_properties import MMPropertySchema
 from ofono2mm.mm_modem_3gpp import MMModem3gppInterface
 from ofono2mm.mm_modem_3gpp_ussd import MMModem3gppUssdInterface
 from ofono2mm.mm_modem_3gpp_profile_manager import MMModem3gppProfileManagerInterface
@@ -18,6 +18,7 @@ from ofono2mm.mm_modem_location import MMModemLocationInterface
 from ofono2mm.mm_sim import MMSimInterface
 from ofono2mm.mm_bearer import MMBearerInterface
 from ofono2mm.mm_modem_voice import MMModemVoiceInterface
+from ofono2mm.ofono_state import OfonoStateMirror
 from ofono2mm.mm_types import ModemManagerState,\
                               ModemManagerStateFailedReason,\
                               ModemManagerLock,\
@@ -33,74 +34,173 @@ from ofono2mm.mm_types import ModemManagerState,\
                               OFONO_CAPS,\
                               MM_MODES
 from ofono2mm.logger import Logger
+from ofono2mm.utils import async_run_steps, OperationQueue, async_deadline
 
 import asyncio
 
 bearer_i = 0
 
-class MMModemInterface(ServiceInterface):
-    def __init__(self, loop, index, bus, ofono_client, modem_name):
+MM_MODEM_INTERFACE = 'org.freedesktop.ModemManager1.Modem'
+
+# Derivations of the modem properties, in the order they run: the method
+# computing them, the (interface, property) pairs it reads and the modem
+# properties it writes. org.ofono.Modem properties use the None interface,
+# modem properties feeding another derivation use MM_MODEM_INTERFACE.
+MODEM_DERIVATIONS = [
+    ('set_modem_state', [
+        (None, 'Powered'),
+        (None, 'Online'),
+        (None, 'Interfaces'),
+        ('org.ofono.SimManager', 'Present'),
+        ('org.ofono.SimManager', 'PinRequired'),
+        ('org.ofono.NetworkRegistration', 'Status'),
+        ('org.ofono.ConnectionContext', 'Active'),
+    ], ['State', 'PowerState', 'Sim', 'StateFailedReason', 'UnlockRequired']),
+    ('set_sim_state', [
+        (None, 'Interfaces'),
+        ('org.ofono.SimManager', 'SubscriberNumbers'),
+        ('org.ofono.SimManager', 'Retries'),
+    ], ['OwnNumbers', 'UnlockRetries']),
+    ('set_access_technology', [
+        (None, 'Interfaces'),
+        ('org.ofono.NetworkRegistration', 'Technology'),
+        (MM_MODEM_INTERFACE, 'State'),
+    ], ['AccessTechnologies']),
+    ('set_signal_quality', [
+        (None, 'Interfaces'),
+        ('org.ofono.NetworkRegistration', 'Strength'),
+        (MM_MODEM_INTERFACE, 'State'),
+    ], ['SignalQuality']),
+    ('set_capabilities', [
+        ('org.ofono.RadioSettings', 'AvailableTechnologies'),
+    ], ['CurrentCapabilities', 'SupportedCapabilities']),
+    ('set_supported_modes', [
+        ('org.ofono.RadioSettings', 'TechnologyPreference'),
+        ('org.ofono.RadioSettings', 'AvailableTechnologies'),
+    ], ['SupportedModes', 'CurrentModes']),
+    ('set_identity', [
+        (None, 'Serial'),
+        (None, 'Revision'),
+        (None, 'SoftwareVersionNumber'),
+        (None, 'Manufacturer'),
+        (None, 'Model'),
+    ], ['EquipmentIdentifier', 'HardwareRevision', 'Revision', 'Manufacturer', 'Model']),
+]
+
+MODEM_DERIVATIONS_BY_DEPENDENCY = {}
+for derivation, dependencies, _ in MODEM_DERIVATIONS:
+    for dependency in dependencies:
+        MODEM_DERIVATIONS_BY_DEPENDENCY.setdefault(dependency, []).append(derivation)
+
+class MMModemInterface(MMServiceInterface):
+    # Seconds a method waits for the ofono interface it needs
+    OFONO_INTERFACE_TIMEOUT = 10
+
+    PROPERTIES = MMPropertySchema([
+        ('Sim', 'o', '/'),
+        ('SimSlots', 'ao', []),
+        ('PrimarySimSlot', 'u', 0),
+        ('Bearers', 'ao', []),
+        ('SupportedCapabilities', 'au', [ModemManagerCapability.NONE]),
+        ('CurrentCapabilities', 'u', ModemManagerCapability.NONE),
+        ('MaxBearers', 'u', 4),
+        ('MaxActiveBearers', 'u', 2),
+        ('MaxActiveMultiplexedBearers', 'u', 2),
+        ('Manufacturer', 's', 'ofono'),
+        ('Model', 's', ''),
+        ('Revision', 's', '10000'),
+        ('CarrierConfiguration', 's', ''),
+        ('CarrierConfigurationRevision', 's', '0'),
+        ('HardwareRevision', 's', '1000'),
+        ('DeviceIdentifier', 's', ''),
+        ('Device', 's', ''),
+        ('Physdev', 's', '/dev/binder'),
+        ('Drivers', 'as', ['binder']),
+        ('Plugin', 's', 'ofono2mm'),
+        ('PrimaryPort', 's', ''),
+        ('Ports', 'a(su)', []),
+        ('EquipmentIdentifier', 's', ''),
+        ('UnlockRequired', 'u', ModemManagerLock.UNKNOWN),
+        ('UnlockRetries', 'a{uu}', {}),
+        ('State', 'i', ModemManagerState.UNKNOWN),
+        ('StateFailedReason', 'u', ModemManagerStateFailedReason.UNKNOWN),
+        ('AccessTechnologies', 'u', ModemManagerAccessTechnology.UNKNOWN),
+        ('SignalQuality', '(ub)', [0, False]),
+        ('OwnNumbers', 'as', []),
+        ('PowerState', 'u', 3), # on runtime power on MM_MODEM_POWER_STATE_ON
+        ('SupportedModes', 'a(uu)', [[ModemManagerMode.NONE, ModemManagerMode.NONE]]),
+        ('CurrentModes', '(uu)', [ModemManagerMode.NONE, ModemManagerMode.NONE]),
+        ('SupportedBands', 'au', []),
+        ('CurrentBands', 'au', []),
+        ('SupportedIpFamilies', 'u', 3), # hardcoded value ipv4 and ipv6 MM_BEARER_IP_FAMILY_IPV4V6
+    ])
+
+    def __init__(self, loop, index, bus, ofono_client, modem_name, object_manager, snapshot=None, sms_store=None):
         super().__init__('org.freedesktop.ModemManager1.Modem')
         self.loop = loop
+        self.object_manager = object_manager
+        self.snapshot = snapshot
+        self.sms_store = sms_store
         self.index = index
         self.bus = bus
         self.ofono_client = ofono_client
         self.ofono_proxy = self.ofono_client["ofono_modem"][modem_name]
         self.modem_name = modem_name
         self.ofono_modem = self.ofono_proxy['org.ofono.Modem']
-        self.ofono_props = {}
+        self.ofono_state = OfonoStateMirror()
+        # False while a warm start waits for the ofono interfaces, see
+        # hold_state()
+        self.reconciled = True
+        self.ofono_props = self.ofono_state.modem_props
         self.ofono_interfaces = {}
-        self.ofono_interface_props = {}
+        self.ofono_interface_props = self.ofono_state.interface_props
+        self.ofono_interface_waiters = {}
         self.mm_cell_type = ModemManagerCellType.UNKNOWN
         self.mm_modem3gpp_interface = False
         self.mm_modem_messaging_interface = False
+        self.mm_modem_voice_interface = False
         self.mm_sim_interface = False
-        self.sim = Variant('o', f'/org/freedesktop/ModemManager/SIM/{self.index}')
+        self.sim = f'/org/freedesktop/ModemManager1/SIM/{self.index}'
         self.bearers = {}
-        self.props = {
-            'Sim': Variant('o', '/'),
-            'SimSlots': Variant('ao', [f'/org/freedesktop/ModemManager/SIM/{self.index}']),
-            'PrimarySimSlot': Variant('u', 0),
-            'Bearers': Variant('ao', []),
-            'SupportedCapabilities': Variant('au', [ModemManagerCapability.NONE]),
-            'CurrentCapabilities': Variant('u', ModemManagerCapability.NONE),
-            'MaxBearers': Variant('u', 4),
-            'MaxActiveBearers': Variant('u', 2),
-            'MaxActiveMultiplexedBearers': Variant('u', 2),
-            'Manufacturer': Variant('s', 'ofono'),
-            'Model': Variant('s', ''),
-            'Revision': Variant('s', '10000'),
-            'CarrierConfiguration': Variant('s', ''),
-            'CarrierConfigurationRevision': Variant('s', '0'),
-            'HardwareRevision': Variant('s', '1000'),
-            'DeviceIdentifier': Variant('s', self.modem_name),
-            'Device': Variant('s', self.modem_name),
-            'Physdev': Variant('s', '/dev/binder'),
-            'Drivers': Variant('as', ['binder']),
-            'Plugin': Variant('s', 'ofono2mm'),
-            'PrimaryPort': Variant('s', self.modem_name),
-            'Ports': Variant('a(su)', [[self.modem_name, ModemManagerPortType.UNKNOWN]]),
-            'EquipmentIdentifier': Variant('s', ''),
-            'UnlockRequired': Variant('u', ModemManagerLock.UNKNOWN),
-            'UnlockRetries': Variant('a{uu}', {}),
-            'State': Variant('i', ModemManagerState.UNKNOWN),
-            'StateFailedReason': Variant('u', ModemManagerStateFailedReason.UNKNOWN),
-            'AccessTechnologies': Variant('u', ModemManagerAccessTechnology.UNKNOWN),
-            'SignalQuality': Variant('(ub)', [0, False]),
-            'OwnNumbers': Variant('as', []),
-            'PowerState': Variant('u', 3), # on runtime power on MM_MODEM_POWER_STATE_ON
-            'SupportedModes': Variant('a(uu)', [[ModemManagerMode.NONE, ModemManagerMode.NONE]]),
-            'CurrentModes': Variant('(uu)', [ModemManagerMode.NONE, ModemManagerMode.NONE]),
-            'SupportedBands': Variant('au', []),
-            'CurrentBands': Variant('au', []),
-            'SupportedIpFamilies': Variant('u', 3) # hardcoded value ipv4 and ipv6 MM_BEARER_IP_FAMILY_IPV4V6
-        }
+        # 'power' serializes Enable, Reset, FactoryReset and SetPowerState,
+        # 'bearer' CreateBearer, DeleteBearer and Simple.Connect
+        self.operations = OperationQueue()
+        self.props.SimSlots = [self.sim]
+        self.props.DeviceIdentifier = self.modem_name
+        self.props.Device = self.modem_name
+        self.props.PrimaryPort = self.modem_name
+        self.props.Ports = [[self.modem_name, ModemManagerPortType.UNKNOWN]]
+
+        if self.snapshot:
+            self.snapshot.restore(self.modem_name, 'Modem', self.props)
+
+        self.ofono_state.watch([dependency for dependency in MODEM_DERIVATIONS_BY_DEPENDENCY
+                                if dependency[0] != MM_MODEM_INTERFACE], self.set_props)
 
     async def init_ofono_interfaces(self):
-        for iface in self.ofono_props['Interfaces'].value:
-            await self.add_ofono_interface(iface)
+        # add_ofono_interface() already checks the contexts once
+        # org.ofono.ConnectionManager shows up
+        await asyncio.gather(*[self.add_ofono_interface(iface) for iface in self.ofono_props['Interfaces'].value])
+
+    async def init_mm_interfaces(self):
+        steps = {
+            'sim': (self.init_mm_sim_interface, []),
+            '3gpp': (self.init_mm_3gpp_interface, ['sim']),
+            '3gpp_ussd': (self.init_mm_3gpp_ussd_interface, ['3gpp']),
+            '3gpp_profile_manager': (self.init_mm_3gpp_profile_manager_interface, ['3gpp']),
+            'messaging': (self.init_mm_messaging_interface, []),
+            'simple': (self.init_mm_simple_interface, ['3gpp']),
+            'firmware': (self.init_mm_firmware_interface, []),
+            'time': (self.init_mm_time_interface, []),
+            'cdma': (self.init_mm_cdma_interface, []),
+            'sar': (self.init_mm_sar_interface, []),
+            'oma': (self.init_mm_oma_interface, []),
+            'signal': (self.init_mm_signal_interface, []),
+            'location': (self.init_mm_location_interface, []),
+            'voice': (self.init_mm_voice_interface, ['sim']),
+        }
 
-        await self.check_ofono_contexts()
+        return await async_run_steps(steps)
 
     async def add_ofono_interface(self, iface):
         self.ofono_interfaces.update({
@@ -108,132 +208,276 @@ class MMModemInterface(ServiceInterface):
         })
 
         try:
-            self.ofono_interface_props.update({
-                iface: await self.ofono_interfaces[iface].call_get_properties()
-            })
+            self.ofono_state.set_interface(iface, await self.ofono_interfaces[iface].call_get_properties())
+            self.ofono_client.signals.subscribe(self.modem_name, iface, 'PropertyChanged', self.ofono_interface_changed(iface))
+        except DBusError:
+            self.ofono_state.set_interface(iface, {})
+            self.ofono_client.signals.subscribe(self.modem_name, iface, 'PropertyChanged', self.ofono_interface_changed(iface))
+        except AttributeError:
+            pass
 
-            if self.mm_modem3gpp_interface:
-                self.mm_modem3gpp_interface.ofono_interface_props = self.ofono_interface_props.copy()
-            if self.mm_sim_interface:
-                self.mm_sim_interface.ofono_interface_props = self.ofono_interface_props.copy()
+        if iface in self.ofono_interface_props:
+            self.resolve_ofono_interface_waiters(iface, True)
 
-            self.ofono_interfaces[iface].on_property_changed(self.ofono_interface_changed(iface))
-        except DBusError:
-            self.ofono_interface_props.update({
-                iface: {}
-            })
+        if iface == "org.ofono.ConnectionManager":
+            await self.check_ofono_contexts()
 
-            if self.mm_modem3gpp_interface:
-                self.mm_modem3gpp_interface.ofono_interface_props = self.ofono_interface_props.copy()
-            if self.mm_sim_interface:
-                self.mm_sim_interface.ofono_interface_props = self.ofono_interface_props.copy()
+    async def refresh_ofono_props(self, mprops):
+        # ofono may have restarted behind our back, re-read everything
+        # but keep the exported objects
+        self.ofono_state.update_modem(mprops)
 
-            self.ofono_interfaces[iface].on_property_changed(self.ofono_interface_changed(iface))
-        except AttributeError:
-            pass
+        for iface in list(self.ofono_interfaces):
+            if iface not in self.ofono_props['Interfaces'].value:
+                await self.remove_ofono_interface(iface)
+
+        await asyncio.gather(*[self.refresh_ofono_interface(iface) for iface in self.ofono_props['Interfaces'].value])
+
+        self.set_props()
 
+    async def refresh_ofono_interface(self, iface):
+        if iface not in self.ofono_interfaces:
+            await self.add_ofono_interface(iface)
+            return
+
+        try:
+            props = await self.ofono_interfaces[iface].call_get_properties()
+        except (DBusError, AttributeError):
+            return
+
+        if iface in self.ofono_interface_props:
+            self.ofono_state.set_interface(iface, props)
+
+    async def wait_for_ofono_interface(self, iface, timeout=None):
+        """
+        Waits until ofono exposes iface on this modem and its properties
+        are known. Returns True as soon as it is there, False if it did not
+        show up within timeout seconds or the modem went away.
+
+        Usage:
+
+        if not await self.wait_for_ofono_interface('org.ofono.ConnectionManager'):
+            return
+        """
+
+        if iface in self.ofono_interface_props:
+            return True
+
+        if timeout is None:
+            timeout = self.OFONO_INTERFACE_TIMEOUT
+
+        if iface not in self.ofono_interface_waiters:
+            self.ofono_interface_waiters[iface] = self.loop.create_future()
+
+        try:
+            # Shielded, a waiter timing out must not cancel the others
+            return await asyncio.wait_for(asyncio.shield(self.ofono_interface_waiters[iface]), timeout)
+        except asyncio.TimeoutError:
+            Logger.warning("%s did not show up on %s within %g s", iface, self.modem_name, timeout)
+            return False
+
+    def resolve_ofono_interface_waiters(self, iface, available):
+        future = self.ofono_interface_waiters.pop(iface, None)
+        if future is not None and not future.done():
+            future.set_result(available)
+
+    async def get_ofono_contexts(self):
+        """
+        ConnectionManager.GetContexts, shared with the concurrent callers.
+        """
+
+        return await self.ofono_client.reads.get(self.modem_name, 'org.ofono.ConnectionManager', 'GetContexts',
+                                                 self.ofono_interfaces['org.ofono.ConnectionManager'].call_get_contexts)
+
+    async def get_ofono_connection_manager_properties(self):
+        return await self.ofono_client.reads.get(self.modem_name, 'org.ofono.ConnectionManager', 'GetProperties',
+                                                 self.ofono_interfaces['org.ofono.ConnectionManager'].call_get_properties)
+
+    def record_snapshot(self):
+        if not self.snapshot:
+            return
+
+        self.snapshot.record(self.modem_name, 'Modem', self.props)
         if self.mm_modem3gpp_interface:
-            self.mm_modem3gpp_interface.set_props()
+            self.snapshot.record(self.modem_name, 'Modem3gpp', self.mm_modem3gpp_interface.props)
         if self.mm_sim_interface:
-            self.mm_sim_interface.set_props()
-        if self.mm_modem_messaging_interface and iface == "org.ofono.MessageManager":
-            self.mm_modem_messaging_interface.set_props()
-            await self.mm_modem_messaging_interface.init_messages()
-        if iface == "org.ofono.ConnectionManager":
-            await self.check_ofono_contexts()
+            self.snapshot.record(self.modem_name, 'Sim', self.mm_sim_interface.props)
+
+    def teardown(self):
+        for iface in list(self.ofono_interface_waiters):
+            self.resolve_ofono_interface_waiters(iface, False)
+
+        # Nothing may react to ofono changes or emit signals any more
+        self.ofono_state.unwatch_all()
+        for interface in self.service_interfaces():
+            interface.cancel_properties_changed()
+
+        for path, mm_bearer_interface in list(self.bearers.items()):
+            if mm_bearer_interface.reconnect_task is not None:
+                mm_bearer_interface.reconnect_task.cancel()
+                mm_bearer_interface.reconnect_task = None
+            self.object_manager.unexport(path)
+        self.bearers = {}
+
+        if self.mm_modem_voice_interface:
+            self.mm_modem_voice_interface.teardown()
+            for path in self.mm_modem_voice_interface.props['Calls'].value:
+                self.object_manager.unexport(path)
+
+        if self.mm_modem_messaging_interface:
+            self.mm_modem_messaging_interface.teardown()
+            for path in self.mm_modem_messaging_interface.props['Messages'].value:
+                self.object_manager.unexport(path)
+
+        self.object_manager.unexport(f'/org/freedesktop/ModemManager1/SIM/{self.index}')
+        self.object_manager.unexport(f'/org/freedesktop/ModemManager1/Modem/{self.index}')
+
+        # Disconnect the signal handlers of the modem and its contexts,
+        # calls and operators
+        self.ofono_client.drop_path(self.modem_name)
+
+    def service_interfaces(self):
+        """
+        The exported interfaces of this modem and of its SIM, bearers,
+        calls and messages.
+        """
+
+        interfaces = [value for value in vars(self).values() if isinstance(value, MMServiceInterface)]
+        interfaces += list(self.bearers.values())
+        if self.mm_modem_voice_interface:
+            interfaces += list(self.mm_modem_voice_interface.call_interfaces.values())
+        if self.mm_modem_messaging_interface:
+            interfaces += list(self.mm_modem_messaging_interface.messages.values())
+
+        return [self] + interfaces
 
     async def remove_ofono_interface(self, iface):
         if iface in self.ofono_interfaces:
             self.ofono_interfaces.pop(iface)
-        if iface in self.ofono_interface_props:
-            self.ofono_interface_props.pop(iface)
 
-        self.set_props()
+        self.ofono_client.signals.unsubscribe_interface(self.modem_name, iface)
+        self.ofono_state.remove_interface(iface)
 
-        if self.mm_modem3gpp_interface:
-            self.mm_modem3gpp_interface.ofono_interface_props = self.ofono_interface_props.copy()
-            self.mm_modem3gpp_interface.set_props()
-        if self.mm_sim_interface:
-            self.mm_sim_interface.ofono_interface_props = self.ofono_interface_props.copy()
-            self.mm_sim_interface.set_props()
+    def export_sim_interface(self):
+        self.mm_sim_interface = MMSimInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
+        if self.snapshot:
+            self.snapshot.restore(self.modem_name, 'Sim', self.mm_sim_interface.props)
+        self.object_manager.export(self.sim, self.mm_sim_interface)
+
+    def hold_state(self):
+        """
+        On a warm start, publishes the modem as initializing instead of
+        a State guessed from org.ofono.Modem alone, before the SIM and
+        the other ofono interfaces are known. set_props() does nothing
+        until reconciled is set back to True.
+        """
+
+        self.reconciled = False
+        self.props.State = ModemManagerState.INITIALIZING
+        self.props.PowerState = 0 # unknown MM_MODEM_POWER_STATE_UNKNOWN
+
+    def export_snapshot_sim(self):
+        """
+        On a warm start, publishes the SIM as the snapshot knows it along
+        with the early Modem export. set_props() corrects both once ofono
+        has answered.
+        """
+
+        if not self.snapshot.has_interface(self.modem_name, 'Sim'):
+            return
+
+        self.export_sim_interface()
+        self.props.Sim = self.sim
 
     async def init_mm_sim_interface(self):
-        self.mm_sim_interface = MMSimInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
-        self.bus.export(f'/org/freedesktop/ModemManager/SIM/{self.index}', self.mm_sim_interface)
+        if not self.mm_sim_interface:
+            self.export_sim_interface()
         self.mm_sim_interface.set_props()
+        self.ofono_state.watch(MMSimInterface.OFONO_DEPENDENCIES, self.mm_sim_interface.set_props)
 
     async def init_mm_3gpp_interface(self):
         self.mm_modem3gpp_interface = MMModem3gppInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem3gpp_interface)
+        if self.snapshot:
+            self.snapshot.restore(self.modem_name, 'Modem3gpp', self.mm_modem3gpp_interface.props)
+        self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem3gpp_interface)
         self.mm_modem3gpp_interface.set_props()
+        self.ofono_state.watch(MMModem3gppInterface.OFONO_DEPENDENCIES, self.mm_modem3gpp_interface.set_props)
 
     async def init_mm_3gpp_ussd_interface(self):
         self.mm_modem3gpp_ussd_interface = MMModem3gppUssdInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem3gpp_ussd_interface)
+        self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem3gpp_ussd_interface)
 
     async def init_mm_3gpp_profile_manager_interface(self):
         self.mm_modem3gpp_profile_manager_interface = MMModem3gppProfileManagerInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem3gpp_profile_manager_interface)
+        self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem3gpp_profile_manager_interface)
 
     async def init_mm_simple_interface(self):
         self.mm_modem_simple_interface = MMModemSimpleInterface(self, self.ofono_interfaces, self.ofono_interface_props)
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_simple_interface)
+        self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_simple_interface)
+        self.mm_modem_simple_interface.set_props()
+        self.ofono_state.watch(MMModemSimpleInterface.OFONO_DEPENDENCIES, self.mm_modem_simple_interface.set_props)
 
     async def init_mm_firmware_interface(self):
         self.mm_modem_firmware_interface = MMModemFirmwareInterface(self)
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_firmware_interface)
+        self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_firmware_interface)
         self.mm_modem_firmware_interface.set_props()
 
     async def init_mm_time_interface(self):
         self.mm_modem_time_interface = MMModemTimeInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_time_interface)
+        self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_time_interface)
 
         if 'org.ofono.NetworkTime' in self.ofono_interfaces:
             await self.mm_modem_time_interface.init_time()
 
     async def init_mm_cdma_interface(self):
         self.mm_modem_cdma_interface = MMModemCDMAInterface(self)
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_cdma_interface)
+        self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_cdma_interface)
 
     async def init_mm_sar_interface(self):
         self.mm_modem_sar_interface = MMModemSarInterface(self)
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_sar_interface)
+        self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_sar_interface)
 
     async def init_mm_oma_interface(self):
         self.mm_modem_oma_interface = MMModemOmaInterface(self)
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_oma_interface)
+        self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_oma_interface)
 
     async def init_mm_signal_interface(self):
         self.mm_modem_signal_interface = MMModemSignalInterface(self, self.ofono_interfaces, self.ofono_interface_props)
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_signal_interface)
+        self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_signal_interface)
+        self.mm_modem_signal_interface.set_props()
+        self.ofono_state.watch(MMModemSignalInterface.OFONO_DEPENDENCIES, self.mm_modem_signal_interface.set_props)
 
     async def init_mm_location_interface(self):
         self.mm_modem_location_interface = MMModemLocationInterface(self)
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_location_interface)
+        self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_location_interface)
 
     async def init_mm_voice_interface(self):
-        self.mm_modem_voice_interface = MMModemVoiceInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_voice_interface)
+        self.mm_modem_voice_interface = MMModemVoiceInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props, self)
+        self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_voice_interface)
+        self.ofono_state.watch(MMModemVoiceInterface.OFONO_DEPENDENCIES, self.mm_modem_voice_interface.set_props)
 
         if 'org.ofono.VoiceCallManager' in self.ofono_interfaces:
             self.mm_modem_voice_interface.set_props()
             await self.mm_modem_voice_interface.init_calls()
 
     async def init_mm_messaging_interface(self):
-        self.mm_modem_messaging_interface = MMModemMessagingInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
-        self.bus.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_messaging_interface)
+        self.mm_modem_messaging_interface = MMModemMessagingInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props, self)
+        self.object_manager.export(f'/org/freedesktop/ModemManager1/Modem/{self.index}', self.mm_modem_messaging_interface)
+        self.mm_modem_messaging_interface.start_loading()
+        self.mm_modem_messaging_interface.init_messages()
+        self.ofono_state.watch(MMModemMessagingInterface.OFONO_DEPENDENCIES, self.mm_modem_messaging_interface.init_messages)
 
-        if 'org.ofono.MessageManager' in self.ofono_interfaces:
-            self.mm_modem_messaging_interface.set_props()
-            await self.mm_modem_messaging_interface.init_messages()
+    def watch_bearer(self, mm_bearer_interface):
+        mm_bearer_interface.set_roaming_allowance()
+        self.ofono_state.watch(MMBearerInterface.OFONO_DEPENDENCIES, mm_bearer_interface.set_roaming_allowance)
 
     async def check_ofono_contexts(self):
         global bearer_i
         if not 'org.ofono.ConnectionManager' in self.ofono_interfaces:
             return
 
-        contexts = await self.ofono_interfaces['org.ofono.ConnectionManager'].call_get_contexts();
-        old_bearer_list = self.props['Bearers'].value
+        contexts = await self.get_ofono_contexts()
+        old_bearer_list = self.props.Bearers
         for ctx in contexts:
             if ctx[1]['Type'].value == "internet":
                 mm_bearer_interface = MMBearerInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props, self)
@@ -273,22 +517,22 @@ class MMModemInterface(ServiceInterface):
                 })
 
                 if 'Interface' in ctx[1]['Settings'].value:
-                    self.props['Ports'].value.append([ctx[1]['Settings'].value['Interface'].value, ModemManagerPortType.AT])
-                    self.emit_properties_changed({'Ports': self.props['Ports'].value})
+                    self.props.Ports.append([ctx[1]['Settings'].value['Interface'].value, ModemManagerPortType.AT])
+                    self.emit_properties_changed({'Ports': self.props.Ports})
 
-                ofono_ctx_interface = self.ofono_client["ofono_context"][ctx[0]]["org.ofono.ConnectionContext"]
-                ofono_ctx_interface.on_property_changed(mm_bearer_interface.ofono_context_changed)
-                ofono_ctx_interface.on_property_changed(self.ofono_context_changed)
+                self.ofono_client.signals.subscribe(ctx[0], 'org.ofono.ConnectionContext', 'PropertyChanged', mm_bearer_interface.ofono_context_changed)
+                self.ofono_client.signals.subscribe(ctx[0], 'org.ofono.ConnectionContext', 'PropertyChanged', self.ofono_context_changed)
                 mm_bearer_interface.ofono_ctx = ctx[0]
-                self.bus.export(f'/org/freedesktop/ModemManager/Bearer/{bearer_i}', mm_bearer_interface)
-                self.props['Bearers'].value.append(f'/org/freedesktop/ModemManager/Bearer/{bearer_i}')
-                self.bearers[f'/org/freedesktop/ModemManager/Bearer/{bearer_i}'] = mm_bearer_interface
+                self.watch_bearer(mm_bearer_interface)
+                self.object_manager.export(f'/org/freedesktop/ModemManager1/Bearer/{bearer_i}', mm_bearer_interface)
+                self.props.Bearers.append(f'/org/freedesktop/ModemManager1/Bearer/{bearer_i}')
+                self.bearers[f'/org/freedesktop/ModemManager1/Bearer/{bearer_i}'] = mm_bearer_interface
                 bearer_i += 1
 
-        if self.props['Bearers'].value == old_bearer_list:
-            self.emit_properties_changed({'Bearers': self.props['Bearers'].value})
+        if self.props.Bearers == old_bearer_list:
+            self.emit_properties_changed({'Bearers': self.props.Bearers})
 
-        self.ofono_interfaces['org.ofono.ConnectionManager'].on_context_added(self.ofono_context_added)
+        self.ofono_client.signals.subscribe(self.modem_name, 'org.ofono.ConnectionManager', 'ContextAdded', self.ofono_context_added)
 
     def ofono_context_added(self, path, properties):
         global bearer_i
@@ -330,109 +574,104 @@ class MMModemInterface(ServiceInterface):
             })
 
             if 'Interface' in properties['Settings'].value:
-                self.props['Ports'].value.append([properties['Settings'].value['Interface'].value, 2])
-                self.emit_properties_changed({'Ports': self.props['Ports'].value})
+                self.props.Ports.append([properties['Settings'].value['Interface'].value, 2])
+                self.emit_properties_changed({'Ports': self.props.Ports})
 
-            ofono_ctx_interface = self.ofono_client["ofono_context"][path]['org.ofono.ConnectionContext']
-            ofono_ctx_interface.on_property_changed(mm_bearer_interface.ofono_context_changed)
-            ofono_ctx_interface.on_property_changed(self.ofono_context_changed)
+            self.ofono_client.signals.subscribe(path, 'org.ofono.ConnectionContext', 'PropertyChanged', mm_bearer_interface.ofono_context_changed)
+            self.ofono_client.signals.subscribe(path, 'org.ofono.ConnectionContext', 'PropertyChanged', self.ofono_context_changed)
             mm_bearer_interface.ofono_ctx = path
-            self.bus.export(f'/org/freedesktop/ModemManager/Bearer/{bearer_i}', mm_bearer_interface)
-            self.props['Bearers'].value.append(f'/org/freedesktop/ModemManager/Bearer/{bearer_i}')
-            self.bearers[f'/org/freedesktop/ModemManager/Bearer/{bearer_i}'] = mm_bearer_interface
+            self.watch_bearer(mm_bearer_interface)
+            self.object_manager.export(f'/org/freedesktop/ModemManager1/Bearer/{bearer_i}', mm_bearer_interface)
+            self.props.Bearers.append(f'/org/freedesktop/ModemManager1/Bearer/{bearer_i}')
+            self.bearers[f'/org/freedesktop/ModemManager1/Bearer/{bearer_i}'] = mm_bearer_interface
             bearer_i += 1
-            self.emit_properties_changed({'Bearers': self.props['Bearers'].value})
+            self.emit_properties_changed({'Bearers': self.props.Bearers})
 
     def set_modem_state(self):
         #############
         # MODEM OFF #
         #############
         if not self.ofono_props['Powered'].value or 'org.ofono.SimManager' not in self.ofono_interface_props:
-            self.props['State'] = Variant('i', ModemManagerState.DISABLED)
-            self.props['PowerState'] = Variant('i', 1) # power is off MM_MODEM_POWER_STATE_OFF
+            self.props.State = ModemManagerState.DISABLED
+            self.props.PowerState = 1 # power is off MM_MODEM_POWER_STATE_OFF
             return
 
         #############
         # MODEM ON  #
         #############
-        self.props['PowerState'] = Variant('i', 3) # power is on MM_MODEM_POWER_STATE_ON
+        self.props.PowerState = 3 # power is on MM_MODEM_POWER_STATE_ON
 
         if 'Present' not in self.ofono_interface_props['org.ofono.SimManager'] or \
                 not self.ofono_interface_props['org.ofono.SimManager']['Present'].value:
-            self.props['Sim'] = Variant('o', '/')
-            self.props['State'] = Variant('i', ModemManagerState.FAILED)
-            self.props['StateFailedReason'] = Variant('i', ModemManagerStateFailedReason.SIM_MISSING)
+            self.props.Sim = '/'
+            self.props.State = ModemManagerState.FAILED
+            self.props.StateFailedReason = ModemManagerStateFailedReason.SIM_MISSING
             return
 
         #################
         # SIM AVAILABLE #
         #################
-        self.props['Sim'] = self.sim
-        self.props['StateFailedReason'] = Variant('i', ModemManagerStateFailedReason.NONE)
+        self.props.Sim = self.sim
+        self.props.StateFailedReason = ModemManagerStateFailedReason.NONE
 
         if self.ofono_interface_props['org.ofono.SimManager']['PinRequired'].value == 'none':
-            self.props['UnlockRequired'] = Variant('u', ModemManagerLock.NONE)
+            self.props.UnlockRequired = ModemManagerLock.NONE
         else:
-            self.props['UnlockRequired'] = Variant('u', ModemManagerLock.SIM_PIN)
-            self.props['State'] = Variant('i', ModemManagerState.LOCKED)
+            self.props.UnlockRequired = ModemManagerLock.SIM_PIN
+            self.props.State = ModemManagerState.LOCKED
             return
 
         #################
         # SIM UNLOCKED  #
         #################
         if not self.ofono_props['Online'].value:
-            self.props['State'] = Variant('i', ModemManagerState.DISABLED)
+            self.props.State = ModemManagerState.DISABLED
             return
 
         #################
         # MODEM ENABLED #
         #################
         if 'org.ofono.NetworkRegistration' not in self.ofono_interface_props:
-            self.props['State'] = Variant('i', ModemManagerState.ENABLED)
+            self.props.State = ModemManagerState.ENABLED
             return
 
         if "Status" not in self.ofono_interface_props['org.ofono.NetworkRegistration']:
-            self.props['State'] = Variant('i', ModemManagerState.ENABLED)
+            self.props.State = ModemManagerState.ENABLED
             return
 
         if self.ofono_interface_props['org.ofono.NetworkRegistration']['Status'].value == 'denied':
-            self.props['State'] = Variant('i', ModemManagerState.ENABLED)
+            self.props.State = ModemManagerState.ENABLED
             return
 
         ###################
         # MODEM SEARCHING #
         ###################
         if self.ofono_interface_props['org.ofono.NetworkRegistration']['Status'].value == 'searching':
-            self.props['State'] = Variant('i', ModemManagerState.SEARCHING)
+            self.props.State = ModemManagerState.SEARCHING
             return
 
-        if 'Strength' in self.ofono_interface_props['org.ofono.NetworkRegistration']:
-            self.props['SignalQuality'] = Variant('(ub)',
-                                                  [self.ofono_interface_props['org.ofono.NetworkRegistration']
-                                                                             ['Strength'].value,
-                                                  True])
         ###################
         # MODEM CONNECTED #
         ###################
         for bearer in self.bearers.values():
             if bearer.Connected:
-                self.props['State'] = Variant('i', ModemManagerState.CONNECTED)
+                self.props.State = ModemManagerState.CONNECTED
                 return
 
         ####################
         # MODEM REGISTERED #
         ####################
         if self.ofono_interface_props['org.ofono.NetworkRegistration']['Status'].value in ['registered', 'roaming']:
-            self.props['State'] = Variant('i', ModemManagerState.REGISTERED)
+            self.props.State = ModemManagerState.REGISTERED
 
     def set_sim_state(self):
         if 'org.ofono.SimManager' not in self.ofono_interface_props:
             return
 
         try:
-            self.props['OwnNumbers'] = Variant('as', self.ofono_interface_props['org.ofono.SimManager']['SubscriberNumbers'].value)
+            self.props.OwnNumbers = self.ofono_interface_props['org.ofono.SimManager']['SubscriberNumbers'].value
         except:
-            self.props['OwnNumbers'] = Variant('as', [])
+            self.props.OwnNumbers = []
 
         unlock_retries = {}
         for key in OFONO_RETRIES_LOCK.keys():
@@ -441,25 +680,36 @@ class MMModemInterface(ServiceInterface):
                 unlock_retries[OFONO_RETRIES_LOCK[key]] = value
             except:
                 pass
-        self.props['UnlockRetries'] = Variant('a{uu}', unlock_retries)
+        self.props.UnlockRetries = unlock_retries
 
     def set_access_technology(self):
         if 'org.ofono.NetworkRegistration' not in self.ofono_interface_props or \
-                self.props['State'].value not in [ModemManagerState.REGISTERED,
+                self.props.State not in [ModemManagerState.REGISTERED,
                                                   ModemManagerState.CONNECTED]:
-            self.props['AccessTechnologies'] = Variant('u', ModemManagerAccessTechnology.UNKNOWN)
-            self.props['SignalQuality'] = Variant('(ub)', [0, False])
+            self.props.AccessTechnologies = ModemManagerAccessTechnology.UNKNOWN
             return
 
         if "Technology" not in self.ofono_interface_props['org.ofono.NetworkRegistration']:
-            self.props['AccessTechnologies'] = Variant('u', ModemManagerAccessTechnology.UNKNOWN)
+            self.props.AccessTechnologies = ModemManagerAccessTechnology.UNKNOWN
             return
 
         ofono_tech = self.ofono_interface_props['org.ofono.NetworkRegistration']["Technology"].value
         Logger.debug ("AccessTechnologies: %s -> %s", ofono_tech, OFONO_TECHNOLOGIES[ofono_tech])
-        self.props['AccessTechnologies'] = Variant('u', OFONO_TECHNOLOGIES[ofono_tech])
+        self.props.AccessTechnologies = OFONO_TECHNOLOGIES[ofono_tech]
         self.mm_cell_type = OFONO_CELL_TYPES[ofono_tech]
 
+    def set_signal_quality(self):
+        if 'org.ofono.NetworkRegistration' not in self.ofono_interface_props or \
+                self.props.State not in [ModemManagerState.REGISTERED,
+                                                  ModemManagerState.CONNECTED]:
+            self.props.SignalQuality = [0, False]
+            return
+
+        if 'Strength' in self.ofono_interface_props['org.ofono.NetworkRegistration']:
+            self.props.SignalQuality = [self.ofono_interface_props['org.ofono.NetworkRegistration']
+                                                                  ['Strength'].value,
+                                        True]
+
     def set_capabilities(self):
         caps = 0
         try:
@@ -471,8 +721,8 @@ class MMModemInterface(ServiceInterface):
             Logger.error("%s", e)
 
         Logger.debug ("SupportedCapabilities: %s", caps)
-        self.props['CurrentCapabilities'] = Variant('u', caps)
-        self.props['SupportedCapabilities'] = Variant('au', [caps])
+        self.props.CurrentCapabilities = caps
+        self.props.SupportedCapabilities = [caps]
 
     def set_supported_modes(self):
         try:
@@ -483,61 +733,93 @@ class MMModemInterface(ServiceInterface):
             for ofono_tech in self.ofono_interface_props['org.ofono.RadioSettings']['AvailableTechnologies'].value:
                 mm_modes |= OFONO_MODES[ofono_tech]
             Logger.debug ("SupportedModes: %s -> %s", mm_modes, MM_MODES[mm_modes])
-            self.props['SupportedModes'] = Variant('a(uu)', MM_MODES[mm_modes])
+            self.props.SupportedModes = MM_MODES[mm_modes]
 
             for mode in MM_MODES[mm_modes]:
                 if mode[1] == mm_pref:
-                    self.props['CurrentModes'] = Variant('(uu)', [mode[0], mm_pref])
+                    self.props.CurrentModes = [mode[0], mm_pref]
                     break
                 elif mode[1] & mm_pref != 0:
-                    self.props['CurrentModes'] = Variant('(uu)', [mm_pref, ModemManagerMode.NONE])
+                    self.props.CurrentModes = [mm_pref, ModemManagerMode.NONE]
                     break
-            Logger.debug ("CurrentModes: %s", self.props['CurrentModes'].value)
+            Logger.debug ("CurrentModes: %s", self.props.CurrentModes)
         except KeyError:
-            self.props['SupportedModes'] = Variant('a(uu)', [[ModemManagerMode.NONE, ModemManagerMode.NONE]])
-            self.props['CurrentModes'] = Variant('(uu)', [ModemManagerMode.NONE, ModemManagerMode.NONE])
+            self.props.SupportedModes = [[ModemManagerMode.NONE, ModemManagerMode.NONE]]
+            self.props.CurrentModes = [ModemManagerMode.NONE, ModemManagerMode.NONE]
         except Exception as e:
             Logger.error("%s", e)
 
-    def set_props(self):
-        old_props = self.props.copy()
-        old_state = self.props['State'].value
+    def set_identity(self):
+        self.props.EquipmentIdentifier = self.ofono_props['Serial'].value if 'Serial' in self.ofono_props else ''
+        self.props.HardwareRevision = self.ofono_props['Revision'].value if 'Revision' in self.ofono_props else ''
+        self.props.Revision = self.ofono_props['SoftwareVersionNumber'].value if 'SoftwareVersionNumber' in self.ofono_props else ''
+        self.props.Manufacturer = self.ofono_props['Manufacturer'].value if 'Manufacturer' in self.ofono_props else 'ofono'
+        self.props.Model = self.ofono_props['Model'].value if 'Model' in self.ofono_props else 'binder'
 
-        self.set_modem_state()
+    def set_props(self, changes=None):
+        """
+        Recomputes the derived properties and emits the ones that changed.
 
-        if old_state != self.props['State'].value:
-            Logger.info("Modem state: %s", ModemManagerState.to_string(self.props['State'].value))
+        changes lists the (interface, property) pairs that changed, see
+        MODEM_DERIVATIONS; only the derivations depending on them run.
+        Without it, everything is recomputed.
+        """
 
-        self.set_sim_state()
-        self.set_access_technology()
-        self.set_capabilities()
-        self.set_supported_modes()
+        if not self.reconciled:
+            return
+
+        if changes is None:
+            pending = set(derivation for derivation, _, _ in MODEM_DERIVATIONS)
+        else:
+            pending = set()
+            for change in changes:
+                pending.update(MODEM_DERIVATIONS_BY_DEPENDENCY.get(change, []))
 
-        self.props['EquipmentIdentifier'] = Variant('s', self.ofono_props['Serial'].value if 'Serial' in self.ofono_props else '')
-        self.props['HardwareRevision'] = Variant('s', self.ofono_props['Revision'].value if 'Revision' in self.ofono_props else '')
-        self.props['Revision'] = Variant('s', self.ofono_props['SoftwareVersionNumber'].value if 'SoftwareVersionNumber' in self.ofono_props else '')
-        self.props['Manufacturer'] = Variant('s', self.ofono_props['Manufacturer'].value if 'Manufacturer' in self.ofono_props else 'ofono')
-        self.props['Model'] = Variant('s', self.ofono_props['Model'].value if 'Model' in self.ofono_props else 'binder')
+        if not pending:
+            return
 
-        if old_state != self.props['State'].value:
-            self.StateChanged(old_state, self.props['State'].value, 1)
+        old_props = {}
+        old_state = self.props.State
+
+        # MODEM_DERIVATIONS is ordered so that a derivation only feeds the
+        # ones coming after it
+        for derivation, _, outputs in MODEM_DERIVATIONS:
+            if derivation not in pending:
+                continue
+
+            for prop in outputs:
+                old_props.setdefault(prop, getattr(self.props, prop))
+
+            getattr(self, derivation)()
+
+            for prop in outputs:
+                if getattr(self.props, prop) != old_props[prop]:
+                    pending.update(MODEM_DERIVATIONS_BY_DEPENDENCY.get((MM_MODEM_INTERFACE, prop), []))
+
+        if old_state != self.props.State:
+            Logger.info("Modem state: %s", ModemManagerState.to_string(self.props.State))
+            self.StateChanged(old_state, self.props.State, 1)
 
         changed_props = {}
-        for prop in self.props:
-            if self.props[prop].value != old_props[prop].value:
-                changed_props.update({ prop: self.props[prop].value })
+        for prop in old_props:
+            if getattr(self.props, prop) != old_props[prop]:
+                changed_props.update({ prop: getattr(self.props, prop) })
 
         self.emit_properties_changed(changed_props)
 
     @method()
+    @async_deadline(60)
     async def Enable(self, enable: 'b'):
-        if self.props['State'].value == -1:
+        await self.operations.run('power', ('Enable', enable), self.doEnable, enable)
+
+    async def doEnable(self, enable):
+        if self.props.State == -1:
             return
 
-        old_state = self.props['State'].value
-        self.props['State'] = Variant('i', 6 if enable else 3)
-        self.StateChanged(old_state, self.props['State'].value, 1)
-        self.emit_properties_changed({'State': self.props['State'].value})
+        old_state = self.props.State
+        self.props.State = 6 if enable else 3
+        self.StateChanged(old_state, self.props.State, 1)
+        self.emit_properties_changed({'State': self.props.State})
 
         try:
             await self.ofono_modem.call_set_property('Online', Variant('b', enable))
@@ -548,25 +830,22 @@ class MMModemInterface(ServiceInterface):
 
     @method()
     def ListBearers(self) -> 'ao':
-        return self.props['Bearers'].value
+        return self.props.Bearers
 
     @method()
+    @async_deadline(60)
     async def CreateBearer(self, properties: 'a{sv}') -> 'o':
         try:
-            return await self.doCreateBearer(properties)
+            return await self.operations.run('bearer', ('CreateBearer', OperationQueue.variants_key(properties)),
+                                             self.doCreateBearer, properties)
         except Exception as e:
             pass
 
     async def doCreateBearer(self, properties):
         global bearer_i
-        connection_manager_tries = 0
 
         # Prevents initial modem connection to fail by waiting for ofono
-        while 'org.ofono.ConnectionManager' not in self.ofono_interfaces and connection_manager_tries < 10:
-            await asyncio.sleep(1)
-            connection_manager_tries += 1
-
-        if 'org.ofono.ConnectionManager' not in self.ofono_interfaces:
+        if not await self.wait_for_ofono_interface('org.ofono.ConnectionManager'):
             return
 
         Logger.debug(f"docreatebearer {bearer_i}")
@@ -578,7 +857,7 @@ class MMModemInterface(ServiceInterface):
         # users would usually have to do
         # set-context-property 0 AccessPointName example.apn && activate-context 1
         # to activate the correct context for ofono2mm to use, lets do it on bearer creation to not need ofono scripts
-        contexts = await self.ofono_interfaces['org.ofono.ConnectionManager'].call_get_contexts()
+        contexts = await self.get_ofono_contexts()
         self.context_names = []
         ctx_idx = 0
         chosen_apn = None
@@ -613,68 +892,91 @@ class MMModemInterface(ServiceInterface):
 
         await ofono_ctx_interface.call_set_property("Protocol", Variant('s', 'ip'))
         mm_bearer_interface.ofono_ctx = ofono_ctx
-        ofono_ctx_interface.on_property_changed(self.ofono_context_changed)
-        self.bus.export(f'/org/freedesktop/ModemManager/Bearer/{bearer_i}', mm_bearer_interface)
-        self.props['Bearers'].value.append(f'/org/freedesktop/ModemManager/Bearer/{bearer_i}')
-        self.bearers[f'/org/freedesktop/ModemManager/Bearer/{bearer_i}'] = mm_bearer_interface
-        self.emit_properties_changed({'Bearers': self.props['Bearers'].value})
+        self.ofono_client.signals.subscribe(ofono_ctx, 'org.ofono.ConnectionContext', 'PropertyChanged', self.ofono_context_changed)
+        bearer_path = f'/org/freedesktop/ModemManager1/Bearer/{bearer_i}'
+        self.watch_bearer(mm_bearer_interface)
+        self.object_manager.export(bearer_path, mm_bearer_interface)
+        self.props.Bearers.append(bearer_path)
+        self.bearers[bearer_path] = mm_bearer_interface
+        self.emit_properties_changed({'Bearers': self.props.Bearers})
         bearer_i += 1
 
-        return f'/org/freedesktop/ModemManager/Bearer/{bearer_i}'
+        return bearer_path
 
     @method()
+    @async_deadline(30)
     async def DeleteBearer(self, path: 'o'):
-        if path in self.props['Bearers'].value:
-            self.props['Bearers'].value.remove(path)
+        # Serialized with CreateBearer and Simple.Connect, which may be
+        # using this bearer
+        await self.operations.run('bearer', ('DeleteBearer', path), self.doDeleteBearer, path)
+
+    async def doDeleteBearer(self, path):
+        if path in self.props.Bearers:
+            self.props.Bearers.remove(path)
             await self.ofono_interfaces['org.ofono.ConnectionManager'].call_remove_context(self.bearers[path].ofono_ctx)
+            self.ofono_client.drop_path(self.bearers[path].ofono_ctx)
+            self.ofono_state.unwatch(self.bearers[path].set_roaming_allowance)
             self.bearers.pop(path)
-            self.bus.unexport(path)
-            self.emit_properties_changed({'Bearers': self.props['Bearers'].value})
+            self.object_manager.unexport(path)
+            self.emit_properties_changed({'Bearers': self.props.Bearers})
 
     @method()
+    @async_deadline(60)
     async def Reset(self):
+        await self.operations.run('power', ('Reset',), self.doReset)
+
+    async def doReset(self):
         await self.ofono_modem.call_set_property('Powered', Variant('b', False))
         await self.ofono_modem.call_set_property('Powered', Variant('b', True))
 
-        old_state = self.props['State'].value
-        self.props['State'] = Variant('i', 6)  # 6 typically represents an enabled state
-        self.StateChanged(old_state, self.props['State'].value, 1)
-        self.emit_properties_changed({'State': self.props['State'].value})
+        old_state = self.props.State
+        self.props.State = 6  # 6 typically represents an enabled state
+        self.StateChanged(old_state, self.props.State, 1)
+        self.emit_properties_changed({'State': self.props.State})
 
         await self.ofono_modem.call_set_property('Online', Variant('b', True))
 
         self.set_props()
 
     @method()
+    @async_deadline(60)
     async def FactoryReset(self, code: 's'):
+        await self.operations.run('power', ('FactoryReset', code), self.doFactoryReset, code)
+
+    async def doFactoryReset(self, code):
         # not quite a factory reset but better than nothing
         await self.ofono_modem.call_set_property('Powered', Variant('b', False))
         await self.ofono_modem.call_set_property('Powered', Variant('b', True))
 
-        old_state = self.props['State'].value
-        self.props['State'] = Variant('i', 6)  # 6 typically represents an enabled state
-        self.StateChanged(old_state, self.props['State'].value, 1)
-        self.emit_properties_changed({'State': self.props['State'].value})
+        old_state = self.props.State
+        self.props.State = 6  # 6 typically represents an enabled state
+        self.StateChanged(old_state, self.props.State, 1)
+        self.emit_properties_changed({'State': self.props.State})
 
         await self.ofono_modem.call_set_property('Online', Variant('b', True))
 
         self.set_props()
 
     @method()
+    @async_deadline(60)
     async def SetPowerState(self, state: 'u'):
+        await self.operations.run('power', ('SetPowerState', state), self.doSetPowerState, state)
+
+    async def doSetPowerState(self, state):
         try:
             await self.ofono_modem.call_set_property('Powered', Variant('b', state > 1))
         except Exception as e:
             pass
 
         if state in [2, 3]:  # If state is 'on' or 'low'
-            old_state = self.props['State'].value
-            self.props['State'] = Variant('i', 6)  # 6 typically represents an enabled state
-            self.StateChanged(old_state, self.props['State'].value, 1)
-            self.emit_properties_changed({'State': self.props['State'].value})
+            old_state = self.props.State
+            self.props.State = 6  # 6 typically represents an enabled state
+            self.StateChanged(old_state, self.props.State, 1)
+            self.emit_properties_changed({'State': self.props.State})
 
             try:
-                await self.ofono_modem.call_set_property('Online', Variant('b', enable))
+                # Low power keeps the radio off
+                await self.ofono_modem.call_set_property('Online', Variant('b', state == 3))
             except Exception as e:
                 pass
 
@@ -682,17 +984,21 @@ class MMModemInterface(ServiceInterface):
 
     @method()
     def SetCurrentCapabilities(self, capabilities: 'u'):
-        self.props['CurrentCapabilities'] = Variant('u', capabilities)
+        self.props.CurrentCapabilities = capabilities
 
     @method()
+    @async_deadline(30)
     async def SetCurrentModes(self, modes: '(uu)'):
-        for supported_modes in self.props['SupportedModes'].value:
+        if not await self.wait_for_ofono_interface('org.ofono.RadioSettings'):
+            return
+
+        for supported_modes in self.props.SupportedModes:
             if supported_modes[1] == modes[1]:
                 value = list(filter(lambda x: OFONO_MODES[x] == modes[1], OFONO_MODES))[0]
                 await self.ofono_interfaces['org.ofono.RadioSettings'].call_set_property('TechnologyPreference', Variant('s', value))
                 return
 
-        for supported_modes in self.props['SupportedModes'].value[::-1]:
+        for supported_modes in self.props.SupportedModes[::-1]:
             if supported_modes[0] & modes[0] != 0:
                 value = list(filter(lambda x: OFONO_MODES[x] == modes[0], OFONO_MODES))[0]
                 await self.ofono_interfaces['org.ofono.RadioSettings'].call_set_property('TechnologyPreference', Variant('s', value))
@@ -702,17 +1008,17 @@ class MMModemInterface(ServiceInterface):
 
     @method()
     def SetCurrentBands(self, bands: 'au'):
-        self.props['CurrentBands'] = Variant('u', bands)
+        self.props.CurrentBands = bands
 
     @method()
     def SetPrimarySimSlot(self, sim_slot: 'u'):
-        self.props['PrimarySimSlot'] = Variant('u', sim_slot)
+        self.props.PrimarySimSlot = sim_slot
 
     @method()
     def GetCellInfo(self) -> 'aa{sv}':
         cell_info = {
             "cell-type": Variant("u", self.mm_cell_type),
-            "serving": Variant("b", self.props['State'].value == 8), # 8 should mean its registered correctly to a network
+            "serving": Variant("b", self.props.State == 8), # 8 should mean its registered correctly to a network
         }
 
         return [cell_info]
@@ -725,144 +1031,7 @@ class MMModemInterface(ServiceInterface):
     def StateChanged(self, old, new, reason) -> 'iiu':
         return [old, new, reason]
 
-    @dbus_property(access=PropertyAccess.READ)
-    def Sim(self) -> 'o':
-        return self.props['Sim'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def SimSlots(self) -> 'ao':
-        return self.props['SimSlots'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def PrimarySimSlot(self) -> 'u':
-        return self.props['PrimarySimSlot'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Bearers(self) -> 'ao':
-        return self.props['Bearers'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def SupportedCapabilities(self) -> 'au':
-        return self.props['SupportedCapabilities'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def CurrentCapabilities(self) -> 'u':
-        return self.props['CurrentCapabilities'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def MaxBearers(self) -> 'u':
-        return self.props['MaxBearers'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def MaxActiveBearers(self) -> 'u':
-        return self.props['MaxActiveBearers'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def MaxActiveMultiplexedBearers(self) -> 'u':
-        return self.props['MaxActiveMultiplexedBearers'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Manufacturer(self) -> 's':
-        return self.props['Manufacturer'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Model(self) -> 's':
-        return self.props['Model'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Revision(self) -> 's':
-        return self.props['Revision'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def HardwareRevision(self) -> 's':
-        return self.props['HardwareRevision'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def DeviceIdentifier(self) -> 's':
-        return self.props['DeviceIdentifier'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Device(self) -> 's':
-        return self.props['Device'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Physdev(self) -> 's':
-        return self.props['Physdev'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Drivers(self) -> 'as':
-        return self.props['Drivers'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Plugin(self) -> 's':
-        return self.props['Plugin'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def PrimaryPort(self) -> 's':
-        return self.props['PrimaryPort'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Ports(self) -> 'a(su)':
-        return self.props['Ports'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def EquipmentIdentifier(self) -> 's':
-        return self.props['EquipmentIdentifier'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def UnlockRequired(self) -> 'u':
-        return self.props['UnlockRequired'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def UnlockRetries(self) -> 'a{uu}':
-        return self.props['UnlockRetries'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def State(self) -> 'i':
-        return self.props['State'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def StateFailedReason(self) -> 'u':
-        return self.props['StateFailedReason'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def AccessTechnologies(self) -> 'u':
-        return self.props['AccessTechnologies'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def SignalQuality(self) -> '(ub)':
-        return self.props['SignalQuality'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def OwnNumbers(self) -> 'as':
-        return self.props['OwnNumbers'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def PowerState(self) -> 'u':
-        return self.props['PowerState'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def SupportedModes(self) -> 'a(uu)':
-        return self.props['SupportedModes'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def CurrentModes(self) -> '(uu)':
-        return self.props['CurrentModes'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def SupportedBands(self) -> 'au':
-        return self.props['SupportedBands'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def CurrentBands(self) -> 'au':
-        return self.props['CurrentBands'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def SupportedIpFamilies(self) -> 'u':
-        return self.props['SupportedIpFamilies'].value
-
     def ofono_changed(self, name, varval):
-        self.ofono_props[name] = varval
         if name == "Interfaces":
             for iface in varval.value:
                 if not (iface in self.ofono_interfaces):
@@ -871,24 +1040,14 @@ class MMModemInterface(ServiceInterface):
                 if not (iface in varval.value):
                     self.loop.create_task(self.remove_ofono_interface(iface))
 
-        self.set_props()
-        if self.mm_modem3gpp_interface:
-            self.mm_modem3gpp_interface.ofono_changed(name, varval)
-        if self.mm_sim_interface:
-            self.mm_sim_interface.ofono_changed(name, varval)
+        self.ofono_state.set_modem_property(name, varval)
 
     def ofono_interface_changed(self, iface):
         def ch(name, varval):
-            if iface in self.ofono_interface_props:
-                self.ofono_interface_props[iface][name] = varval
-                self.set_props()
-                if self.mm_modem3gpp_interface:
-                    self.mm_modem3gpp_interface.ofono_interface_changed(iface)(name, varval)
-                if self.mm_sim_interface:
-                    self.mm_sim_interface.ofono_interface_changed(iface)(name, varval)
+            self.ofono_state.set_interface_property(iface, name, varval)
 
         return ch
 
     def ofono_context_changed(self, propname, value):
         if propname == "Active":
-            self.set_props()
+            self.set_props([('org.ofono.ConnectionContext', 'Active')])
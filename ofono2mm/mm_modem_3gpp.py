@@ -1,9 +1,39 @@
-from dbus_next.service import (ServiceInterface,
-                               method, dbus_property, signal)
-from dbus_next.constants import PropertyAccess
+from dbus_next.service import (method, signal)
 from dbus_next import Variant, DBusError
 
-class MMModem3gppInterface(ServiceInterface):
+from ofono2mm.mm_service import MMServiceInterface
+from ofono2mm.mm_properties import MMPropertySchema
+from ofono2mm.utils import async_deadline
+
+class MMModem3gppInterface(MMServiceInterface):
+    PROPERTIES = MMPropertySchema([
+        ('Imei', 's', ''),
+        ('RegistrationState', 'u', 0), # on runtime idle MM_MODEM_3GPP_REGISTRATION_STATE_IDLE
+        ('OperatorCode', 's', ''),
+        ('OperatorName', 's', ''),
+        ('EnabledFacilityLocks', 'u', 0), # on runtime none MM_MODEM_3GPP_FACILITY_NONE
+        ('SubscriptionState', 'u', 0), # on runtime unknown MM_MODEM_3GPP_SUBSCRIPTION_STATE_UNKNOWN
+        ('EpsUeModeOperation', 'u', 0), # on runtime unknown MM_MODEM_3GPP_PACKET_SERVICE_STATE_UNKNOWN
+        ('Pco', 'a(ubay)', []),
+        ('InitialEpsBearer', 'o', '/'),
+        ('InitialEpsBearerSettings', 'a{sv}', {}),
+        ('PacketServiceState', 'u', 0), # on runtime unknown MM_MODEM_3GPP_PACKET_SERVICE_STATE_UNKNOWN
+        ('Nr5gRegistrationSettings', 'a{sv}', {
+            'mico-mode': Variant('u', 0), # hardcoded value unknown MM_MODEM_3GPP_MICO_MODE_UNKNOWN
+            'dtx-cycle': Variant('u', 0) # hardcoded value unknown MM_MODEM_3GPP_DRX_CYCLE_UNKNOWN
+        }),
+    ])
+
+    # The ofono properties set_props() reads, see OfonoStateMirror
+    OFONO_DEPENDENCIES = [
+        (None, 'Interfaces'),
+        (None, 'Serial'),
+        ('org.ofono.NetworkRegistration', 'Name'),
+        ('org.ofono.NetworkRegistration', 'MobileCountryCode'),
+        ('org.ofono.NetworkRegistration', 'MobileNetworkCode'),
+        ('org.ofono.NetworkRegistration', 'Status'),
+    ]
+
     def __init__(self, index, bus, ofono_client, modem_name, ofono_modem, ofono_props, ofono_interfaces, ofono_interface_props):
         super().__init__('org.freedesktop.ModemManager1.Modem.Modem3gpp')
         self.index = index
@@ -15,62 +45,41 @@ class MMModem3gppInterface(ServiceInterface):
         self.ofono_props = ofono_props
         self.ofono_interfaces = ofono_interfaces
         self.ofono_interface_props = ofono_interface_props
-        self.props = {
-            'Imei': Variant('s', ''),
-            'RegistrationState': Variant('u', 0), # on runtime idle MM_MODEM_3GPP_REGISTRATION_STATE_IDLE
-            'OperatorCode': Variant('s', ''),
-            'OperatorName': Variant('s', ''),
-            'EnabledFacilityLocks': Variant('u', 0), # on runtime none MM_MODEM_3GPP_FACILITY_NONE
-            'SubscriptionState': Variant('u', 0), # on runtime unknown MM_MODEM_3GPP_SUBSCRIPTION_STATE_UNKNOWN
-            'EpsUeModeOperation': Variant('u', 0), # on runtime unknown MM_MODEM_3GPP_PACKET_SERVICE_STATE_UNKNOWN
-            'Pco': Variant('a(ubay)', []),
-            'InitialEpsBearer': Variant('o', '/'),
-            'InitialEpsBearerSettings': Variant('a{sv}', {}),
-            'PacketServiceState': Variant('u', 0), # on runtime unknown MM_MODEM_3GPP_PACKET_SERVICE_STATE_UNKNOWN
-            'Nr5gRegistrationSettings': Variant('a{sv}', {
-                'mico-mode': Variant('u', 0), # hardcoded value unknown MM_MODEM_3GPP_MICO_MODE_UNKNOWN
-                'dtx-cycle': Variant('u', 0) # hardcoded value unknown MM_MODEM_3GPP_DRX_CYCLE_UNKNOWN
-            })
-        }
-
-    def set_props(self):
-        old_props = self.props.copy()
+
+    def set_props(self, changes=None):
+        old_props = self.props.snapshot()
         if 'org.ofono.NetworkRegistration' in self.ofono_interface_props:
-            self.props['OperatorName'] = Variant('s', self.ofono_interface_props['org.ofono.NetworkRegistration']['Name'].value if "Name" in self.ofono_interface_props['org.ofono.NetworkRegistration'] else '')
+            self.props.OperatorName = self.ofono_interface_props['org.ofono.NetworkRegistration']['Name'].value if "Name" in self.ofono_interface_props['org.ofono.NetworkRegistration'] else ''
             MCC = self.ofono_interface_props['org.ofono.NetworkRegistration']['MobileCountryCode'].value if "MobileCountryCode" in self.ofono_interface_props['org.ofono.NetworkRegistration'] else ''
             MNC = self.ofono_interface_props['org.ofono.NetworkRegistration']['MobileNetworkCode'].value if "MobileNetworkCode" in self.ofono_interface_props['org.ofono.NetworkRegistration'] else ''
-            self.props['OperatorCode'] = Variant('s', f"{MCC}{MNC}" if MCC != '' else '')
+            self.props.OperatorCode = f"{MCC}{MNC}" if MCC != '' else ''
             if 'Status' in self.ofono_interface_props['org.ofono.NetworkRegistration']:
                 if self.ofono_interface_props['org.ofono.NetworkRegistration']['Status'].value == "unregistered":
-                    self.props['RegistrationState'] = Variant('u', 0) # idle MM_MODEM_3GPP_REGISTRATION_STATE_IDLE
+                    self.props.RegistrationState = 0 # idle MM_MODEM_3GPP_REGISTRATION_STATE_IDLE
                 elif self.ofono_interface_props['org.ofono.NetworkRegistration']['Status'].value == "registered":
-                    self.props['RegistrationState'] = Variant('u', 1) # home MM_MODEM_3GPP_REGISTRATION_STATE_HOME
+                    self.props.RegistrationState = 1 # home MM_MODEM_3GPP_REGISTRATION_STATE_HOME
                 elif self.ofono_interface_props['org.ofono.NetworkRegistration']['Status'].value == "searching":
-                    self.props['RegistrationState'] = Variant('u', 2) # searching MM_MODEM_3GPP_REGISTRATION_STATE_SEARCHING
+                    self.props.RegistrationState = 2 # searching MM_MODEM_3GPP_REGISTRATION_STATE_SEARCHING
                 elif self.ofono_interface_props['org.ofono.NetworkRegistration']['Status'].value == "denied":
-                    self.props['RegistrationState'] = Variant('u', 3) # denied MM_MODEM_3GPP_REGISTRATION_STATE_DENIED
+                    self.props.RegistrationState = 3 # denied MM_MODEM_3GPP_REGISTRATION_STATE_DENIED
                 elif self.ofono_interface_props['org.ofono.NetworkRegistration']['Status'].value == "unknown":
-                    self.props['RegistrationState'] = Variant('u', 4) # unknown MM_MODEM_3GPP_REGISTRATION_STATE_UNKNOWN
+                    self.props.RegistrationState = 4 # unknown MM_MODEM_3GPP_REGISTRATION_STATE_UNKNOWN
                 elif self.ofono_interface_props['org.ofono.NetworkRegistration']['Status'].value == "roaming":
-                    self.props['RegistrationState'] = Variant('u', 5) # MM_MODEM_3GPP_REGISTRATION_STATE_ROAMING
+                    self.props.RegistrationState = 5 # MM_MODEM_3GPP_REGISTRATION_STATE_ROAMING
             else:
-                self.props['RegistrationState'] = Variant('u', 4) # unknown MM_MODEM_3GPP_REGISTRATION_STATE_UNKNOWN
+                self.props.RegistrationState = 4 # unknown MM_MODEM_3GPP_REGISTRATION_STATE_UNKNOWN
         else:
-            self.props['OperatorName'] = Variant('s', '')
-            self.props['OperatorCode'] = Variant('s', '')
-            self.props['RegistrationState'] = Variant('u', 4) # unknown MM_MODEM_3GPP_REGISTRATION_STATE_UNKNOWN
-
-        self.props['Imei'] = Variant('s', self.ofono_props['Serial'].value if 'Serial' in self.ofono_props else '')
-        self.props['EnabledFacilityLocks'] = Variant('u', 0) # none MM_MODEM_3GPP_FACILITY_NONE
+            self.props.OperatorName = ''
+            self.props.OperatorCode = ''
+            self.props.RegistrationState = 4 # unknown MM_MODEM_3GPP_REGISTRATION_STATE_UNKNOWN
 
-        changed_props = {}
-        for prop in self.props:
-            if self.props[prop].value != old_props[prop].value:
-                changed_props.update({ prop: self.props[prop].value })
+        self.props.Imei = self.ofono_props['Serial'].value if 'Serial' in self.ofono_props else ''
+        self.props.EnabledFacilityLocks = 0 # none MM_MODEM_3GPP_FACILITY_NONE
 
-        self.emit_properties_changed(changed_props)
+        self.emit_properties_changed(self.props.changes(old_props))
 
     @method()
+    @async_deadline(60)
     async def Register(self, operator_id: 's'):
         if operator_id == "":
             if 'org.ofono.NetworkRegistration' in self.ofono_interfaces:
@@ -87,6 +96,7 @@ class MMModem3gppInterface(ServiceInterface):
 
 
     @method()
+    @async_deadline(180)
     async def Scan(self) -> 'aa{sv}':
         operators = []
         ofono_operators = await self.ofono_interfaces['org.ofono.NetworkRegistration'].call_scan()
@@ -144,63 +154,3 @@ class MMModem3gppInterface(ServiceInterface):
     @method()
     async def SetPacketServiceState(self) -> 'u':
         pass
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Imei(self) -> 's':
-        return self.props['Imei'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def RegistrationState(self) -> 'u':
-        return self.props['RegistrationState'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def OperatorCode(self) -> 's':
-        return self.props['OperatorCode'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def OperatorName(self) -> 's':
-        return self.props['OperatorName'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def EnabledFacilityLocks(self) -> 'u':
-        return self.props['EnabledFacilityLocks'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def SubscriptionState(self) -> 'u':
-        return self.props['SubscriptionState'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def EpsUeModeOperation(self) -> 'u':
-        return self.props['EpsUeModeOperation'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Pco(self) -> 'a(ubay)':
-        return self.props['Pco'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def InitialEpsBearer(self) -> 'o':
-        return self.props['InitialEpsBearer'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def InitialEpsBearerSettings(self) -> 'a{sv}':
-        return self.props['InitialEpsBearerSettings'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def PacketServiceState(self) -> 'u':
-        return self.props['PacketServiceState'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Nr5gRegistrationSettings(self) -> 'a{sv}':
-        return self.props['Nr5gRegistrationSettings'].value
-
-    def ofono_changed(self, name, varval):
-        self.ofono_props[name] = varval
-        self.set_props()
-
-    def ofono_interface_changed(self, iface):
-        def ch(name, varval):
-            if iface in self.ofono_interface_props:
-                self.ofono_interface_props[iface][name] = varval
-            self.set_props()
-
-        return ch
@@ -1,8 +1,10 @@
-from dbus_next.service import ServiceInterface, method, dbus_property, signal
+from dbus_next.service import method, dbus_property, signal
 from dbus_next.constants import PropertyAccess
 from dbus_next import Variant
 
-class MMModem3gppUssdInterface(ServiceInterface):
+from ofono2mm.mm_service import MMServiceInterface
+
+class MMModem3gppUssdInterface(MMServiceInterface):
     def __init__(self, index, bus, ofono_client, modem_name, ofono_modem, ofono_props, ofono_interfaces, ofono_interface_props):
         super().__init__('org.freedesktop.ModemManager1.Modem.Modem3gpp.Ussd')
         self.index = index
@@ -52,8 +54,8 @@ class MMModem3gppUssdInterface(ServiceInterface):
             else:
                 self.props['State'] = Variant('u', 0) # unknown MM_MODEM_3GPP_USSD_SESSION_STATE_UNKNOWN
 
-            self.ofono_interfaces['org.ofono.SupplementaryServices'].on_notification_received(self.save_notification_received)
-            self.ofono_interfaces['org.ofono.SupplementaryServices'].on_request_received(self.save_request_received)
+            self.ofono_client.signals.subscribe(self.modem_name, 'org.ofono.SupplementaryServices', 'NotificationReceived', self.save_notification_received)
+            self.ofono_client.signals.subscribe(self.modem_name, 'org.ofono.SupplementaryServices', 'RequestReceived', self.save_request_received)
         except Exception as e:
             self.props['State'] = Variant('u', 0) # unknown MM_MODEM_3GPP_USSD_SESSION_STATE_UNKNOWN
 
@@ -1,12 +1,18 @@
-from dbus_next.service import ServiceInterface, method, dbus_property, signal
+from dbus_next.service import method, dbus_property, signal
 from dbus_next.constants import PropertyAccess
 from dbus_next import Variant
+
+from ofono2mm.mm_service import MMServiceInterface
+
 from datetime import datetime
 import gi
 gi.require_version('Geoclue', '2.0')
 from gi.repository import Geoclue
 
-class MMModemLocationInterface(ServiceInterface):
+class MMModemLocationInterface(MMServiceInterface):
+    # Some getters do not read props
+    CACHE_GET_ALL = False
+
     def __init__(self, modem):
         super().__init__('org.freedesktop.ModemManager1.Modem.Location')
         self.modem = modem
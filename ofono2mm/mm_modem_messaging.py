@@ -1,14 +1,26 @@
-from dbus_next.service import (ServiceInterface,
-                               method, dbus_property, signal)
+from dbus_next.service import (method, dbus_property, signal)
 from dbus_next.constants import PropertyAccess
 from dbus_next import Variant
 
+from ofono2mm.mm_service import MMServiceInterface
 from ofono2mm.mm_sms import MMSmsInterface
+from ofono2mm.sms_store import STORED_PROPS
+from ofono2mm.utils import async_deadline
+
+import asyncio
 
 message_i = 1
 
-class MMModemMessagingInterface(ServiceInterface):
-    def __init__(self, index, bus, ofono_client, modem_name, ofono_modem, ofono_props, ofono_interfaces, ofono_interface_props):
+class MMModemMessagingInterface(MMServiceInterface):
+    # init_messages() follows org.ofono.MessageManager coming and going
+    OFONO_DEPENDENCIES = [
+        (None, 'Interfaces'),
+    ]
+
+    # Stored messages exported per loop iteration at startup
+    LOAD_BATCH = 100
+
+    def __init__(self, index, bus, ofono_client, modem_name, ofono_modem, ofono_props, ofono_interfaces, ofono_interface_props, mm_modem):
         super().__init__('org.freedesktop.ModemManager1.Modem.Messaging')
         self.index = index
         self.bus = bus
@@ -19,6 +31,17 @@ class MMModemMessagingInterface(ServiceInterface):
         self.ofono_props = ofono_props
         self.ofono_interfaces = ofono_interfaces
         self.ofono_interface_props = ofono_interface_props
+        self.mm_modem = mm_modem
+        self.sms_store = mm_modem.sms_store
+        self.load_task = None
+        if self.sms_store is not None:
+            # New messages must not take the path of a stored one
+            global message_i
+            message_i = max(message_i, self.sms_store.max_stored_index + 1)
+        # MM path to MMSmsInterface, and to its position in Messages.
+        # Messages is updated in place, List hands it out as is.
+        self.messages = {}
+        self.message_positions = {}
         self.props = {
             'Messages': Variant('ao', []),
             'SupportedStorages': Variant('au', []),
@@ -26,19 +49,90 @@ class MMModemMessagingInterface(ServiceInterface):
         }
 
     def set_props(self):
-        old_props = self.props
+        old_props = self.props.copy()
 
         for prop in self.props:
             if self.props[prop].value != old_props[prop].value:
                 self.emit_properties_changed({prop: self.props[prop].value})
 
-    async def init_messages(self):
+    def init_messages(self, changes=None):
+        # Called again whenever the ofono interfaces change, subscribing
+        # twice is harmless
         if 'org.ofono.MessageManager' in self.ofono_interfaces:
-            self.ofono_interfaces['org.ofono.MessageManager'].on_incoming_message(self.add_incoming_message)
+            self.ofono_client.signals.subscribe(self.modem_name, 'org.ofono.MessageManager', 'IncomingMessage', self.add_incoming_message)
 
-    def add_incoming_message(self, msg, props):
+    def start_loading(self):
+        if self.sms_store is not None and self.load_task is None:
+            self.load_task = asyncio.get_running_loop().create_task(self.load_messages())
+
+    def teardown(self):
+        if self.load_task is not None:
+            self.load_task.cancel()
+            self.load_task = None
+
+    async def load_messages(self):
+        """
+        Exports the messages of this modem kept in the SMS store,
+        LOAD_BATCH at a time so a large store does not hold up the loop.
+        Each batch is announced in one go by the object manager.
+        """
+
+        stored = await self.sms_store.load(self.modem_name)
+
+        for start in range(0, len(stored), self.LOAD_BATCH):
+            for path, values in stored[start:start + self.LOAD_BATCH]:
+                if path in self.messages:
+                    continue
+
+                mm_sms_interface = self.new_sms_interface()
+                for name, value in values.items():
+                    if name in STORED_PROPS:
+                        setattr(mm_sms_interface.props, name, value)
+
+                self.insert_message(path, mm_sms_interface)
+
+            self.emit_properties_changed({'Messages': self.props['Messages'].value})
+            await asyncio.sleep(0)
+
+        self.load_task = None
+
+    def new_sms_interface(self):
+        return MMSmsInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
+
+    def insert_message(self, path, mm_sms_interface):
+        self.messages[path] = mm_sms_interface
+        self.message_positions[path] = len(self.props['Messages'].value)
+        self.props['Messages'].value.append(path)
+        self.mm_modem.object_manager.export(path, mm_sms_interface)
+
+    def remove_message(self, path):
+        # Move the last path into the hole instead of shifting the list
+        messages = self.props['Messages'].value
+        position = self.message_positions.pop(path)
+        last = messages.pop()
+        if last != path:
+            messages[position] = last
+            self.message_positions[last] = position
+
+        self.messages.pop(path)
+        self.mm_modem.object_manager.unexport(path)
+
+    def add_message(self, mm_sms_interface, received):
         global message_i
-        mm_sms_interface = MMSmsInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
+        path = f'/org/freedesktop/ModemManager1/SMS/{message_i}'
+        message_i += 1
+
+        self.insert_message(path, mm_sms_interface)
+        self.emit_properties_changed({'Messages': self.props['Messages'].value})
+        self.Added(path, received)
+
+        if self.sms_store is not None:
+            self.sms_store.add(path, self.modem_name, mm_sms_interface.props)
+
+        return path
+
+    def add_incoming_message(self, msg, props):
+        mm_sms_interface = self.new_sms_interface()
         mm_sms_interface.props.update({
             'State': Variant('u', 3), # hardcoded value received MM_SMS_STATE_RECEIVED
             'PduType': Variant('u', 1), # hardcoded value deliver MM_SMS_PDU_TYPE_DELIVER
@@ -47,11 +141,7 @@ class MMModemMessagingInterface(ServiceInterface):
             'Timestamp': props['SentTime']
         })
 
-        self.bus.export(f'/org/freedesktop/ModemManager1/SMS/{message_i}', mm_sms_interface)
-        self.props['Messages'].value.append(f'/org/freedesktop/ModemManager1/SMS/{message_i}')
-        self.emit_properties_changed({'Messages': self.props['Messages'].value})
-        self.Added(f'/org/freedesktop/ModemManager1/SMS/{message_i}', True)
-        message_i += 1
+        self.add_message(mm_sms_interface, True)
 
     @method()
     async def List(self) -> 'ao':
@@ -59,36 +149,33 @@ class MMModemMessagingInterface(ServiceInterface):
 
     @method()
     async def Delete(self, path: 'o'):
-        if path in self.props['Messages'].value:
-            self.props['Messages'].value.remove(path)
-            self.bus.unexport(path)
+        if path in self.messages:
+            self.remove_message(path)
             self.emit_properties_changed({'Messages': self.props['Messages'].value})
             self.Deleted(path)
 
+            if self.sms_store is not None:
+                self.sms_store.delete(path)
+
     @method()
+    @async_deadline(30)
     async def Create(self, properties: 'a{sv}') -> 'o':
-        global message_i
         if 'number' not in properties or 'text' not in properties:
             return
 
-        mm_sms_interface = MMSmsInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
+        mm_sms_interface = self.new_sms_interface()
         mm_sms_interface.props.update({
             'Text': properties['text'],
             'Number': properties['number'],
             'DeliveryReportRequest': properties['delivery-report-request'] if 'delivery-report-request' in properties else Variant('b', False)
         })
 
-        self.bus.export(f'/org/freedesktop/ModemManager1/SMS/{message_i}', mm_sms_interface)
-        self.props['Messages'].value.append(f'/org/freedesktop/ModemManager1/SMS/{message_i}')
-        self.emit_properties_changed({'Messages': self.props['Messages'].value})
-        self.Added(f'/org/freedesktop/ModemManager1/SMS/{message_i}', True)
-        message_i_old = message_i
-        message_i += 1
+        path = self.add_message(mm_sms_interface, True)
 
-        if 'org.ofono.MessageManager' in self.ofono_interfaces:
+        if await self.mm_modem.wait_for_ofono_interface('org.ofono.MessageManager'):
             ofono_sms_path = await self.ofono_interfaces['org.ofono.MessageManager'].call_send_message(properties['number'].value, properties['text'].value)
 
-        return f'/org/freedesktop/ModemManager1/SMS/{message_i_old}'
+        return path
 
     @signal()
     def Added(self, path, received) -> 'ob':
@@ -109,15 +196,3 @@ class MMModemMessagingInterface(ServiceInterface):
     @dbus_property(access=PropertyAccess.READ)
     def DefaultStorage(self) -> 'u':
         return self.props['DefaultStorage'].value
-
-    def ofono_changed(self, name, varval):
-        self.ofono_props[name] = varval
-        self.set_props()
-
-    def ofono_interface_changed(self, iface):
-        def ch(name, varval):
-            if iface in self.ofono_interface_props:
-                self.ofono_interface_props[iface][name] = varval
-            self.set_props()
-
-        return ch
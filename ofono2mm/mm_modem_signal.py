@@ -1,8 +1,20 @@
-from dbus_next.service import ServiceInterface, method, dbus_property, signal
+from dbus_next.service import method, dbus_property, signal
 from dbus_next.constants import PropertyAccess
 from dbus_next import Variant
 
-class MMModemSignalInterface(ServiceInterface):
+from ofono2mm.mm_service import MMServiceInterface
+
+class MMModemSignalInterface(MMServiceInterface):
+    # The ofono properties set_props() reads, see OfonoStateMirror
+    OFONO_DEPENDENCIES = [
+        (None, 'Interfaces'),
+        ('org.ofono.NetworkMonitor', 'ReceivedSignalStrength'),
+        ('org.ofono.NetworkMonitor', 'BitErrorRate'),
+        ('org.ofono.NetworkMonitor', 'ReferenceSignalReceivedQuality'),
+        ('org.ofono.NetworkMonitor', 'ReferenceSignalReceivedPower'),
+        ('org.ofono.NetworkMonitor', 'ReceivedSignalCodePower'),
+    ]
+
     def __init__(self, mm_modem, ofono_interfaces, ofono_interface_props):
         super().__init__('org.freedesktop.ModemManager1.Modem.Signal')
         self.mm_modem = mm_modem
@@ -49,7 +61,7 @@ class MMModemSignalInterface(ServiceInterface):
             })
         }
 
-    async def set_props(self):
+    def set_props(self, changes=None):
         if 'org.ofono.NetworkMonitor' in self.ofono_interface_props:
             self.props['Cdma'].value['rssi'] = Variant('d', self.ofono_interface_props['org.ofono.NetworkMonitor']['ReceivedSignalStrength'].value if "ReceivedSignalStrength" in self.ofono_interface_props['org.ofono.NetworkMonitor'] else 0)
             self.props['Evdo'].value['rssi'] = Variant('d', self.ofono_interface_props['org.ofono.NetworkMonitor']['ReceivedSignalStrength'].value if "ReceivedSignalStrength" in self.ofono_interface_props['org.ofono.NetworkMonitor'] else 0)
@@ -95,11 +107,6 @@ class MMModemSignalInterface(ServiceInterface):
 
     @method()
     async def Setup(self, rate: 'u'):
-        try:
-            await self.set_props()
-        except Exception as e:
-            pass
-
         self.props['Rate'] = Variant('u', rate)
 
     @method()
@@ -1,10 +1,23 @@
-from dbus_next.service import (ServiceInterface, method, dbus_property, signal)
+from dbus_next.service import (method, dbus_property, signal)
 from dbus_next.constants import PropertyAccess
 from dbus_next import Variant
 
+from ofono2mm.mm_service import MMServiceInterface
 from ofono2mm.mm_types import ModemManagerState, ModemManagerAccessTechnology
+from ofono2mm.utils import OperationQueue, async_deadline
+
+class MMModemSimpleInterface(MMServiceInterface):
+    # The ofono properties set_props() reads, see OfonoStateMirror
+    OFONO_DEPENDENCIES = [
+        (None, 'Interfaces'),
+        ('org.ofono.NetworkRegistration', 'Name'),
+        ('org.ofono.NetworkRegistration', 'MobileCountryCode'),
+        ('org.ofono.NetworkRegistration', 'MobileNetworkCode'),
+        ('org.ofono.NetworkRegistration', 'Strength'),
+        ('org.ofono.NetworkRegistration', 'Status'),
+        ('org.ofono.NetworkRegistration', 'Technology'),
+    ]
 
-class MMModemSimpleInterface(ServiceInterface):
     def __init__(self, mm_modem, ofono_interfaces, ofono_interface_props):
         super().__init__('org.freedesktop.ModemManager1.Modem.Simple')
         self.mm_modem = mm_modem
@@ -24,8 +37,7 @@ class MMModemSimpleInterface(ServiceInterface):
              'cdma-nid': Variant('u', 0)
         }
 
-    async def set_props(self):
-        old_props = self.props.copy()
+    def set_props(self, changes=None):
         if 'org.ofono.NetworkRegistration' in self.ofono_interface_props:
             self.props['m3gpp-operator-name'] = Variant('s', self.ofono_interface_props['org.ofono.NetworkRegistration']['Name'].value if "Name" in self.ofono_interface_props['org.ofono.NetworkRegistration'] else '')
 
@@ -92,29 +104,32 @@ class MMModemSimpleInterface(ServiceInterface):
             self.props['access-technologies'] = Variant('u', ModemManagerAccessTechnology.UNKNOWN)
 
     @method()
+    @async_deadline(90)
     async def Connect(self, properties: 'a{sv}') -> 'o':
-        try:
-            await self.props()
-        except Exception as e:
-            pass
+        # Only picking or creating the bearer holds the 'bearer' queue,
+        # activating it retries and may take until the deadline
+        bearer = await self.mm_modem.operations.run('bearer', ('Connect', OperationQueue.variants_key(properties)),
+                                                    self.get_bearer, properties)
+        if bearer in self.mm_modem.bearers:
+            await self.mm_modem.bearers[bearer].doConnect()
+
+        return bearer
 
+    async def get_bearer(self, properties):
         for b in self.mm_modem.bearers:
             if self.mm_modem.bearers[b].props['Properties'].value['apn'] == properties['apn']:
                 await self.mm_modem.bearers[b].add_auth_ofono(properties['username'].value if 'username' in properties else '',
                                                                 properties['password'].value if 'password' in properties else '')
                 self.mm_modem.bearers[b].props['Properties'] = Variant('a{sv}', properties)
-                await self.mm_modem.bearers[b].doConnect()
                 return b
 
         try:
-            bearer = await self.mm_modem.doCreateBearer(properties)
-            await self.mm_modem.bearers[bearer].doConnect()
+            return await self.mm_modem.doCreateBearer(properties)
         except Exception as e:
-            bearer = f'/org/freedesktop/ModemManager/Bearer/0'
-
-        return bearer
+            return f'/org/freedesktop/ModemManager1/Bearer/0'
 
     @method()
+    @async_deadline(30)
     async def Disconnect(self, path: 'o'):
         if path == '/':
             for b in self.mm_modem.bearers:
@@ -130,5 +145,5 @@ class MMModemSimpleInterface(ServiceInterface):
 
     @method()
     async def GetStatus(self) -> 'a{sv}':
-        await self.set_props()
+        # Kept up to date by set_props()
         return self.props
@@ -1,9 +1,14 @@
 from datetime import datetime, timedelta, timezone
-from dbus_next.service import (ServiceInterface, method, dbus_property, signal)
+from dbus_next.service import (method, dbus_property, signal)
 from dbus_next.constants import PropertyAccess
 from dbus_next import Variant
 
-class MMModemTimeInterface(ServiceInterface):
+from ofono2mm.mm_service import MMServiceInterface
+
+class MMModemTimeInterface(MMServiceInterface):
+    # Some getters do not read props
+    CACHE_GET_ALL = False
+
     def __init__(self, index, bus, ofono_client, modem_name, ofono_modem, ofono_props, ofono_interfaces, ofono_interface_props):
         super().__init__('org.freedesktop.ModemManager1.Modem.Time')
         self.index = index
@@ -24,7 +29,7 @@ class MMModemTimeInterface(ServiceInterface):
 
     async def init_time(self):
         if 'org.ofono.NetworkTime' in self.ofono_interfaces:
-            self.ofono_interfaces['org.ofono.NetworkTime'].on_network_time_changed(self.update_time)
+            self.ofono_client.signals.subscribe(self.modem_name, 'org.ofono.NetworkTime', 'NetworkTimeChanged', self.update_time)
 
     async def update_time(self, time):
         # print(time)
@@ -1,17 +1,122 @@
-from dbus_next.service import ServiceInterface, method, dbus_property, signal
+from dbus_next.service import method, dbus_property, signal
 from dbus_next.constants import PropertyAccess
-from dbus_next import Variant
+from dbus_next import Variant, DBusError
 
+from ofono2mm.mm_service import MMServiceInterface
 from ofono2mm.mm_call import MMCallInterface
+from ofono2mm.mm_types import ModemManagerCallState, ModemManagerCallStateReason, ModemManagerCallDirection, \
+                              OFONO_CALL_STATES, OFONO_CALL_DIRECTIONS
 
 from ofono2mm.logger import Logger
+from ofono2mm.utils import async_deadline
 
-import time
+from collections import deque
+
+import asyncio
 
 call_i = 1
 
-class MMModemVoiceInterface(ServiceInterface):
-    def __init__(self, index, bus, ofono_client, modem_name, ofono_modem, ofono_props, ofono_interfaces, ofono_interface_props):
+class PostCallDataRestore:
+    """
+    Reactivates the internet contexts of a modem once its last voice call
+    is gone, as some carriers don't bring data back after a call.
+
+    Usage:
+
+    data_restore = PostCallDataRestore(mm_modem)
+    data_restore.schedule() # a call was removed
+    data_restore.cancel()   # a call was added
+
+    Contexts are only touched SETTLE_DELAY seconds after the last call
+    ended. A context that does not report Active within ACTIVE_TIMEOUT
+    is tried again with an exponential backoff, up to MAX_ATTEMPTS times.
+    Nothing ever blocks the event loop.
+    """
+
+    SETTLE_DELAY = 2
+    ACTIVE_TIMEOUT = 10
+    MIN_BACKOFF = 2
+    MAX_BACKOFF = 30
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, mm_modem):
+        self.mm_modem = mm_modem
+        self.ofono_client = mm_modem.ofono_client
+        self.task = None
+
+    def schedule(self):
+        self.cancel()
+        self.task = asyncio.get_running_loop().create_task(self.restore())
+
+    def cancel(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.task = None
+
+    async def restore(self):
+        await asyncio.sleep(self.SETTLE_DELAY)
+
+        if 'org.ofono.ConnectionManager' not in self.mm_modem.ofono_interfaces:
+            return
+
+        try:
+            contexts = await self.mm_modem.get_ofono_contexts()
+        except Exception as e:
+            Logger.warning("Not restoring data after the call, contexts unavailable: %s", e)
+            return
+
+        paths = [ctx[0] for ctx in contexts
+                 if ctx[1].get('Type', Variant('s', '')).value.lower() == 'internet'
+                 and ctx[1].get('AccessPointName', Variant('s', '')).value
+                 and not ctx[1].get('Active', Variant('b', False)).value]
+
+        for path in paths:
+            await self.restore_context(path)
+
+    async def restore_context(self, path):
+        active = asyncio.Event()
+
+        def context_changed(propname, value):
+            if propname == 'Active' and value.value:
+                active.set()
+
+        self.ofono_client.signals.subscribe(path, 'org.ofono.ConnectionContext', 'PropertyChanged', context_changed)
+        try:
+            backoff = self.MIN_BACKOFF
+            for attempt in range(1, self.MAX_ATTEMPTS + 1):
+                ctx_interface = self.ofono_client["ofono_context"][path]['org.ofono.ConnectionContext']
+                try:
+                    await ctx_interface.call_set_property("Active", Variant('b', True))
+                except DBusError as e:
+                    # InProgress and friends, ofono may still bring it up
+                    Logger.debug("Activating %s after the call, attempt %d: %s", path, attempt, e)
+
+                try:
+                    await asyncio.wait_for(active.wait(), self.ACTIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+                else:
+                    Logger.debug("Data context %s restored after %d attempt(s)", path, attempt)
+                    return
+
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.MAX_BACKOFF)
+
+            Logger.warning("Could not restore data context %s after the call", path)
+        finally:
+            self.ofono_client.signals.unsubscribe(path, 'org.ofono.ConnectionContext', 'PropertyChanged', context_changed)
+
+class MMModemVoiceInterface(MMServiceInterface):
+    # Number of MMCallInterface objects kept ready for new calls
+    CALL_POOL_SIZE = 2
+
+    # The ofono properties set_props() reads, see OfonoStateMirror
+    OFONO_DEPENDENCIES = [
+        (None, 'Interfaces'),
+        ('org.ofono.SimManager', 'FixedDialing'),
+    ]
+
+    def __init__(self, index, bus, ofono_client, modem_name, ofono_modem, ofono_props, ofono_interfaces, ofono_interface_props, mm_modem):
         super().__init__('org.freedesktop.ModemManager1.Modem.Voice')
         self.index = index
         self.bus = bus
@@ -22,96 +127,180 @@ class MMModemVoiceInterface(ServiceInterface):
         self.ofono_props = ofono_props
         self.ofono_interfaces = ofono_interfaces
         self.ofono_interface_props = ofono_interface_props
+        self.mm_modem = mm_modem
+        self.data_restore = PostCallDataRestore(mm_modem)
+        # ofono VoiceCall path to MM Call path, and back
+        self.ofono_to_mm_calls = {}
+        self.mm_to_ofono_calls = {}
+        # MM path to MMCallInterface of the exported calls
+        self.call_interfaces = {}
+        # Call objects built ahead of time, so a ringing call only needs
+        # to be filled in and exported
+        self.call_pool = []
+        self.call_pool_refill = None
+        # The last Dial to CallAdded and ofono CallAdded to MM CallAdded
+        # latencies
+        self.dial_latencies = deque(maxlen=100)
+        self.ring_latencies = deque(maxlen=100)
         self.props = {
             'Calls': Variant('ao', []),
             'EmergencyOnly': Variant('b', False),
         }
 
-    def set_props(self):
-        old_props = self.props
+    def set_props(self, changes=None):
+        old_props = self.props.copy()
+
+        if 'org.ofono.SimManager' in self.ofono_interface_props and 'FixedDialing' in self.ofono_interface_props['org.ofono.SimManager']:
+            self.props['EmergencyOnly'] = Variant('b', self.ofono_interface_props['org.ofono.SimManager']['FixedDialing'].value)
+        else:
+            self.props['EmergencyOnly'] = Variant('b', False)
 
         for prop in self.props:
             if self.props[prop].value != old_props[prop].value:
                 self.emit_properties_changed({prop: self.props[prop].value})
 
     async def init_calls(self):
-        if 'org.ofono.SimManager' in self.ofono_interfaces and 'FixedDialing' in self.ofono_interface_props['org.ofono.SimManager']:
-            self.props['EmergencyOnly'] = Variant('b', self.ofono_interface_props['org.ofono.SimManager']['FixedDialing'].value)
-        else:
-            self.props['EmergencyOnly'] = Variant('b', False)
-
         if 'org.ofono.VoiceCallManager' in self.ofono_interfaces:
-            self.ofono_interfaces['org.ofono.VoiceCallManager'].on_call_added(self.add_call)
+            self.ofono_client.signals.subscribe(self.modem_name, 'org.ofono.VoiceCallManager', 'CallAdded', self.add_call)
 
         if 'org.ofono.VoiceCallManager' in self.ofono_interfaces:
-            self.ofono_interfaces['org.ofono.VoiceCallManager'].on_call_removed(self.remove_call)
+            self.ofono_client.signals.subscribe(self.modem_name, 'org.ofono.VoiceCallManager', 'CallRemoved', self.remove_call)
 
-    async def add_call(self, path, props):
-        global call_i
-        if props['State'].value == 'incoming':
-            call_i += 1
-            if 'org.ofono.SimManager' in self.ofono_interfaces and 'FixedDialing' in self.ofono_interface_props['org.ofono.SimManager']:
-                self.props['EmergencyOnly'] = Variant('b', self.ofono_interface_props['org.ofono.SimManager']['FixedDialing'].value)
-            else:
-                self.props['EmergencyOnly'] = Variant('b', False)
+        self.refill_call_pool()
+
+    def teardown(self):
+        """
+        Stops everything still scheduled for the calls of a modem that
+        went away. The call objects themselves are unexported by the modem.
+        """
+
+        self.data_restore.cancel()
+        if self.call_pool_refill is not None:
+            self.call_pool_refill.cancel()
+            self.call_pool_refill = None
+        self.call_pool = []
+
+        for mm_call_interface in self.call_interfaces.values():
+            mm_call_interface.teardown()
 
-            mm_call_interface = MMCallInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
-            mm_call_interface.props.update({
-                'State': Variant('i', 3), # ringing in MM_CALL_STATE_RINGING_IN
-                'StateReason': Variant('i', 2), # incoming new MM_CALL_STATE_REASON_INCOMING_NEW
-                'Direction': Variant('i', 1), # incoming MM_CALL_DIRECTION_INCOMING
-                'Number': Variant('s', props['LineIdentification'].value),
-                'Multiparty': props['Multiparty'],
-            })
-
-            mm_call_interface.voicecall = path
-            await mm_call_interface.init_call()
-            self.bus.export(f'/org/freedesktop/ModemManager1/Call/{call_i}', mm_call_interface)
-            self.props['Calls'].value.append(f'/org/freedesktop/ModemManager1/Call/{call_i}')
-            self.emit_properties_changed({'Calls': self.props['Calls'].value})
-            self.CallAdded(f'/org/freedesktop/ModemManager1/Call/{call_i}')
+    def refill_call_pool(self):
+        self.call_pool_refill = None
+        while len(self.call_pool) < self.CALL_POOL_SIZE:
+            self.call_pool.append(MMCallInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props))
+
+    def schedule_call_pool_refill(self):
+        if self.call_pool_refill is None:
+            self.call_pool_refill = asyncio.get_running_loop().call_soon(self.refill_call_pool)
+
+    def take_call_interface(self):
+        if self.call_pool:
+            return self.call_pool.pop()
+
+        return MMCallInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
+
+    def add_call(self, path, props):
+        # Not a coroutine: the call is exported right from the signal
+        # dispatch, without waiting for a task to be scheduled
+        received = asyncio.get_running_loop().time()
+        self.create_call(path, props, received)
+
+        # Keep the data down while a call is going on
+        self.data_restore.cancel()
 
     async def remove_call(self, path):
-        global call_i
+        # The ofono call object is gone, drop its proxy and signal handlers
+        self.ofono_client.evict(path, 'org.ofono.VoiceCall')
 
-        try:
-            self.props['Calls'].value.remove(f'/org/freedesktop/ModemManager1/Call/{call_i}')
-            self.bus.unexport(f'/org/freedesktop/ModemManager1/Call/{call_i}')
-            self.emit_properties_changed({'Calls': self.props['Calls'].value})
-            self.CallDeleted(f'/org/freedesktop/ModemManager1/Call/{call_i}')
-        except Exception as e:
-            pass
+        mm_path = self.ofono_to_mm_calls.get(path)
+        if mm_path is not None:
+            self.unexport_call(mm_path)
 
         if 'org.ofono.SimManager' in self.ofono_interfaces and 'FixedDialing' in self.ofono_interface_props['org.ofono.SimManager']:
             self.props['EmergencyOnly'] = Variant('b', self.ofono_interface_props['org.ofono.SimManager']['FixedDialing'].value)
         else:
             self.props['EmergencyOnly'] = Variant('b', False)
 
-        if 'org.ofono.ConnectionManager' in self.ofono_interfaces:
-            contexts = await self.ofono_interfaces['org.ofono.ConnectionManager'].call_get_contexts()
-            self.context_names = []
-            ctx_idx = 0
-            chosen_apn = None
-            chosen_ctx_path = None
-            for ctx in contexts:
-                name = ctx[1].get('Type', Variant('s', '')).value
-                access_point_name = ctx[1].get('AccessPointName', Variant('s', '')).value
-                if name.lower() == "internet":
-                    ctx_idx += 1
-                    if access_point_name:
-                        self.context_names.append(access_point_name)
-                        chosen_apn = access_point_name
-                        chosen_ctx_path = ctx[0]
-
-                if chosen_ctx_path:
-                    # print(f'activate context on apn {chosen_apn}')
-                    chosen_ctx_interface = self.ofono_client["ofono_context"][chosen_ctx_path]['org.ofono.ConnectionContext']
-                    # on some carriers context does not get reactivated after a call automatically, lets do it ourselves just in case
-                    time.sleep(2) # wait a bit for the call to end
-                    try:
-                        await chosen_ctx_interface.call_set_property("Active", Variant('b', True))
-                    except Exception as e:
-                        pass
+        # On some carriers the data context does not come back after a
+        # call, bring it back ourselves once no call is left
+        if not self.props['Calls'].value:
+            self.data_restore.schedule()
+
+    def create_call(self, ofono_path, props, received=None):
+        """
+        Exports the MM call object of an ofono voice call and indexes it,
+        for incoming and outgoing calls alike. props are the ofono call
+        properties, as sent with CallAdded, received the loop time
+        CallAdded came in. Returns the MM path of the call.
+        """
+
+        global call_i
+
+        mm_path = self.ofono_to_mm_calls.get(ofono_path)
+        if mm_path is not None:
+            return mm_path
+
+        call_i += 1
+        mm_path = f'/org/freedesktop/ModemManager1/Call/{call_i}'
+        self.ofono_to_mm_calls[ofono_path] = mm_path
+        self.mm_to_ofono_calls[mm_path] = ofono_path
+
+        state, reason = OFONO_CALL_STATES.get(props['State'].value, (ModemManagerCallState.UNKNOWN, ModemManagerCallStateReason.UNKNOWN))
+        direction = OFONO_CALL_DIRECTIONS.get(props['State'].value, ModemManagerCallDirection.UNKNOWN)
+        mm_call_interface = self.take_call_interface()
+        mm_call_interface.props.State = state
+        mm_call_interface.props.StateReason = reason
+        mm_call_interface.props.Direction = direction
+        mm_call_interface.props.Number = props.get('LineIdentification', Variant('s', '')).value
+        mm_call_interface.props.Multiparty = props.get('Multiparty', Variant('b', False)).value
+        mm_call_interface.voicecall = ofono_path
+        mm_call_interface.init_call()
+
+        self.call_interfaces[mm_path] = mm_call_interface
+        self.mm_modem.object_manager.export(mm_path, mm_call_interface)
+        self.props['Calls'].value.append(mm_path)
+        self.CallAdded(mm_path)
+
+        # Everything else waits until the call is announced
+        mm_call_interface.added = asyncio.get_running_loop().time()
+        if received is not None:
+            self.ring_latencies.append(mm_call_interface.added - received)
+
+        self.emit_properties_changed({'Calls': self.props['Calls'].value})
+        self.schedule_call_pool_refill()
+        Logger.debug("Call added: ofono path %s, MM path %s", ofono_path, mm_path)
+
+        return mm_path
+
+    def unexport_call(self, mm_path):
+        ofono_path = self.mm_to_ofono_calls.pop(mm_path, None)
+        if ofono_path is not None:
+            self.ofono_to_mm_calls.pop(ofono_path, None)
+
+        mm_call_interface = self.call_interfaces.pop(mm_path, None)
+        if mm_call_interface is not None:
+            mm_call_interface.teardown()
+
+        if mm_path not in self.props['Calls'].value:
+            return
+
+        self.props['Calls'].value.remove(mm_path)
+        self.mm_modem.object_manager.unexport(mm_path)
+        self.emit_properties_changed({'Calls': self.props['Calls'].value})
+        self.CallDeleted(mm_path)
+
+    def log_call_stats(self, name):
+        self.log_latencies(name, "ofono CallAdded to MM CallAdded", self.ring_latencies)
+        self.log_latencies(name, "Dial to CallAdded", self.dial_latencies)
+
+    @staticmethod
+    def log_latencies(name, what, latencies):
+        if not latencies:
+            return
+
+        latencies = sorted(latencies)
+        Logger.debug("%s: %s over %d calls: p50 %.1f ms, p99 %.1f ms, max %.1f ms", name, what, len(latencies),
+                     latencies[len(latencies) // 2] * 1000, latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1000,
+                     latencies[-1] * 1000)
 
     @method()
     async def ListCalls(self) -> 'ao':
@@ -120,11 +309,17 @@ class MMModemVoiceInterface(ServiceInterface):
     @method()
     async def DeleteCall(self, path: 'o'):
         if path in self.props['Calls'].value:
-            await self.ofono_interfaces['org.ofono.VoiceCallManager'].call_hangup_all()
-            self.props['Calls'].value.remove(path)
-            self.bus.unexport(path)
-            self.emit_properties_changed({'Calls': self.props['Calls'].value})
-            self.CallDeleted(path)
+            ofono_path = self.mm_to_ofono_calls.get(path)
+            if ofono_path is not None:
+                try:
+                    await self.ofono_client["ofono_modem"][ofono_path]['org.ofono.VoiceCall'].call_hangup()
+                except DBusError:
+                    # Already gone
+                    pass
+            else:
+                await self.ofono_interfaces['org.ofono.VoiceCallManager'].call_hangup_all()
+
+            self.unexport_call(path)
 
             if 'org.ofono.SimManager' in self.ofono_interfaces and 'FixedDialing' in self.ofono_interface_props['org.ofono.SimManager']:
                 self.props['EmergencyOnly'] = Variant('b', self.ofono_interface_props['org.ofono.SimManager']['FixedDialing'].value)
@@ -132,35 +327,32 @@ class MMModemVoiceInterface(ServiceInterface):
                 self.props['EmergencyOnly'] = Variant('b', False)
 
     @method()
+    @async_deadline(30)
     async def CreateCall(self, properties: 'a{sv}') -> 'o':
-        global call_i
+        if not await self.mm_modem.wait_for_ofono_interface('org.ofono.VoiceCallManager'):
+            raise DBusError('org.freedesktop.ModemManager1.Error.Core.WrongState', 'Voice calls are not available')
+
         if 'org.ofono.SimManager' in self.ofono_interfaces and 'FixedDialing' in self.ofono_interface_props['org.ofono.SimManager']:
             self.props['EmergencyOnly'] = Variant('b', self.ofono_interface_props['org.ofono.SimManager']['FixedDialing'].value)
         else:
             self.props['EmergencyOnly'] = Variant('b', False)
 
-        await self.ofono_interfaces['org.ofono.VoiceCallManager'].call_dial(properties['number'].value, 'disabled')
-        call_i += 1
-        mm_call_interface = MMCallInterface(self.index, self.bus, self.ofono_client, self.modem_name, self.ofono_modem, self.ofono_props, self.ofono_interfaces, self.ofono_interface_props)
-        mm_call_interface.props.update({
-            'State': Variant('i', 0),  # unknown MM_CALL_STATE_UNKNOWN
-            'StateReason': Variant('i', 0), # outgoing MM_CALL_STATE_REASON_UNKNOWN
-            'Direction': Variant('i', 2), # outgoing MM_CALL_DIRECTION_OUTGOING
-            'Number': Variant('s', properties['number'].value),
+        self.data_restore.cancel()
+        dial_started = asyncio.get_running_loop().time()
+        ofono_path = await self.ofono_interfaces['org.ofono.VoiceCallManager'].call_dial(properties['number'].value, 'disabled')
+
+        # ofono usually sent CallAdded before replying, then the call is
+        # already there. Otherwise build it from what we dialed.
+        mm_path = self.create_call(ofono_path, {
+            'State': Variant('s', 'dialing'),
+            'LineIdentification': properties['number'],
         })
 
-        # Get last created ofono call as we need to pass the ofono call path to mm_call_interface
-        active_calls = await self.ofono_interfaces['org.ofono.VoiceCallManager'].call_get_calls()
-        last_call = active_calls[-1]
+        # Matched by path, overlapping dials don't mix up their latencies
+        if mm_path in self.call_interfaces:
+            self.dial_latencies.append(self.call_interfaces[mm_path].added - dial_started)
 
-        mm_call_interface.voicecall = last_call[0]
-        await mm_call_interface.init_call()
-        self.bus.export(f'/org/freedesktop/ModemManager1/Call/{call_i}', mm_call_interface)
-        self.props['Calls'].value.append(f'/org/freedesktop/ModemManager1/Call/{call_i}')
-        self.emit_properties_changed({'Calls': self.props['Calls'].value})
-        self.CallAdded(f'/org/freedesktop/ModemManager1/Call/{call_i}')
-        Logger.debug ("Call Added: Ofono Path: %s, MM_Path: /org/freedesktop/ModemManager1/Call/%s", last_call[0], call_i)
-        return f'/org/freedesktop/ModemManager1/Call/{call_i}'
+        return mm_path
 
     @method()
     async def HoldAndAccept(self):
@@ -202,15 +394,3 @@ class MMModemVoiceInterface(ServiceInterface):
     @dbus_property(access=PropertyAccess.READ)
     def EmergencyOnly(self) -> 'b':
         return self.props['EmergencyOnly'].value
-
-    def ofono_changed(self, name, varval):
-        self.ofono_props[name] = varval
-        self.set_props()
-
-    def ofono_interface_changed(self, iface):
-        def ch(name, varval):
-            if iface in self.ofono_interface_props:
-                self.ofono_interface_props[iface][name] = varval
-            self.set_props()
-
-        return ch
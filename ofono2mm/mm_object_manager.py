@@ -0,0 +1,139 @@
+from dbus_next.service import ServiceInterface
+from dbus_next import Message, MessageType
+
+from ofono2mm.mm_service import MMServiceInterface
+from ofono2mm.logger import Logger
+
+import asyncio
+
+class MMObjectManager:
+    """
+    Exports the ModemManager objects below the root object and announces
+    them with the org.freedesktop.DBus.ObjectManager signals of the root
+    object, as ModemManager clients expect.
+
+    GetManagedObjects is answered by dbus-next itself for every exported
+    path, so a client gets the whole tree in one call on the root object.
+    Usage:
+
+    object_manager.export(f'{ROOT}/Modem/0', mm_modem_interface)
+    object_manager.unexport(f'{ROOT}/Modem/0')
+
+    Interfaces exported on the same path within one loop iteration are
+    announced with a single InterfacesAdded signal. GetAll calls on the
+    exported objects are answered from the interface's cached reply.
+
+    bus.export() and bus.unexport() would also send InterfacesAdded and
+    InterfacesRemoved themselves, from the path of the object instead of
+    the root object, one signal per interface. Those are turned off for
+    this bus, so every change is announced exactly once. ModemManager
+    clients don't miss them: libmm-glib, like any GDBusObjectManager
+    client, only listens to the signals of the manager object, i.e. ROOT,
+    and drops the ones sent from other paths.
+    """
+
+    ROOT = '/org/freedesktop/ModemManager1'
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.objects = {}
+        self.pending = {}
+        self.pending_flush = None
+        self.bus.add_message_handler(self.get_all_handler)
+        # Only the signals of the root object are sent, see above
+        self.bus._emit_interface_added = lambda path, interface: None
+        self.bus._emit_interface_removed = lambda path, removed_interfaces: None
+
+    def get_all_handler(self, msg):
+        if msg.message_type != MessageType.METHOD_CALL or \
+                msg.interface != 'org.freedesktop.DBus.Properties' or \
+                msg.member != 'GetAll' or msg.signature != 's':
+            return None
+
+        for interface in self.objects.get(msg.path, []):
+            if interface.name == msg.body[0] and isinstance(interface, MMServiceInterface):
+                values = interface.get_all_properties()
+                if values is not None:
+                    return Message.new_method_return(msg, 'a{sv}', [values])
+
+        # Let dbus-next build the reply
+        return None
+
+    def export(self, path, interface):
+        self.bus.export(path, interface)
+        self.objects.setdefault(path, []).append(interface)
+        self.pending.setdefault(path, []).append(interface)
+
+        if self.pending_flush is not None:
+            return
+
+        try:
+            self.pending_flush = asyncio.get_running_loop().call_soon(self.flush)
+        except RuntimeError:
+            self.flush()
+
+    def unexport(self, path, interface=None):
+        """
+        Unexports one interface of an object, or the whole object if
+        interface is None.
+        """
+
+        exported = self.objects.get(path, [])
+        removed = [i for i in exported if interface is None or i is interface]
+        if not removed:
+            return
+
+        self.bus.unexport(path, interface)
+
+        # Never announced, nothing to take back
+        pending = self.pending.get(path, [])
+        announced = [i for i in removed if i not in pending]
+        self.pending[path] = [i for i in pending if i not in removed]
+        if not self.pending[path]:
+            self.pending.pop(path)
+
+        self.objects[path] = [i for i in exported if i not in removed]
+        if not self.objects[path]:
+            self.objects.pop(path)
+
+        if announced:
+            self.send_signal('InterfacesRemoved', 'oas', [path, [i.name for i in announced]])
+
+    def is_exported(self, path):
+        return path in self.objects
+
+    def flush(self):
+        self.pending_flush = None
+        pending = self.pending
+        self.pending = {}
+
+        for path, interfaces in pending.items():
+            self.interfaces_added(path, interfaces)
+
+    def interfaces_added(self, path, interfaces):
+        result = {}
+
+        def get_properties_callback(interface, values, user_data, e):
+            if e is not None:
+                Logger.error("Failed to read the properties of %s on %s: %s", interface.name, path, e)
+
+            result[interface.name] = values
+            if len(result) == len(interfaces):
+                self.send_signal('InterfacesAdded', 'oa{sa{sv}}', [path, result])
+
+        for interface in interfaces:
+            values = interface.get_all_properties() if isinstance(interface, MMServiceInterface) else None
+            if values is not None:
+                get_properties_callback(interface, values, None, None)
+            else:
+                ServiceInterface._get_all_property_values(interface, get_properties_callback)
+
+    def send_signal(self, member, signature, body):
+        if self.bus._disconnected:
+            return
+
+        self.bus.send(Message.new_signal(path=self.ROOT,
+                                         interface='org.freedesktop.DBus.ObjectManager',
+                                         member=member,
+                                         signature=signature,
+                                         body=body))
@@ -0,0 +1,152 @@
+from dbus_next.service import dbus_property
+from dbus_next.constants import PropertyAccess
+from dbus_next import Variant
+
+# Variants of small constant values, shared by every interface
+CONSTANTS = {}
+CONSTANT_LIMIT = 4096
+
+def constant_variant(signature, value):
+    """
+    Returns a Variant for value, reusing the same object for booleans,
+    integers and short strings instead of allocating a new one each time.
+    Nobody may modify the returned Variant.
+    """
+
+    value_type = type(value)
+    if value_type not in (bool, int, str) or (value_type is str and len(value) > 64):
+        return Variant(signature, value)
+
+    key = (signature, value_type, value)
+    variant = CONSTANTS.get(key)
+    if variant is None:
+        variant = Variant(signature, value)
+        if len(CONSTANTS) < CONSTANT_LIMIT:
+            CONSTANTS[key] = variant
+
+    return variant
+
+class MMPropertyRecord:
+    """
+    Holds the raw property values of one exported interface in slots.
+
+    Values are read and written as attributes, without a Variant:
+
+    self.props.State = ModemManagerState.ENABLED
+
+    The dict API of the former props dicts is kept for the callers that
+    work on Variants, e.g. props['State'].value or props.update({...}).
+    Every write drops the cached GetAll reply of the interface.
+    """
+
+    __slots__ = ('interface',)
+    schema = None
+
+    def __init__(self, interface):
+        object.__setattr__(self, 'interface', interface)
+        for name, value in self.schema.defaults:
+            # Containers are modified in place, never share them
+            if type(value) in (list, dict):
+                value = value.copy()
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if self.interface is not None:
+            self.interface.get_all_cache = None
+
+    def __getitem__(self, name):
+        if name not in self.schema.signatures:
+            raise KeyError(name)
+
+        return constant_variant(self.schema.signatures[name], getattr(self, name))
+
+    def __setitem__(self, name, variant):
+        if name not in self.schema.signatures:
+            raise KeyError(name)
+
+        setattr(self, name, variant.value)
+
+    def __contains__(self, name):
+        return name in self.schema.signatures
+
+    def __iter__(self):
+        return iter(self.schema.names)
+
+    def __len__(self):
+        return len(self.schema.names)
+
+    def keys(self):
+        return list(self.schema.names)
+
+    def items(self):
+        return [(name, self[name]) for name in self.schema.names]
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def update(self, props):
+        for name, variant in props.items():
+            self[name] = variant
+
+    def copy(self):
+        return dict(self.items())
+
+    def snapshot(self):
+        """
+        The raw values of all the properties, to be given to changes().
+        """
+
+        return tuple(getattr(self, name) for name in self.schema.names)
+
+    def changes(self, snapshot):
+        """
+        The raw values of the properties that differ from snapshot.
+        """
+
+        return {name: getattr(self, name) for name, old_value in zip(self.schema.names, snapshot)
+                if getattr(self, name) != old_value}
+
+class MMPropertySchema:
+    """
+    The D-Bus properties of an exported interface: their name, signature
+    and default value, in the order of the ModemManager introspection data.
+    Interfaces list them in their PROPERTIES class attribute:
+
+    class MMSmsInterface(MMServiceInterface):
+        PROPERTIES = MMPropertySchema([
+            ('State', 'u', 0), # unknown MM_SMS_STATE_UNKNOWN
+            ('Number', 's', ''),
+        ])
+
+    A read-only getter is generated for every property the class does not
+    define itself, and props becomes an MMPropertyRecord.
+    """
+
+    def __init__(self, properties):
+        self.names = tuple(name for name, _, _ in properties)
+        self.signatures = {name: signature for name, signature, _ in properties}
+        self.defaults = tuple((name, default) for name, _, default in properties)
+        self.record_class = type('MMPropertyRecord', (MMPropertyRecord,), {
+            '__slots__': self.names,
+            'schema': self,
+        })
+
+    def record(self, interface):
+        return self.record_class(interface)
+
+    def install(self, cls):
+        for name in self.names:
+            if name not in cls.__dict__:
+                setattr(cls, name, self.getter(name, self.signatures[name]))
+
+    @staticmethod
+    def getter(name, signature):
+        def get(self):
+            return getattr(self.props, name)
+
+        get.__name__ = name
+        get.__qualname__ = name
+        get.__annotations__ = {'return': signature}
+
+        return dbus_property(access=PropertyAccess.READ)(get)
@@ -0,0 +1,190 @@
+from dbus_next.service import ServiceInterface
+
+from ofono2mm.mm_properties import MMPropertyRecord, constant_variant
+from ofono2mm.logger import Logger
+
+import asyncio
+
+class MMProperties(dict):
+    """
+    The props dict of an MMServiceInterface, dropping the cached GetAll
+    reply of the interface whenever a property is replaced.
+    """
+
+    def __init__(self, interface, props):
+        super().__init__(props)
+        self.interface = interface
+
+    def __setitem__(self, name, value):
+        super().__setitem__(name, value)
+        self.interface.get_all_cache = None
+
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self.interface.get_all_cache = None
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.interface.get_all_cache = None
+
+    def pop(self, *args):
+        self.interface.get_all_cache = None
+        return super().pop(*args)
+
+class MMServiceInterface(ServiceInterface):
+    """
+    Base class of the exported ModemManager interfaces.
+
+    PropertiesChanged emissions are coalesced: changed properties are kept
+    in a dirty dict and sent as one signal once COALESCE_WINDOW seconds
+    have passed. A window of 0 coalesces what changes within the current
+    event loop iteration, a negative window disables coalescing.
+    Properties in IMMEDIATE_PROPERTIES flush the dirty dict right away.
+
+    The GetAll reply is built once and kept until a property in props is
+    replaced. Interfaces whose getters read anything else than props set
+    CACHE_GET_ALL to False, interfaces with async getters are never cached.
+
+    Interfaces describing their properties with an MMPropertySchema in
+    PROPERTIES get generated getters and an MMPropertyRecord as props.
+    """
+
+    COALESCE_WINDOW = 0.02
+    IMMEDIATE_PROPERTIES = {'State'}
+    CACHE_GET_ALL = True
+    PROPERTIES = None
+
+    # Emissions asked for by the interfaces, and signals really sent
+    requested_signals = 0
+    emitted_signals = 0
+
+    # GetAll replies served from the cache and built, by interface name
+    get_all_hits = {}
+    get_all_misses = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'PROPERTIES' in cls.__dict__ and cls.PROPERTIES is not None:
+            cls.PROPERTIES.install(cls)
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.dirty_props = {}
+        self.dirty_flush = None
+        self.get_all_cache = None
+        if self.PROPERTIES is not None:
+            self._props = self.PROPERTIES.record(self)
+        else:
+            self._props = MMProperties(self, {})
+
+    @property
+    def props(self):
+        return self._props
+
+    @props.setter
+    def props(self, props):
+        if isinstance(props, MMPropertyRecord):
+            self._props = props
+        elif self.PROPERTIES is not None:
+            self._props = self.PROPERTIES.record(self)
+            self._props.update(props)
+        else:
+            self._props = MMProperties(self, props)
+        self.get_all_cache = None
+
+    def get_all_properties(self):
+        """
+        Returns the GetAll reply of this interface, or None when it can
+        not be served from the cache.
+        """
+
+        if self.get_all_cache is not None:
+            MMServiceInterface.get_all_hits[self.name] = MMServiceInterface.get_all_hits.get(self.name, 0) + 1
+            return self.get_all_cache
+
+        properties = [prop for prop in ServiceInterface._get_properties(self)
+                      if not prop.disabled and prop.access.readable()]
+        if not self.CACHE_GET_ALL or any(asyncio.iscoroutinefunction(prop.prop_getter) for prop in properties):
+            return None
+
+        MMServiceInterface.get_all_misses[self.name] = MMServiceInterface.get_all_misses.get(self.name, 0) + 1
+        self.get_all_cache = {
+            prop.name: constant_variant(prop.signature, getattr(self, prop.prop_getter.__name__))
+            for prop in properties
+        }
+
+        return self.get_all_cache
+
+    def emit_properties_changed(self, changed_properties, invalidated_properties=[]):
+        if not changed_properties and not invalidated_properties:
+            return
+
+        MMServiceInterface.requested_signals += 1
+        self.dirty_props.update(changed_properties)
+
+        if invalidated_properties or MMServiceInterface.COALESCE_WINDOW < 0 or \
+                any(name in self.IMMEDIATE_PROPERTIES for name in changed_properties):
+            self.flush_properties_changed(invalidated_properties)
+            return
+
+        if self.dirty_flush is not None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_properties_changed()
+            return
+
+        if MMServiceInterface.COALESCE_WINDOW == 0:
+            self.dirty_flush = loop.call_soon(self.flush_properties_changed)
+        else:
+            self.dirty_flush = loop.call_later(MMServiceInterface.COALESCE_WINDOW, self.flush_properties_changed)
+
+    def cancel_properties_changed(self):
+        """
+        Drops the pending PropertiesChanged emission, for interfaces that
+        are going away.
+        """
+
+        if self.dirty_flush is not None:
+            self.dirty_flush.cancel()
+            self.dirty_flush = None
+        self.dirty_props = {}
+
+    def flush_properties_changed(self, invalidated_properties=[]):
+        if self.dirty_flush is not None:
+            self.dirty_flush.cancel()
+            self.dirty_flush = None
+
+        if not self.dirty_props and not invalidated_properties:
+            return
+
+        changed_properties = self.dirty_props
+        self.dirty_props = {}
+
+        MMServiceInterface.emitted_signals += 1
+        super().emit_properties_changed(changed_properties, invalidated_properties)
+
+        if MMServiceInterface.emitted_signals % 100 == 0:
+            Logger.debug("PropertiesChanged: %d requested, %d emitted, reduction ratio %.2f",
+                         MMServiceInterface.requested_signals, MMServiceInterface.emitted_signals,
+                         MMServiceInterface.signal_reduction_ratio())
+
+    @staticmethod
+    def log_get_all_stats():
+        for name in sorted(set(MMServiceInterface.get_all_hits) | set(MMServiceInterface.get_all_misses)):
+            Logger.debug("GetAll %s: %d hits, %d misses", name,
+                         MMServiceInterface.get_all_hits.get(name, 0), MMServiceInterface.get_all_misses.get(name, 0))
+
+    @staticmethod
+    def signal_reduction_ratio():
+        """
+        Share of the requested PropertiesChanged signals that were merged
+        into another one instead of being sent.
+        """
+
+        if not MMServiceInterface.requested_signals:
+            return 0.0
+
+        return 1 - MMServiceInterface.emitted_signals / MMServiceInterface.requested_signals
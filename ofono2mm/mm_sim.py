@@ -1,9 +1,37 @@
-from dbus_next.service import (ServiceInterface,
-                               method, dbus_property)
-from dbus_next.constants import PropertyAccess
-from dbus_next import Variant, DBusError
+from dbus_next.service import method
+from dbus_next import DBusError
+
+from ofono2mm.mm_service import MMServiceInterface
+from ofono2mm.mm_properties import MMPropertySchema
+
+class MMSimInterface(MMServiceInterface):
+    PROPERTIES = MMPropertySchema([
+        ('Active', 'b', True),
+        ('SimIdentifier', 's', ''),
+        ('Imsi', 's', '0'),
+        ('Eid', 's', ''),
+        ('OperatorIdentifier', 's', '0'),
+        ('OperatorName', 's', ''),
+        ('EmergencyNumbers', 'as', []),
+        ('PreferredNetworks', 'a(su)', []),
+        ('Gid1', 'ay', bytes()),
+        ('Gid2', 'ay', bytes()),
+        ('SimType', 'u', 1), # hardcoded value physical MM_SIM_TYPE_PHYSICAL
+        ('EsimStatus', 'u', 0), # hardcoded value unknown MM_SIM_ESIM_STATUS_UNKNOWN
+        ('Removability', 'u', 1), # hardcoded value MM_SIM_REMOVABILITY_REMOVABLE
+    ])
+
+    # The ofono properties set_props() reads, see OfonoStateMirror
+    OFONO_DEPENDENCIES = [
+        (None, 'Interfaces'),
+        ('org.ofono.SimManager', 'Present'),
+        ('org.ofono.SimManager', 'CardIdentifier'),
+        ('org.ofono.SimManager', 'SubscriberIdentity'),
+        ('org.ofono.SimManager', 'MobileCountryCode'),
+        ('org.ofono.SimManager', 'MobileNetworkCode'),
+        ('org.ofono.VoiceCallManager', 'EmergencyNumbers'),
+    ]
 
-class MMSimInterface(ServiceInterface):
     def __init__(self, index, bus, ofono_client, modem_name, ofono_modem, ofono_props, ofono_interfaces, ofono_interface_props):
         super().__init__('org.freedesktop.ModemManager1.Sim')
         self.index = index
@@ -15,41 +43,26 @@ class MMSimInterface(ServiceInterface):
         self.ofono_props = ofono_props
         self.ofono_interfaces = ofono_interfaces
         self.ofono_interface_props = ofono_interface_props
-        self.props = {
-            'Active': Variant('b', True),
-            'SimIdentifier': Variant('s', ''),
-            'Imsi': Variant('s', '0'),
-            'Eid': Variant('s', ''),
-            'OperatorIdentifier': Variant('s', '0'),
-            'OperatorName': Variant('s', ''),
-            'EmergencyNumbers': Variant('as', []),
-            'PreferredNetworks': Variant('a(su)', []),
-            'Gid1': Variant('ay', bytes()),
-            'Gid2': Variant('ay', bytes()),
-            'SimType': Variant('u', 1), # hardcoded value physical MM_SIM_TYPE_PHYSICAL
-            'EsimStatus': Variant('u', 0), # hardcoded value unknown MM_SIM_ESIM_STATUS_UNKNOWN
-            'Removability': Variant('u', 1) # hardcoded value MM_SIM_REMOVABILITY_REMOVABLE
-        }
-
-    def set_props(self):
-        old_props = self.props
+
+    def set_props(self, changes=None):
+        old_props = self.props.snapshot()
 
         if 'org.ofono.SimManager' in self.ofono_interface_props:
             if 'Present' in self.ofono_interface_props['org.ofono.SimManager']:
                 if self.ofono_interface_props['org.ofono.SimManager']['Present']:
-                    self.props['Active'] = Variant('b', True)
+                    self.props.Active = True
                 else:
-                    self.props['Active'] = Variant('b', False)
+                    self.props.Active = False
             else:
-                self.props['Active'] = Variant('b', False)
+                self.props.Active = False
             if 'CardIdentifier' in self.ofono_interface_props['org.ofono.SimManager']:
-                self.props['SimIdentifier'] = Variant('s', self.ofono_interface_props['org.ofono.SimManager']['CardIdentifier'].value)
+                self.props.SimIdentifier = self.ofono_interface_props['org.ofono.SimManager']['CardIdentifier'].value
             else:
-                self.props['SimIdentifier'] = Variant('s', '')
+                self.props.SimIdentifier = ''
             if 'SubscriberIdentity' in self.ofono_interface_props['org.ofono.SimManager']:
-                self.props['Imsi'] = Variant('s', self.ofono_interface_props['org.ofono.SimManager']['SubscriberIdentity'].value)
+                self.props.Imsi = self.ofono_interface_props['org.ofono.SimManager']['SubscriberIdentity'].value
             else:
-                self.props['Imsi'] = Variant('s', '')
+                self.props.Imsi = ''
 
             
             if 'MobileCountryCode' in self.ofono_interface_props['org.ofono.SimManager']:
@@ -62,21 +75,19 @@ class MMSimInterface(ServiceInterface):
             else:
                 MNC = ''
 
-            self.props['OperatorIdentifier'] = Variant('s', f"{MCC}{MNC}" if MCC != '' else '')
-            self.props['PreferredNetworks'] = Variant('a(su)', [[f"{MCC}{MNC}", 19]])
+            self.props.OperatorIdentifier = f"{MCC}{MNC}" if MCC != '' else ''
+            self.props.PreferredNetworks = [[f"{MCC}{MNC}", 19]]
         else:
-            self.props['Active'] = Variant('b', False)
-            self.props['SimIdentifier'] = Variant('s', '')
-            self.props['Imsi'] = Variant('s', '')
-            self.props['OperatorIdentifier'] = Variant('s', '')
-            self.props['PreferredNetworks'] = Variant('a(su)', [])
+            self.props.Active = False
+            self.props.SimIdentifier = ''
+            self.props.Imsi = ''
+            self.props.OperatorIdentifier = ''
+            self.props.PreferredNetworks = []
 
         if 'org.ofono.VoiceCallManager' in self.ofono_interface_props:
-            self.props['EmergencyNumbers'] = Variant('as', self.ofono_interface_props['org.ofono.VoiceCallManager']['EmergencyNumbers'].value if 'EmergencyNumbers' in self.ofono_interface_props['org.ofono.VoiceCallManager'] else [])
+            self.props.EmergencyNumbers = self.ofono_interface_props['org.ofono.VoiceCallManager']['EmergencyNumbers'].value if 'EmergencyNumbers' in self.ofono_interface_props['org.ofono.VoiceCallManager'] else []
 
-        for prop in self.props:
-            if self.props[prop].value != old_props[prop].value:
-                self.emit_properties_changed({prop: self.props[prop].value})
+        self.emit_properties_changed(self.props.changes(old_props))
 
     @method()
     async def SendPin(self, pin: 's'):
@@ -104,68 +115,3 @@ class MMSimInterface(ServiceInterface):
     @method()
     async def SetPreferredNetwork(self, preferred_networks: 'a(su)'):
         pass # ofono has no way to actually set this info, just pass
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Active(self) -> 'b':
-        return self.props['Active'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def SimIdentifier(self) -> 's':
-        return self.props['SimIdentifier'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Imsi(self) -> 's':
-        return self.props['Imsi'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Eid(self) -> 's':
-        return self.props['Eid'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def OperatorIdentifier(self) -> 's':
-        return self.props['OperatorIdentifier'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def OperatorName(self) -> 's':
-        return self.props['OperatorName'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def EmergencyNumbers(self) -> 'as':
-        return self.props['EmergencyNumbers'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def PreferredNetworks(self) -> 'a(su)':
-        return self.props['PreferredNetworks'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Gid1(self) -> 'ay':
-        return self.props['Gid1'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Gid2(self) -> 'ay':
-        return self.props['Gid2'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def SimType(self) -> 'u':
-        return self.props['SimType'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def EsimStatus(self) -> 'u':
-        return self.props['EsimStatus'].value
-
-    @dbus_property(access=PropertyAccess.READ)
-    def Removability(self) -> 'u':
-        return self.props['Removability'].value
-
-    def ofono_changed(self, name, varval):
-        self.ofono_props[name] = varval
-        self.set_props()
-
-    def ofono_interface_changed(self, iface):
-        def ch(name, varval):
-            if iface in self.ofono_interface_props:
-                self.ofono_interface_props[iface][name] = varval
-
-            self.set_props()
-
-        return ch
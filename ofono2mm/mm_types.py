@@ -231,3 +231,67 @@ class ModemManagerPortType:
     MBIM    = 7
     AUDIO   = 8
     IGNORED = 9
+
+class ModemManagerCallState:
+    UNKNOWN     = 0
+    DIALING     = 1
+    RINGING_OUT = 2
+    RINGING_IN  = 3
+    ACTIVE      = 4
+    HELD        = 5
+    WAITING     = 6
+    TERMINATED  = 7
+
+class ModemManagerCallStateReason:
+    UNKNOWN            = 0
+    OUTGOING_STARTED   = 1
+    INCOMING_NEW       = 2
+    ACCEPTED           = 3
+    TERMINATED         = 4
+    REFUSED_OR_BUSY    = 5
+    ERROR              = 6
+    AUDIO_SETUP_FAILED = 7
+    TRANSFERRED        = 8
+    DEFLECTED          = 9
+    CALL_WAITING       = 10
+
+class ModemManagerCallDirection:
+    UNKNOWN  = 0
+    INCOMING = 1
+    OUTGOING = 2
+
+# ofono VoiceCall State: MM call state and the reason for entering it
+OFONO_CALL_STATES = {
+    'dialing': (ModemManagerCallState.DIALING, ModemManagerCallStateReason.OUTGOING_STARTED),
+    'alerting': (ModemManagerCallState.RINGING_OUT, ModemManagerCallStateReason.OUTGOING_STARTED),
+    'incoming': (ModemManagerCallState.RINGING_IN, ModemManagerCallStateReason.INCOMING_NEW),
+    'waiting': (ModemManagerCallState.WAITING, ModemManagerCallStateReason.CALL_WAITING),
+    'active': (ModemManagerCallState.ACTIVE, ModemManagerCallStateReason.ACCEPTED),
+    'held': (ModemManagerCallState.HELD, ModemManagerCallStateReason.UNKNOWN),
+    'disconnected': (ModemManagerCallState.TERMINATED, ModemManagerCallStateReason.TERMINATED),
+}
+
+# Transitions whose reason depends on the state the call leaves
+OFONO_CALL_TRANSITIONS = {
+    (ModemManagerCallState.DIALING, 'disconnected'): (ModemManagerCallState.TERMINATED, ModemManagerCallStateReason.REFUSED_OR_BUSY),
+    (ModemManagerCallState.RINGING_OUT, 'disconnected'): (ModemManagerCallState.TERMINATED, ModemManagerCallStateReason.REFUSED_OR_BUSY),
+    (ModemManagerCallState.HELD, 'active'): (ModemManagerCallState.ACTIVE, ModemManagerCallStateReason.UNKNOWN),
+}
+
+OFONO_CALL_DIRECTIONS = {
+    'dialing': ModemManagerCallDirection.OUTGOING,
+    'alerting': ModemManagerCallDirection.OUTGOING,
+    'incoming': ModemManagerCallDirection.INCOMING,
+    'waiting': ModemManagerCallDirection.INCOMING,
+}
+
+def ofono_call_transition(old_state, ofono_state):
+    """
+    MM call state and reason of a call in old_state whose ofono state
+    became ofono_state. Unknown ofono states leave the call as it is.
+    """
+
+    if (old_state, ofono_state) in OFONO_CALL_TRANSITIONS:
+        return OFONO_CALL_TRANSITIONS[(old_state, ofono_state)]
+
+    return OFONO_CALL_STATES.get(ofono_state, (old_state, ModemManagerCallStateReason.UNKNOWN))
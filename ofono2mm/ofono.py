@@ -1,9 +1,55 @@
 from dbus_next.service import (ServiceInterface,
                                method, dbus_property, signal)
-from dbus_next.constants import PropertyAccess
-from dbus_next import Variant, DBusError, BusType
+from dbus_next.constants import PropertyAccess, ArgDirection
+from dbus_next import Variant, DBusError, BusType, MessageType
+from dbus_next.proxy_object import BaseProxyInterface
+from dbus_next import introspection as intr
+
+from ofono2mm.logger import Logger
+from ofono2mm.utils import deadline_remaining, TIMEOUT_ERROR
+
+from collections import OrderedDict
 
 import asyncio
+import functools
+import json
+import os
+import stat
+import time
+
+def node_to_dict(node):
+    """
+    A parsed introspection as plain JSON values, see node_from_dict().
+    """
+
+    def args(args):
+        return [[arg.signature, arg.name] for arg in args]
+
+    return {
+        'name': node.name,
+        'interfaces': [{
+            'name': interface.name,
+            'methods': [[m.name, args(m.in_args), args(m.out_args)] for m in interface.methods],
+            'signals': [[s.name, args(s.args)] for s in interface.signals],
+            'properties': [[p.name, p.signature, p.access.value] for p in interface.properties],
+        } for interface in node.interfaces],
+        'nodes': [node_to_dict(child) for child in node.nodes],
+    }
+
+def node_from_dict(data, is_root=True):
+    def args(args, direction):
+        return [intr.Arg(signature, direction, name) for signature, name in args]
+
+    node = intr.Node(data['name'], [intr.Interface(
+        interface['name'],
+        [intr.Method(name, args(in_args, ArgDirection.IN), args(out_args, ArgDirection.OUT))
+         for name, in_args, out_args in interface['methods']],
+        [intr.Signal(name, args(signal_args, ArgDirection.OUT)) for name, signal_args in interface['signals']],
+        [intr.Property(name, signature, PropertyAccess(access)) for name, signature, access in interface['properties']],
+    ) for interface in data['interfaces']], is_root)
+    node.nodes = [node_from_dict(child, False) for child in data['nodes']]
+
+    return node
 
 class ObjectProxy:
     def __init__(self, parent, getter, getter_args):
@@ -17,12 +63,242 @@ class ObjectProxy:
     def __getitem__(self, iface):
         return self.get_interface(iface)
 
+class OfonoSignalRouter:
+    """
+    Delivers the signals of a service to the handlers subscribed to them.
+
+    Instead of one match rule and one message handler per proxy interface,
+    a single match rule covers every object of the service and signals
+    are dispatched through a dict keyed by (path, interface, member):
+
+    router.subscribe(path, 'org.ofono.Modem', 'PropertyChanged', handler)
+
+    Handlers get the signal arguments, coroutines are run as tasks whose
+    failures are logged. Observers added with observe() get every signal
+    message of the service before the handlers run.
+
+    log_stats() compares the AddMatch calls made with the ones dbus-next
+    proxies would have made, one each time a (path, interface) pair gets
+    its first handler.
+    """
+
+    def __init__(self, bus, bus_name):
+        self.bus = bus
+        self.bus_name = bus_name
+        self.match_rule = f"type='signal',sender='{bus_name}'"
+        self.handlers = {}
+        # (path, interface): number of handlers keys on it
+        self.pairs = {}
+        self.observers = []
+        self.installed = False
+        self.tasks = set()
+        self.dispatched = 0
+        self.dispatch_time = 0
+        # AddMatch calls made, and the ones one rule per proxy interface
+        # would have needed
+        self.rules_added = 0
+        self.proxy_rules_added = 0
+        self.max_proxy_rules = 0
+
+    def subscribe(self, path, interface, member, handler):
+        if (path, interface, member) not in self.handlers:
+            self.handlers[(path, interface, member)] = []
+            self.pairs[(path, interface)] = self.pairs.get((path, interface), 0) + 1
+            if self.pairs[(path, interface)] == 1:
+                self.proxy_rules_added += 1
+                self.max_proxy_rules = max(self.max_proxy_rules, len(self.pairs))
+
+        handlers = self.handlers[(path, interface, member)]
+        if handler not in handlers:
+            handlers.append(handler)
+
+        if not self.installed:
+            self.bus._add_match_rule(self.match_rule)
+            self.bus.add_message_handler(self.message_handler)
+            self.installed = True
+            self.rules_added += 1
+
+    def observe(self, observer):
+        if observer not in self.observers:
+            self.observers.append(observer)
+
+    def unsubscribe(self, path, interface, member, handler):
+        handlers = self.handlers.get((path, interface, member), [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            self.remove_keys([(path, interface, member)])
+
+    def unsubscribe_interface(self, path, interface):
+        self.remove_keys([key for key in self.handlers if key[0] == path and key[1] == interface])
+
+    def unsubscribe_path(self, path):
+        """
+        Removes the handlers of an object and of all of its children.
+        """
+
+        prefix = path.rstrip('/') + '/'
+        self.remove_keys([key for key in self.handlers if key[0] == path or key[0].startswith(prefix)])
+
+    def remove_keys(self, keys):
+        for key in keys:
+            if self.handlers.pop(key, None) is None:
+                continue
+
+            self.pairs[key[:2]] -= 1
+            if not self.pairs[key[:2]]:
+                self.pairs.pop(key[:2])
+
+        if self.installed and not self.handlers:
+            self.bus._remove_match_rule(self.match_rule)
+            self.bus.remove_message_handler(self.message_handler)
+            self.installed = False
+
+    def message_handler(self, msg):
+        if msg.message_type != MessageType.SIGNAL:
+            return
+
+        handlers = self.handlers.get((msg.path, msg.interface, msg.member))
+        if not handlers and not self.observers:
+            return
+
+        if msg.sender != self.bus_name and self.bus._name_owners.get(self.bus_name, msg.sender) != msg.sender:
+            return
+
+        for observer in self.observers:
+            observer(msg)
+
+        if not handlers:
+            return
+
+        start = time.perf_counter()
+        for handler in list(handlers):
+            try:
+                result = handler(*msg.body)
+                if asyncio.iscoroutine(result):
+                    task = asyncio.create_task(result)
+                    self.tasks.add(task)
+                    task.add_done_callback(self.task_done(msg))
+            except Exception as e:
+                Logger.error("Failed to handle %s.%s on %s: %s", msg.interface, msg.member, msg.path, e)
+
+        self.dispatched += 1
+        self.dispatch_time += time.perf_counter() - start
+
+    def task_done(self, msg):
+        def done(task):
+            self.tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                Logger.error("Failed to handle %s.%s on %s: %s", msg.interface, msg.member, msg.path, task.exception())
+
+        return done
+
+    def log_stats(self):
+        installed = sum(1 for rule in self.bus._match_rules if f"sender='{self.bus_name}'" in rule)
+        Logger.debug("Signals: %d handlers on %d ofono (path, interface) pairs, %d match rule(s) installed",
+                     sum(len(handlers) for handlers in self.handlers.values()), len(self.pairs), installed)
+        Logger.debug("Signals: %d AddMatch calls, one rule per proxy interface would have made %d and held up to %d at once",
+                     self.rules_added, self.proxy_rules_added, self.max_proxy_rules)
+        if self.dispatched:
+            Logger.debug("Signals: %d dispatched, %.1f us on average",
+                         self.dispatched, self.dispatch_time / self.dispatched * 1000000)
+
+class OfonoReadCache:
+    """
+    Single-flight layer for the ofono reads several places issue at the
+    same time, like ConnectionManager.GetContexts:
+
+    contexts = await reads.get(modem_path, 'org.ofono.ConnectionManager', 'GetContexts',
+                               connection_manager.call_get_contexts)
+
+    Concurrent reads of the same (path, interface, method) share one D-Bus
+    call. The result is kept for TTL seconds, or until the router sees a
+    signal that may change it, see INVALIDATED_BY. Results are shared
+    between callers, which must not modify them.
+    """
+
+    TTL = 2
+
+    # Interface of a signal: interface of the reads it invalidates, and
+    # whether those live on the parent object (contexts on their modem)
+    INVALIDATED_BY = {
+        'org.ofono.ConnectionManager': ('org.ofono.ConnectionManager', False),
+        'org.ofono.ConnectionContext': ('org.ofono.ConnectionManager', True),
+    }
+
+    def __init__(self, signals):
+        self.signals = signals
+        self.inflight = {}
+        self.results = {}
+        self.calls = 0
+        self.shared = 0
+        self.hits = 0
+        self.signals.observe(self.signal_observer)
+
+    async def get(self, path, interface, method, func):
+        key = (path, interface, method)
+
+        if key in self.results:
+            result, expiry = self.results[key]
+            if expiry > time.monotonic():
+                self.hits += 1
+                return result
+            self.results.pop(key)
+
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self.call(key, func))
+            self.inflight[key] = task
+        else:
+            self.shared += 1
+
+        return await asyncio.shield(task)
+
+    async def call(self, key, func):
+        self.calls += 1
+        try:
+            result = await func()
+        finally:
+            current = self.inflight.get(key) is asyncio.current_task()
+            if current:
+                self.inflight.pop(key)
+
+        # Without the match rule nothing would invalidate the result, and
+        # a signal seen during the call made it stale already
+        if current and self.signals.installed:
+            self.results[key] = (result, time.monotonic() + self.TTL)
+
+        return result
+
+    def invalidate(self, path, interface):
+        for key in [key for key in [*self.results, *self.inflight] if key[0] == path and key[1] == interface]:
+            self.results.pop(key, None)
+            self.inflight.pop(key, None)
+
+    def drop_path(self, path):
+        prefix = path.rstrip('/') + '/'
+        for key in [key for key in [*self.results, *self.inflight] if key[0] == path or key[0].startswith(prefix)]:
+            self.results.pop(key, None)
+            self.inflight.pop(key, None)
+
+    def signal_observer(self, msg):
+        if msg.interface not in self.INVALIDATED_BY:
+            return
+
+        interface, on_parent = self.INVALIDATED_BY[msg.interface]
+        self.invalidate(msg.path.rsplit('/', 1)[0] if on_parent else msg.path, interface)
+
+    def log_stats(self):
+        Logger.debug("Reads: %d ofono calls, %d shared with a call in flight, %d served from the cache",
+                     self.calls, self.shared, self.hits)
+
 class CachedClient:
     """
     An object that keeps dbus_next's object proxies and interfaces in
     an internal cache.
 
-    Objects are lazily-obtained when needed. Usage is as follows:
+    Objects are lazily-obtained when needed and keyed by (path, interface).
+    Usage is as follows:
 
     client = CachedClient()
     interface = client[INTROSPECTION][OBJECT_PATH][INTERFACE]
@@ -31,6 +307,42 @@ class CachedClient:
     bus_name = None
     introspections = None
 
+    # Optional file keeping the parsed introspections between runs, as
+    # JSON. It is only trusted when owned by us or root and not writable
+    # by anybody else.
+    INTROSPECTION_CACHE = None
+
+    # Objects that come and go all the time are kept in a bounded LRU
+    # cache, everything else lives as long as its modem
+    TRANSIENT_INTERFACES = [
+        'org.ofono.VoiceCall',
+        'org.ofono.ConnectionContext',
+        'org.ofono.NetworkOperator',
+    ]
+    MAX_TRANSIENT = 64
+
+    # How long a failed interface lookup is remembered, in seconds
+    NEGATIVE_TTL = 60
+
+    # OfonoSignalRouter of the clients whose signals are listened to
+    signals = None
+
+    # OfonoReadCache of the clients whose reads are shared
+    reads = None
+
+    # Seconds a method call may take before it is cancelled and fails
+    # with a Timeout DBusError. A closer deadline set by the MM method
+    # being handled (see async_deadline) wins.
+    DEFAULT_CALL_TIMEOUT = 25
+    CALL_TIMEOUTS = {
+        'Scan': 180,
+        'Register': 60,
+        'SetProperty': 30,
+        'Dial': 60,
+        'SendMessage': 60,
+        'Initiate': 60,
+    }
+
     def __init__(self, bus):
         """
         Initialises the class.
@@ -42,27 +354,191 @@ class CachedClient:
         assert self.introspections is not None
 
         self.bus = bus
+        self.introspection_data = {}
+        self.proxies = {}
         self.cache = {}
+        self.transient = OrderedDict()
+        self.negative = {}
+        self.timeouts = {}
+
+        # Load introspections, parsing each XML file only once
+        parsed = self.load_introspection_cache()
+        cache_changed = False
 
-        # Load introspections
         for introspection, path in self.introspections.items():
+            mtime = os.stat(path).st_mtime_ns
+            if path in parsed and parsed[path]['mtime'] == mtime:
+                try:
+                    self.introspection_data[introspection] = node_from_dict(parsed[path]['node'])
+                    continue
+                except Exception as e:
+                    Logger.warning("Ignoring cached introspection of %s: %s", path, e)
+
             with open(path, "r") as f:
-                self.cache[hash(introspection)] = f.read()
+                self.introspection_data[introspection] = intr.Node.parse(f.read())
+
+            parsed[path] = {'mtime': mtime, 'node': node_to_dict(self.introspection_data[introspection])}
+            cache_changed = True
+
+        if cache_changed:
+            self.save_introspection_cache(parsed)
+
+    def load_introspection_cache(self):
+        if not self.INTROSPECTION_CACHE or not os.path.exists(self.INTROSPECTION_CACHE):
+            return {}
+
+        try:
+            with open(self.INTROSPECTION_CACHE, "r") as f:
+                st = os.fstat(f.fileno())
+                if st.st_uid not in (0, os.getuid()) or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                    Logger.warning("Ignoring introspection cache %s: not owned by us or writable by others", self.INTROSPECTION_CACHE)
+                    return {}
+                parsed = json.load(f)
+            if isinstance(parsed, dict):
+                return parsed
+        except Exception as e:
+            Logger.warning("Ignoring introspection cache %s: %s", self.INTROSPECTION_CACHE, e)
+
+        return {}
+
+    def save_introspection_cache(self, parsed):
+        if not self.INTROSPECTION_CACHE:
+            return
+
+        # Other clients share the same file, keep their entries
+        parsed = {**self.load_introspection_cache(), **parsed}
+
+        try:
+            os.makedirs(os.path.dirname(self.INTROSPECTION_CACHE), exist_ok=True)
+            with open(self.INTROSPECTION_CACHE + ".tmp", "w") as f:
+                os.fchmod(f.fileno(), 0o644)
+                json.dump(parsed, f)
+            os.replace(self.INTROSPECTION_CACHE + ".tmp", self.INTROSPECTION_CACHE)
+        except OSError as e:
+            Logger.warning("Could not write introspection cache %s: %s", self.INTROSPECTION_CACHE, e)
 
     def get_interface(self, introspection, path, interface):
-        path_hashed = hash(path)
-        interface_hashed = hash(path + interface)
+        key = (path, interface)
+
+        if key in self.cache:
+            return self.cache[key]
+
+        if key in self.transient:
+            self.transient.move_to_end(key)
+            return self.transient[key]
 
-        if not interface_hashed in self.cache:
-            if not path_hashed in self.cache:
-                self.cache[path_hashed] = self.bus.get_proxy_object(self.bus_name, path, self.cache[hash(introspection)])
+        if key in self.negative:
+            if self.negative[key] > time.monotonic():
+                return None
+            self.negative.pop(key)
 
+        if not path in self.proxies:
+            self.proxies[path] = self.bus.get_proxy_object(self.bus_name, path, self.introspection_data[introspection])
+
+        try:
+            proxy_interface = self.proxies[path].get_interface(interface)
+        except Exception as e:
+            # skip over org.ofono.IpMultimediaSystem, but look again later
+            self.add_negative(key)
+            return None
+
+        self.add_deadlines(proxy_interface)
+
+        if interface in self.TRANSIENT_INTERFACES:
+            self.transient[key] = proxy_interface
+            while len(self.transient) > self.MAX_TRANSIENT:
+                # Only the proxy goes away, the object may still be alive
+                self.evict(*next(iter(self.transient)), signals=False)
+        else:
+            self.cache[key] = proxy_interface
+
+        return proxy_interface
+
+    def add_deadlines(self, proxy_interface):
+        """
+        Replaces the call methods of a proxy interface with ones giving
+        up after their timeout. Giving up cancels the pending call, its
+        reply is then dropped by dbus-next.
+        """
+
+        for intr_method in proxy_interface.introspection.methods:
+            name = f'call_{BaseProxyInterface._to_snake_case(intr_method.name)}'
+            call = getattr(proxy_interface, name)
+            timeout = self.CALL_TIMEOUTS.get(intr_method.name, self.DEFAULT_CALL_TIMEOUT)
+            setattr(proxy_interface, name, self.with_deadline(call, proxy_interface, intr_method.name, timeout))
+
+    def with_deadline(self, call, proxy_interface, member, timeout):
+        @functools.wraps(call)
+        async def call_with_deadline(*args, **kwargs):
+            remaining = deadline_remaining()
+            call_timeout = timeout if remaining is None else min(timeout, remaining)
             try:
-                self.cache[interface_hashed] = self.cache[path_hashed].get_interface(interface)
-            except Exception as e:
-                self.cache[interface_hashed] = None  # skip over org.ofono.IpMultimediaSystem
+                return await asyncio.wait_for(call(*args, **kwargs), call_timeout)
+            except asyncio.TimeoutError:
+                key = f'{proxy_interface.introspection.name}.{member}'
+                self.timeouts[key] = self.timeouts.get(key, 0) + 1
+                Logger.warning("%s on %s timed out after %g s", key, proxy_interface.path, call_timeout)
+                raise DBusError(TIMEOUT_ERROR, f'{key} timed out')
+
+        return call_with_deadline
+
+    def log_timeout_stats(self):
+        for key, count in sorted(self.timeouts.items()):
+            Logger.debug("%s: %d timeouts", key, count)
+
+    def add_negative(self, key):
+        now = time.monotonic()
+        for expired in [k for k, expiry in self.negative.items() if expiry <= now]:
+            self.negative.pop(expired)
+
+        self.negative[key] = now + self.NEGATIVE_TTL
+
+    def evict(self, path, interface, signals=True):
+        """
+        Removes one interface from the cache, disconnecting its signal
+        handlers unless signals is False.
+        """
 
-        return self.cache[interface_hashed]
+        key = (path, interface)
+        proxy_interface = self.cache.pop(key, None) or self.transient.pop(key, None)
+        self.negative.pop(key, None)
+
+        if proxy_interface is not None:
+            self.disconnect_signals(proxy_interface)
+        if signals and self.signals is not None:
+            self.signals.unsubscribe_interface(path, interface)
+
+        if not any(k[0] == path for k in self.cache) and not any(k[0] == path for k in self.transient):
+            self.proxies.pop(path, None)
+
+    def drop_path(self, path):
+        """
+        Removes an object and all of its children from the cache,
+        disconnecting every signal handler connected on them.
+
+        :param: path: the object path to drop.
+        """
+
+        def is_dropped(p):
+            return p == path or p.startswith(path.rstrip('/') + '/')
+
+        for key in [key for key in [*self.cache, *self.transient, *self.negative] if is_dropped(key[0])]:
+            self.evict(*key)
+
+        for p in [p for p in self.proxies if is_dropped(p)]:
+            self.proxies.pop(p)
+
+        if self.signals is not None:
+            self.signals.unsubscribe_path(path)
+        if self.reads is not None:
+            self.reads.drop_path(path)
+
+    @staticmethod
+    def disconnect_signals(proxy_interface):
+        for member, handlers in list(proxy_interface._signal_handlers.items()):
+            off_signal = getattr(proxy_interface, f'off_{BaseProxyInterface._to_snake_case(member)}')
+            for handler in list(handlers):
+                off_signal(handler)
 
     def __getitem__(self, introspection):
         """
@@ -89,9 +565,100 @@ class Ofono(CachedClient):
         'ofono_operator' : '/usr/lib/ofono2mm/ofono_operator.xml',
     }
 
+    def __init__(self, bus):
+        super().__init__(bus)
+        self.signals = OfonoSignalRouter(bus, self.bus_name)
+        self.reads = OfonoReadCache(self.signals)
+
 class DBus(CachedClient):
 
     bus_name = "org.freedesktop.DBus"
     introspections = {
         "dbus" : '/usr/lib/ofono2mm/dbus.xml',
     }
+
+class OfonoReadiness:
+    """
+    Tracks whether ofono is running and ready to hand out its modems.
+
+    Discovery waits on this instead of polling org.ofono.Manager.GetModems
+    in a loop. It is woken up by NameOwnerChanged, the nemomobile
+    ReadyChanged signal and ModemAdded, and otherwise retries with a
+    bounded exponential backoff while ofono is not ready or not answering.
+    """
+
+    def __init__(self, ofono_client, min_backoff=0.5, max_backoff=30):
+        self.ofono_client = ofono_client
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.present = False
+        self.waiting = False
+        self.nemo_manager = None
+        self.event = asyncio.Event()
+
+    def ofono_added(self):
+        self.present = True
+        self.nemo_manager = self.ofono_client["ofono"]["/"]["org.nemomobile.ofono.ModemManager"]
+        if self.nemo_manager is not None:
+            self.ofono_client.signals.subscribe('/', 'org.nemomobile.ofono.ModemManager', 'ReadyChanged', self.nemo_ready_changed)
+        self.poke()
+
+    def ofono_removed(self):
+        self.present = False
+        if self.nemo_manager is not None:
+            self.ofono_client.signals.unsubscribe('/', 'org.nemomobile.ofono.ModemManager', 'ReadyChanged', self.nemo_ready_changed)
+            self.nemo_manager = None
+        self.poke()
+
+    def nemo_ready_changed(self, ready):
+        if ready:
+            self.poke()
+
+    def poke(self):
+        self.event.set()
+
+    async def is_ready(self):
+        if self.nemo_manager is None:
+            return True
+
+        try:
+            return await self.nemo_manager.call_get_ready()
+        except DBusError:
+            # Not a nemomobile ofono, rely on GetModems alone
+            self.ofono_client.signals.unsubscribe('/', 'org.nemomobile.ofono.ModemManager', 'ReadyChanged', self.nemo_ready_changed)
+            self.nemo_manager = None
+            return True
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def wait_for_modems(self, get_modems):
+        """
+        Calls get_modems once ofono is ready and returns its result, which
+        may be an empty list: modems showing up later come with ModemAdded.
+
+        Returns None if ofono goes away in the meantime.
+        """
+
+        backoff = self.min_backoff
+        self.waiting = True
+
+        try:
+            while self.present:
+                self.event.clear()
+
+                try:
+                    if await self.is_ready():
+                        return await get_modems()
+                except DBusError:
+                    pass
+
+                await self.wait(backoff)
+                backoff = self.min_backoff if self.event.is_set() else min(backoff * 2, self.max_backoff)
+        finally:
+            self.waiting = False
+
+        return None
@@ -0,0 +1,101 @@
+from ofono2mm.logger import Logger
+
+class OfonoStateMirror:
+    """
+    The ofono properties of one modem, shared by all of its MM interfaces.
+
+    modem_props holds the org.ofono.Modem properties and interface_props
+    the properties of every other ofono interface. Both dicts are updated
+    in place, so interfaces may keep a reference to them.
+
+    Interfaces register the (interface, property) pairs they derive
+    their own properties from, interface being None for org.ofono.Modem:
+
+    mirror.watch([('org.ofono.SimManager', 'Present')], callback)
+
+    Every update bumps version and calls each interested callback once
+    with the list of (interface, property) pairs that changed.
+    """
+
+    def __init__(self):
+        self.modem_props = {}
+        self.interface_props = {}
+        self.version = 0
+        self.watchers = {}
+
+    def watch(self, dependencies, callback):
+        for dependency in dependencies:
+            callbacks = self.watchers.setdefault(dependency, [])
+            if callback not in callbacks:
+                callbacks.append(callback)
+
+    def unwatch(self, callback):
+        for callbacks in self.watchers.values():
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def unwatch_all(self):
+        self.watchers = {}
+
+    def update_modem(self, props):
+        changes = [(None, name) for name in props
+                   if name not in self.modem_props or self.modem_props[name].value != props[name].value]
+        self.modem_props.update(props)
+        self.dispatch(changes)
+
+    def set_modem_property(self, name, value):
+        self.update_modem({name: value})
+
+    def set_interface(self, iface, props):
+        """
+        Replaces all the properties of an ofono interface, adding it if
+        needed. Adding or removing an interface also counts as a change of
+        the modem Interfaces property.
+        """
+
+        old_props = self.interface_props.get(iface, {})
+        changes = [(iface, name) for name in set(old_props) | set(props)
+                   if name not in old_props or name not in props or old_props[name].value != props[name].value]
+
+        if iface not in self.interface_props:
+            self.interface_props[iface] = {}
+            changes.append((None, 'Interfaces'))
+
+        # Update in place, interfaces may hold on to this dict
+        self.interface_props[iface].clear()
+        self.interface_props[iface].update(props)
+        self.dispatch(changes)
+
+    def set_interface_property(self, iface, name, value):
+        if iface not in self.interface_props:
+            return
+
+        old_value = self.interface_props[iface].get(name)
+        self.interface_props[iface][name] = value
+        if old_value is None or old_value.value != value.value:
+            self.dispatch([(iface, name)])
+
+    def remove_interface(self, iface):
+        if iface not in self.interface_props:
+            return
+
+        props = self.interface_props.pop(iface)
+        self.dispatch([(iface, name) for name in props] + [(None, 'Interfaces')])
+
+    def dispatch(self, changes):
+        if not changes:
+            return
+
+        self.version += 1
+
+        callbacks = []
+        for change in changes:
+            for callback in self.watchers.get(change, []):
+                if callback not in callbacks:
+                    callbacks.append(callback)
+
+        for callback in callbacks:
+            try:
+                callback(changes)
+            except Exception as e:
+                Logger.error("Failed to apply ofono changes %s: %s", changes, e)
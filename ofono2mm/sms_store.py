@@ -0,0 +1,157 @@
+from ofono2mm.logger import Logger
+
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio
+import json
+import os
+import sqlite3
+
+# The MMSmsInterface properties kept on disk, all of them JSON values
+STORED_PROPS = [
+    'State',
+    'PduType',
+    'Number',
+    'Text',
+    'SMSC',
+    'Class',
+    'DeliveryReportRequest',
+    'MessageReference',
+    'Timestamp',
+    'DischargeTimestamp',
+    'DeliveryState',
+    'Storage',
+]
+
+class SmsStore:
+    """
+    Keeps the SMS messages of every modem on disk, so they are still
+    listed after a restart.
+
+    Messages live in an SQLite database in WAL mode, one row per MM path,
+    indexed by modem, number and timestamp. Usage:
+
+    store = SmsStore('/var/lib/ofono2mm/sms.db')
+    store.open()
+    store.add('/org/freedesktop/ModemManager1/SMS/1', '/ril_0', sms.props)
+    for path, props in await store.load('/ril_0'):
+        ...
+
+    Once opened, the database is only used from a single worker thread,
+    so writes never block the event loop and are applied in order. A
+    store that can not be opened or written to is disabled, messages
+    are then only kept in memory as before.
+
+    Messages hold private texts and numbers, the directory is created
+    0700 and the database 0600, SQLite gives its -wal and -shm files the
+    mode of the database.
+
+    A message is stored with the props it has when add() is called.
+    Later State or DeliveryState changes are not written back by
+    themselves: add() replaces the stored row and must be called again.
+    Nothing changes them after Added yet.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sms-store')
+        # Highest SMS index found on disk when the store was opened
+        self.max_stored_index = 0
+
+    def open(self):
+        if not self.path:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600))
+            # Stores created before were world-readable
+            for suffix in ['', '-wal', '-shm']:
+                if os.path.exists(self.path + suffix):
+                    os.chmod(self.path + suffix, 0o600)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            with self.db:
+                self.db.execute("CREATE TABLE IF NOT EXISTS messages ("
+                                "path TEXT PRIMARY KEY, "
+                                "modem TEXT NOT NULL, "
+                                "number TEXT NOT NULL, "
+                                "timestamp TEXT NOT NULL, "
+                                "props TEXT NOT NULL)")
+                self.db.execute("CREATE INDEX IF NOT EXISTS messages_modem ON messages (modem)")
+                self.db.execute("CREATE INDEX IF NOT EXISTS messages_number ON messages (number)")
+                self.db.execute("CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp)")
+        except (OSError, sqlite3.Error) as e:
+            Logger.warning("Not keeping SMS messages in %s: %s", self.path, e)
+            self.close_db()
+            return
+
+        self.max_stored_index = self.max_index()
+
+    def close(self):
+        """
+        Waits for the pending writes and closes the database.
+        """
+
+        self.executor.submit(self.close_db)
+        self.executor.shutdown(wait=True)
+
+    def close_db(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def execute(self, query, args=()):
+        if self.db is None:
+            return []
+
+        try:
+            with self.db:
+                return self.db.execute(query, args).fetchall()
+        except sqlite3.Error as e:
+            Logger.warning("SMS store %s failed, disabling it: %s", self.path, e)
+            self.close_db()
+            return []
+
+    async def load(self, modem_name):
+        """
+        The stored messages of a modem as (path, props) pairs, props
+        holding the raw values of STORED_PROPS, in the order they came.
+        """
+
+        return await self.run(self.load_rows, modem_name)
+
+    def load_rows(self, modem_name):
+        messages = []
+        for path, props in self.execute("SELECT path, props FROM messages WHERE modem = ? ORDER BY rowid", (modem_name,)):
+            try:
+                messages.append((path, json.loads(props)))
+            except ValueError as e:
+                Logger.warning("Ignoring stored SMS %s: %s", path, e)
+
+        return messages
+
+    def add(self, path, modem_name, props):
+        # Read the values now, the worker runs later
+        values = {name: getattr(props, name) for name in STORED_PROPS}
+        self.run(self.execute, "INSERT OR REPLACE INTO messages (path, modem, number, timestamp, props) VALUES (?, ?, ?, ?, ?)",
+                 (path, modem_name, values['Number'], values['Timestamp'], json.dumps(values)))
+
+    def delete(self, path):
+        self.run(self.execute, "DELETE FROM messages WHERE path = ?", (path,))
+
+    def max_index(self):
+        """
+        The highest SMS index in use, 0 without messages.
+        """
+
+        rows = self.execute("SELECT MAX(CAST(substr(path, length(rtrim(path, '0123456789')) + 1) AS INTEGER)) FROM messages")
+        if not rows or rows[0][0] is None:
+            return 0
+
+        return rows[0][0]
@@ -0,0 +1,97 @@
+from dbus_next import Variant
+
+from ofono2mm.logger import Logger
+
+import json
+import os
+
+SNAPSHOT_PROPS = {
+    'Modem': [
+        'Manufacturer',
+        'Model',
+        'Revision',
+        'HardwareRevision',
+        'EquipmentIdentifier',
+        'SupportedCapabilities',
+        'CurrentCapabilities',
+        'SupportedModes',
+        'OwnNumbers',
+    ],
+    'Modem3gpp': [
+        'Imei',
+    ],
+    'Sim': [
+        'SimIdentifier',
+        'Imsi',
+        'Eid',
+        'OperatorIdentifier',
+    ],
+}
+
+class ModemSnapshot:
+    """
+    Keeps the last-known static properties of every modem on disk, so
+    they can be handed out to clients at boot before ofono has answered.
+
+    The snapshot is keyed by ofono modem path and interface, e.g.:
+
+    {"/ril_0": {"Modem": {"Model": ["s", "binder"]}, "Sim": {...}}}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.modems = {}
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, "r") as f:
+                self.modems = json.load(f)
+        except (OSError, ValueError) as e:
+            Logger.warning("Ignoring modem snapshot %s: %s", self.path, e)
+            self.modems = {}
+
+    def save(self):
+        if not self.path:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # IMSI, ICCID, IMEI and own numbers are nobody else's business
+            fd = os.open(self.path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.modems, f)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            Logger.warning("Could not write modem snapshot %s: %s", self.path, e)
+
+    def has_modem(self, modem_name):
+        return modem_name in self.modems
+
+    def has_interface(self, modem_name, interface):
+        return bool(self.modems.get(modem_name, {}).get(interface))
+
+    def restore(self, modem_name, interface, props):
+        """
+        Pre-populates the props dict of an MM interface with the values
+        found in the snapshot.
+        """
+
+        for name, (signature, value) in self.modems.get(modem_name, {}).get(interface, {}).items():
+            if name not in SNAPSHOT_PROPS[interface] or name not in props:
+                continue
+
+            try:
+                props[name] = Variant(signature, value)
+            except Exception as e:
+                Logger.warning("Ignoring snapshot value %s of %s: %s", name, modem_name, e)
+
+    def record(self, modem_name, interface, props):
+        self.modems.setdefault(modem_name, {})[interface] = {
+            name: [props[name].signature, props[name].value]
+            for name in SNAPSHOT_PROPS[interface]
+            if name in props
+        }
@@ -1,4 +1,15 @@
+from dbus_next import DBusError
+
+from ofono2mm.logger import Logger
+
 import asyncio
+import contextvars
+import functools
+
+# Loop time by which the MM method being handled must have answered
+call_deadline = contextvars.ContextVar('call_deadline', default=None)
+
+TIMEOUT_ERROR = 'org.freedesktop.ModemManager1.Error.Core.Timeout'
 
 def async_retryable(times=0):
     """
@@ -10,7 +21,9 @@ def async_retryable(times=0):
     async def fail():
         raise Exception("This function will be tried five times!")
 
-    If times is 0 (default), the function will be retried indefinitely.
+    If times is 0 (default), the function will be retried indefinitely,
+    or until the deadline of the MM method being handled has passed, see
+    async_deadline.
     """
 
     def decorator(func):
@@ -20,7 +33,7 @@ def async_retryable(times=0):
                             try:
                                     result = await func(*args, **kwargs)
                             except Exception as e:
-                                    if current_try == times-1:
+                                    if current_try == times-1 or deadline_remaining() == 0:
                                             raise
 
                                     # print("Trying again, error was %s" % e)
@@ -34,6 +47,48 @@ def async_retryable(times=0):
 
     return decorator
 
+def async_deadline(seconds):
+    """
+    Decorator bounding the time an MM method handler may take, including
+    the ofono calls it makes: once the deadline has passed, the pending
+    ofono call is cancelled and fails with a Timeout DBusError.
+
+    Usage:
+
+    @method()
+    @async_deadline(60)
+    async def Register(self, operator_id: 's'):
+        ...
+
+    An enclosing deadline that is closer is kept.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            deadline = asyncio.get_running_loop().time() + seconds
+            current = call_deadline.get()
+            token = call_deadline.set(deadline if current is None else min(current, deadline))
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                call_deadline.reset(token)
+
+        return wrapper
+
+    return decorator
+
+def deadline_remaining():
+    """
+    Seconds left before the current deadline, None without a deadline.
+    """
+
+    deadline = call_deadline.get()
+    if deadline is None:
+        return None
+
+    return max(0, deadline - asyncio.get_running_loop().time())
+
 def async_locked(func):
     async def wrapper(*args, **kwargs):
         async with func.__lock:
@@ -41,3 +96,153 @@ def async_locked(func):
 
     func.__lock = asyncio.Lock()
     return wrapper
+
+class OperationQueue:
+    """
+    Serializes the operations of one modem that must not interleave.
+
+    Usage:
+
+    operations = OperationQueue()
+    await operations.run('power', ('Enable', True), self.do_enable, True)
+
+    Operations sharing a key run one after another, in the order they
+    were requested; different keys don't wait for each other. A request
+    equal to one still waiting on the same key is merged into it: both
+    callers get the result of a single run. Once an operation started,
+    an equal request queues behind it as the state may have changed.
+    """
+
+    def __init__(self):
+        self.locks = {}
+        self.waiting = {}
+        self.depth = {}
+        self.operations = {}
+        self.merged = {}
+        self.wait_time = {}
+        self.max_wait_time = {}
+
+    async def run(self, key, request, func, *args):
+        waiting = self.waiting.setdefault(key, {})
+        task = waiting.get(request)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self.execute(key, request, func, *args))
+            waiting[request] = task
+        else:
+            self.merged[key] = self.merged.get(key, 0) + 1
+            Logger.debug("Operation %s %s merged into a pending one", key, request)
+
+        # A caller going away must not cancel the run others wait for
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), deadline_remaining())
+        except asyncio.TimeoutError:
+            raise DBusError(TIMEOUT_ERROR, f'Timed out waiting for {key} operation {request[0]}')
+
+    async def execute(self, key, request, func, *args):
+        loop = asyncio.get_running_loop()
+        queued = loop.time()
+        self.depth[key] = self.depth.get(key, 0) + 1
+
+        try:
+            async with self.locks.setdefault(key, asyncio.Lock()):
+                if self.waiting[key].get(request) is asyncio.current_task():
+                    self.waiting[key].pop(request)
+
+                waited = loop.time() - queued
+                self.operations[key] = self.operations.get(key, 0) + 1
+                self.wait_time[key] = self.wait_time.get(key, 0) + waited
+                self.max_wait_time[key] = max(self.max_wait_time.get(key, 0), waited)
+                if waited > 1:
+                    Logger.debug("Operation %s %s waited %.1f s, %d queued", key, request, waited, self.depth[key] - 1)
+
+                return await func(*args)
+        finally:
+            self.depth[key] -= 1
+
+    @staticmethod
+    def variants_key(variants):
+        """
+        A hashable request for a dict of Variants, e.g. bearer properties.
+        """
+
+        return tuple(sorted((name, repr(variant.value)) for name, variant in variants.items()))
+
+    def queue_depth(self, key):
+        return self.depth.get(key, 0)
+
+    def log_stats(self, name):
+        for key in sorted(self.operations):
+            Logger.debug("Operations %s %s: %d run, %d merged, %.1f ms average wait, %.1f ms max wait",
+                         name, key, self.operations[key], self.merged.get(key, 0),
+                         self.wait_time[key] / self.operations[key] * 1000, self.max_wait_time[key] * 1000)
+
+async def async_run_steps(steps):
+    """
+    Runs a set of initialisation steps concurrently, only ordering the
+    ones that depend on each other.
+
+    Usage:
+
+    timings = await async_run_steps({
+        'sim': (init_sim, []),
+        '3gpp': (init_3gpp, ['sim']),
+        'voice': (init_voice, []),
+    })
+
+    Every step is a coroutine function started as soon as all of its
+    dependencies have finished. Returns a dict mapping each step name to
+    the time in seconds the step itself took to run.
+
+    The first step to fail cancels the others, once they are done its
+    exception is raised. Unknown or cyclic dependencies raise ValueError
+    before anything runs.
+    """
+
+    loop = asyncio.get_running_loop()
+    tasks = {}
+    timings = {}
+
+    async def run_step(name, func, depends):
+        await asyncio.gather(*[tasks[dep] for dep in depends])
+        start = loop.time()
+        try:
+            return await func()
+        finally:
+            timings[name] = loop.time() - start
+
+    for name, (func, depends) in steps.items():
+        for dep in depends:
+            if dep not in steps:
+                raise ValueError(f"Step {name} depends on unknown step {dep}")
+
+    # Depth-first search, a step met again while its dependencies are
+    # still being visited closes a cycle
+    visited = {}
+
+    def visit(name, path):
+        if visited.get(name) == 'done':
+            return
+        if visited.get(name) == 'visiting':
+            cycle = path[path.index(name):] + [name]
+            raise ValueError(f"Steps depend on each other: {' -> '.join(cycle)}")
+
+        visited[name] = 'visiting'
+        for dep in steps[name][1]:
+            visit(dep, path + [name])
+        visited[name] = 'done'
+
+    for name in steps:
+        visit(name, [])
+
+    for name, (func, depends) in steps.items():
+        tasks[name] = loop.create_task(run_step(name, func, depends))
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+
+    return timings
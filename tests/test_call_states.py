@@ -0,0 +1,18 @@
+from benchmarks.call_state_replay import SEQUENCES, replay
+
+from ofono2mm.mm_types import ModemManagerCallState, ModemManagerCallStateReason, \
+                              OFONO_CALL_STATES, ofono_call_transition
+
+import pytest
+
+@pytest.mark.parametrize('name', list(SEQUENCES))
+def test_replay(name):
+    replay(name)
+
+def test_every_ofono_state_is_mapped():
+    for ofono_state in ['dialing', 'alerting', 'incoming', 'waiting', 'active', 'held', 'disconnected']:
+        assert ofono_state in OFONO_CALL_STATES
+
+def test_unknown_ofono_state_keeps_the_call_state():
+    assert ofono_call_transition(ModemManagerCallState.ACTIVE, 'bogus') == \
+        (ModemManagerCallState.ACTIVE, ModemManagerCallStateReason.UNKNOWN)
@@ -0,0 +1,108 @@
+from dbus_next import DBusError
+
+from ofono2mm.dtmf import DtmfQueue
+
+import asyncio
+
+TONE = 0.01
+PAUSE = 0.005
+
+class FakeVoiceCallManager:
+    """
+    Records every SendTones call with its loop time, refusing the first
+    busy_calls of them with InProgress.
+    """
+
+    def __init__(self, busy_calls=0):
+        self.busy_calls = busy_calls
+        self.sent = []
+        self.refused = 0
+
+    async def call_send_tones(self, tones):
+        if self.refused < self.busy_calls:
+            self.refused += 1
+            raise DBusError('org.ofono.Error.InProgress', 'Operation already in progress')
+
+        self.sent.append((tones, asyncio.get_running_loop().time()))
+
+def test_digits_are_batched_and_paced():
+    manager = FakeVoiceCallManager()
+    progress = []
+
+    async def run():
+        dtmf = DtmfQueue(manager.call_send_tones, TONE, PAUSE, lambda sent, queued: progress.append((sent, queued)))
+        first = dtmf.send('1')
+        await asyncio.sleep(0)
+        # Queued while '1' is being played, they go out together
+        rest = [dtmf.send(digit) for digit in '234']
+        await asyncio.gather(first, *rest)
+
+    asyncio.run(run())
+
+    assert [tones for tones, _ in manager.sent] == ['1', '234']
+    # The second batch waited for the first tone and its pause
+    assert manager.sent[1][1] - manager.sent[0][1] >= TONE + PAUSE - 0.001
+    assert progress == [(1, 1), (4, 4)]
+
+def test_batches_are_limited():
+    manager = FakeVoiceCallManager()
+
+    async def run():
+        dtmf = DtmfQueue(manager.call_send_tones, 0, 0)
+        dtmf.MAX_BATCH = 4
+        await asyncio.gather(*[dtmf.send(digits) for digits in ['12', '34', '56', '7890123']])
+
+    asyncio.run(run())
+
+    assert [tones for tones, _ in manager.sent] == ['1234', '56', '7890123']
+
+def test_busy_ofono_does_not_drop_digits():
+    manager = FakeVoiceCallManager(busy_calls=1)
+
+    async def run():
+        dtmf = DtmfQueue(manager.call_send_tones, TONE, PAUSE)
+        await dtmf.send('123')
+
+    asyncio.run(run())
+
+    assert manager.refused == 1
+    assert [tones for tones, _ in manager.sent] == ['123']
+
+def test_other_errors_fail_the_caller():
+    async def send_tones(tones):
+        raise DBusError('org.ofono.Error.InvalidFormat', 'Invalid format')
+
+    async def run():
+        dtmf = DtmfQueue(send_tones, 0, 0)
+        try:
+            await dtmf.send('x')
+        except DBusError as e:
+            return e.type
+
+    assert asyncio.run(run()) == 'org.ofono.Error.InvalidFormat'
+
+def test_calls_emit_dtmf_progress():
+    from ofono2mm.mm_call import MMCallInterface
+
+    class FakeOfonoClient:
+        def __getitem__(self, key):
+            return self
+
+    manager = FakeVoiceCallManager()
+    progress = []
+
+    async def run():
+        mm_call_interface = MMCallInterface(0, None, FakeOfonoClient(), '/ril_0', None, {},
+                                            {'org.ofono.VoiceCallManager': manager}, {})
+        mm_call_interface.dtmf.tone_duration = TONE
+        mm_call_interface.dtmf.pause_duration = PAUSE
+        assert mm_call_interface.dtmf.progress == mm_call_interface.DtmfProgress
+        # Unexported, the signal would go nowhere
+        mm_call_interface.dtmf.progress = lambda sent, queued: progress.append((sent, queued))
+        mm_call_interface.DtmfProgress(0, 0)
+        await mm_call_interface.SendDtmf.__wrapped__(mm_call_interface, '12')
+
+    asyncio.run(run())
+
+    assert [tones for tones, _ in manager.sent] == ['12']
+    assert progress == [(2, 2)]